@@ -0,0 +1,51 @@
+"""
+Benchmarks of the acquisition hot paths, runnable without hardware:
+
+    uv run python -m benchmarks
+    uv run python -m benchmarks --cases trigger websocket --rates 100 2000 --channels 3 6
+"""
+from argparse import ArgumentParser
+from dataclasses import asdict
+import json
+import logging
+import warnings
+
+from .cases import CASES, run_cases
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the rpi-seism acquisition hot paths.")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--rates", nargs="+", type=int, default=[100, 250, 500, 1000, 2000],
+                        help="sampling rates in Hz")
+    parser.add_argument("--channels", nargs="+", type=int, default=[3],
+                        help="channel counts")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # Checksum failures of the noisy streams would flood the output
+    logging.basicConfig(level=logging.ERROR)
+    # No GPIO off the Pi, the Reader falls back to the mock pin factory
+    warnings.filterwarnings("ignore", module="gpiozero")
+
+    header = f"{'benchmark':<44} {'rate':>6} {'ch':>3} {'ops/s':>12} {'us/sample':>10} {'x realtime':>11} {'peak KiB':>10}"
+    print(header)
+    print("-" * len(header))
+
+    results = []
+    for result in run_cases(args.cases, args.rates, args.channels):
+        results.append(result)
+        print(
+            f"{result.name:<44} {result.sampling_rate:>6} {result.n_channels:>3} "
+            f"{result.ops_per_sec:>12.1f} {result.us_per_sample:>10.3f} "
+            f"{result.realtime_factor:>11.1f} {result.peak_memory_kib:>10.1f}",
+            flush=True
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="UTF-8") as json_file:
+            json.dump([dict(asdict(r), realtime_factor=r.realtime_factor) for r in results], json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
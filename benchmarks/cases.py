@@ -0,0 +1,181 @@
+from pathlib import Path
+from queue import Queue
+from tempfile import TemporaryDirectory
+from threading import Event
+import asyncio
+
+import numpy as np
+
+from src.jobs import MSeedWriter, NotifierSender, Reader, TriggerProcessor, WebSocketSender
+from src.structs.sample import Sample
+from src.structs.sample_block import SampleBlock
+from src.utils.event_bus import EventBus
+from src.utils.event_catalog import EventCatalog
+
+from .common import Result, make_block_stream, make_byte_stream, make_packets, make_settings, make_signal, measure
+
+
+def bench_sample(rate: int, n_channels: int, workdir: Path) -> list[Result]:
+    """Decoding of one second of frames: Sample.from_bytes and SampleBlock.decode_stream."""
+    results = []
+
+    # The legacy frame carries exactly 3 channels
+    if n_channels == 3:
+        stream = make_byte_stream(rate)
+        frames = [stream[i:i + Sample.PACKET_SIZE] for i in range(0, len(stream), Sample.PACKET_SIZE)]
+
+        def decode():
+            for frame in frames:
+                Sample.from_bytes(frame)
+
+        results.append(measure("Sample.from_bytes", decode, len(frames), rate, n_channels, ops_per_call=len(frames)))
+
+    settings = make_settings(rate, n_channels)
+    samples_per_frame = settings.mcu.samples_per_frame
+    block_stream = make_block_stream(rate, n_channels, samples_per_frame)
+
+    def decode_blocks():
+        SampleBlock.decode_stream(bytearray(block_stream), n_channels, samples_per_frame)
+
+    results.append(measure(f"SampleBlock.decode_stream (K={samples_per_frame})", decode_blocks, rate, rate, n_channels))
+
+    return results
+
+
+def bench_reader(rate: int, n_channels: int, workdir: Path) -> list[Result]:
+    """Reader framing loop over one second of clean and noisy serial bytes, for both frame versions."""
+    settings = make_settings(rate, n_channels)
+    queue = Queue()
+    reader = Reader("bench", settings, [queue], Event())
+
+    results = []
+    for label, noisy in (("clean", False), ("noisy", True)):
+        # The legacy frame carries exactly 3 channels
+        if n_channels == 3:
+            stream = make_byte_stream(rate, noisy=noisy)
+
+            def frame():
+                reader._process_buffer(bytearray(stream))
+
+            results.append(measure(
+                f"Reader._process_buffer ({label})", frame, rate, rate, n_channels,
+                setup=queue.queue.clear
+            ))
+
+        block_stream = make_block_stream(rate, n_channels, settings.mcu.samples_per_frame, noisy=noisy)
+
+        def blocks():
+            reader._next_sequence = None
+            reader._process_blocks(bytearray(block_stream))
+
+        results.append(measure(
+            f"Reader._process_blocks ({label})", blocks, rate, rate, n_channels,
+            setup=queue.queue.clear
+        ))
+
+    return results
+
+
+def bench_trigger(rate: int, n_channels: int, workdir: Path) -> list[Result]:
+    """STA/LTA update of one second of samples, run by the trigger for every sample."""
+    settings = make_settings(rate, n_channels)
+    trigger = TriggerProcessor(
+        settings, Queue(), Event(), EventBus(), EventCatalog(workdir / "bench_events.sqlite")
+    )
+    state = trigger.streams[settings.stream_id]
+
+    # Only the detector is measured, no event is opened in the catalog
+    state.thr_on = float("inf")
+    packets = make_packets(settings, rate)
+
+    def process():
+        for packet in packets:
+            trigger._process_packet(state, packet)
+
+    return [measure("TriggerProcessor._process_packet", process, rate, rate, n_channels)]
+
+
+def bench_websocket(rate: int, n_channels: int, workdir: Path) -> list[Result]:
+    """Decimation and broadcast of every channel, run once per second of data."""
+    settings = make_settings(rate, n_channels)
+    sender = WebSocketSender(settings, Queue(), Event(), EventBus())
+
+    window_size = rate * 5
+    values = make_signal(window_size, n_channels)
+    times = 1.7e9 + np.arange(window_size) / rate
+
+    for c, ch in enumerate(settings.channels):
+        sender.channels_state[(settings.stream_id, ch.name)] = {
+            "data": list(values[:, c].astype(float)),
+            "time": list(times),
+            "counter": window_size
+        }
+
+    loop = asyncio.new_event_loop()
+
+    async def process_all():
+        for ch in settings.channels:
+            await sender._process_and_broadcast(settings, ch.name)
+
+    def process():
+        loop.run_until_complete(process_all())
+
+    try:
+        return [measure("WebSocketSender._process_and_broadcast", process, rate, rate, n_channels)]
+    finally:
+        loop.close()
+
+
+def bench_mseed(rate: int, n_channels: int, workdir: Path) -> list[Result]:
+    """MiniSEED write of one minute of data."""
+    settings = make_settings(rate, n_channels)
+    writer = MSeedWriter(
+        settings, Queue(), workdir / "mseed", Event(), EventBus(),
+        EventCatalog(workdir / "bench_events.sqlite")
+    )
+
+    count = rate * 60
+    values = make_signal(count, n_channels)
+
+    state = writer.streams[settings.stream_id]
+
+    def fill():
+        state.start_time = 1.7e9
+        state.buffer = {ch.name: values[:, c].tolist() for c, ch in enumerate(settings.channels)}
+
+    return [measure("MSeedWriter._write_mseed", writer._write_mseed, count, rate, n_channels, setup=fill)]
+
+
+def bench_notifier(rate: int, n_channels: int, workdir: Path) -> list[Result]:
+    """Plotly graph of a 120 s event window."""
+    settings = make_settings(rate, n_channels)
+    notifier = NotifierSender(settings, Queue(), Event(), EventBus())
+    window = notifier.streams[settings.stream_id]
+
+    count = rate * 120
+    values = make_signal(count, n_channels)
+    timestamps = 1.7e9 + np.arange(count) / rate
+
+    def graph():
+        notifier._generate_plotly_graph(window, timestamps, values)
+
+    return [measure("NotifierSender._generate_plotly_graph", graph, count, rate, n_channels, min_time=0)]
+
+
+CASES = {
+    "sample": bench_sample,
+    "reader": bench_reader,
+    "trigger": bench_trigger,
+    "websocket": bench_websocket,
+    "mseed": bench_mseed,
+    "notifier": bench_notifier,
+}
+
+
+def run_cases(names: list[str], rates: list[int], channels: list[int]):
+    """Run the selected cases for every sampling rate and channel count."""
+    with TemporaryDirectory() as temp_dir:
+        for name in names:
+            for n_channels in channels:
+                for rate in rates:
+                    yield from CASES[name](rate, n_channels, Path(temp_dir))
@@ -0,0 +1,208 @@
+from dataclasses import dataclass
+from typing import Callable
+import time
+import tracemalloc
+
+import numpy as np
+
+from src.settings import Settings
+from src.settings.mcu_settings import SPS_MAPPING, MCUSettings
+from src.structs.sample import Sample
+from src.structs.sample_block import SampleBlock
+
+
+ORIENTATIONS = ["vertical", "north", "east"]
+CHANNEL_NAMES = ["EHZ", "EHN", "EHE"]
+
+
+@dataclass
+class Result:
+    name: str
+    sampling_rate: int
+    n_channels: int
+    ops_per_sec: float
+    us_per_sample: float
+    peak_memory_kib: float
+
+    @property
+    def realtime_factor(self) -> float:
+        """How many times real time the measured code can sustain."""
+        return 1e6 / (self.us_per_sample * self.sampling_rate)
+
+
+def make_settings(sampling_rate: int, n_channels: int, samples_per_frame: int = 10) -> Settings:
+    """
+    Default settings with the given sampling rate and number of channels (version 2
+    frames). The MCU settings are not validated: the consumers are also benchmarked
+    beyond what the serial line can carry.
+    """
+    settings = Settings.get_default_settings()
+
+    # Slowest ADC data rate that respects the MCU timing margin (13x rule, 3.3x per channel)
+    adc_sample_rate = next(
+        (rate for rate, sps in sorted(SPS_MAPPING.items(), key=lambda x: x[1])
+         if sps >= sampling_rate * max(13, 3.3 * n_channels)),
+        max(SPS_MAPPING, key=SPS_MAPPING.get)
+    )
+
+    data = settings.model_dump()
+    # Validated with a slow rate, replaced below
+    data["mcu"]["sampling_rate"] = 1
+    data["mcu"]["n_channels"] = n_channels
+    data["channels"] = [
+        {
+            "name": CHANNEL_NAMES[i] if i < len(CHANNEL_NAMES) else f"EH{i}",
+            "adc_channel": i,
+            "orientation": ORIENTATIONS[i % len(ORIENTATIONS)]
+        }
+        for i in range(n_channels)
+    ]
+
+    settings = Settings(**data)
+    settings.mcu = MCUSettings.model_construct(
+        sampling_rate=sampling_rate,
+        adc_gain=settings.mcu.adc_gain,
+        adc_sample_rate=adc_sample_rate,
+        frame_version=2,
+        n_channels=n_channels,
+        samples_per_frame=samples_per_frame
+    )
+
+    return settings
+
+
+def make_signal(count: int, n_channels: int, seed: int = 0) -> np.ndarray:
+    """Background noise with a burst in the middle, shape (count, n_channels)."""
+    rng = np.random.default_rng(seed)
+    data = rng.normal(0, 1000, (count, n_channels))
+    data[count // 2:count // 2 + count // 10] *= 20
+
+    return data.astype(np.int32)
+
+
+def make_packets(settings: Settings, count: int, start_time: float = 1.7e9) -> list[dict]:
+    """Packets as produced by the Reader."""
+    rate = settings.mcu.sampling_rate
+    values = make_signal(count, len(settings.channels))
+
+    return [
+        {
+            "stream": settings.stream_id,
+            "index": i,
+            "timestamp": start_time + i / rate,
+            "measurements": [
+                {"channel": ch, "value": int(values[i, c])}
+                for c, ch in enumerate(settings.channels)
+            ]
+        }
+        for i in range(count)
+    ]
+
+
+def make_frame(ch0: int, ch1: int, ch2: int) -> bytes:
+    """Serialize a Sample frame with a valid checksum."""
+    frame = bytearray(Sample(0xAA, 0xBB, ch0, ch1, ch2, 0).to_bytes())
+
+    checksum = 0
+    for b in frame[:-1]:
+        checksum ^= b
+    frame[-1] = checksum
+
+    return bytes(frame)
+
+
+def make_byte_stream(count: int, noisy: bool = False, seed: int = 0) -> bytes:
+    """
+    Serial byte stream of `count` frames. A noisy stream has garbage bytes between
+    5% of the frames and a corrupted checksum on 1% of them.
+    """
+    rng = np.random.default_rng(seed)
+    values = make_signal(count, 3, seed)
+    stream = bytearray()
+
+    for i in range(count):
+        frame = bytearray(make_frame(*(int(v) for v in values[i])))
+
+        if noisy:
+            if rng.random() < 0.05:
+                stream.extend(rng.integers(0, 256, rng.integers(1, 9), dtype=np.uint8).tobytes())
+            if rng.random() < 0.01:
+                frame[-1] ^= 0xFF
+
+        stream.extend(frame)
+
+    return bytes(stream)
+
+
+def make_block_stream(count: int, n_channels: int, samples_per_frame: int, noisy: bool = False, seed: int = 0) -> bytes:
+    """
+    Serial byte stream of `count` samples in SampleBlock frames. A noisy stream has
+    garbage bytes before 5% of the frames and a corrupted CRC on 1% of them.
+    """
+    rng = np.random.default_rng(seed)
+    values = make_signal(count - count % samples_per_frame, n_channels, seed)
+    stream = bytearray()
+
+    for sequence, block in enumerate(values.reshape(-1, samples_per_frame, n_channels)):
+        frame = bytearray(SampleBlock(sequence, block).to_bytes())
+
+        if noisy:
+            if rng.random() < 0.05:
+                stream.extend(rng.integers(0, 256, rng.integers(1, 9), dtype=np.uint8).tobytes())
+            if rng.random() < 0.01:
+                frame[-1] ^= 0xFF
+
+        stream.extend(frame)
+
+    return bytes(stream)
+
+
+def measure(
+    name: str,
+    func: Callable[[], object],
+    samples_per_call: int,
+    sampling_rate: int,
+    n_channels: int,
+    min_time: float = 0.5,
+    setup: Callable[[], object] | None = None,
+    ops_per_call: int = 1
+) -> Result:
+    """
+    Time `func` (calling `setup` before every call, outside of the timing) for at
+    least `min_time` seconds, then measure its peak memory with tracemalloc on a
+    separate call, so that tracing doesn't affect the timing. `ops_per_call` is the
+    number of benchmarked operations a call performs, when it loops over them.
+    """
+    if setup is not None:
+        setup()
+    func()  # warm up (lazy imports, caches)
+
+    calls = 0
+    elapsed = 0.0
+    while calls == 0 or elapsed < min_time:
+        if setup is not None:
+            setup()
+
+        started = time.perf_counter()
+        func()
+        elapsed += time.perf_counter() - started
+        calls += 1
+
+    if setup is not None:
+        setup()
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Result(
+        name=name,
+        sampling_rate=sampling_rate,
+        n_channels=n_channels,
+        ops_per_sec=calls * ops_per_call / elapsed,
+        us_per_sample=elapsed / calls / samples_per_call * 1e6,
+        peak_memory_kib=peak / 1024
+    )
@@ -0,0 +1,326 @@
+"""
+Emulator of the acquisition MCU on a pseudo-terminal, to run the whole pipeline without
+hardware. It answers the settings handshake, streams Sample (version 1) or SampleBlock
+(version 2) frames while heartbeats arrive and can inject line noise, dropped bytes and
+bad checksums:
+
+    uv run python -m benchmarks.mcu_emulator --rate 500 --garbage 0.01 --bad-checksum 0.001
+    uv run python -m src.main --port /dev/pts/N    # the path printed by the emulator
+"""
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from logging import getLogger
+import logging
+import os
+import time
+import tty
+
+import numpy as np
+
+from src.structs.mcu_settings import MCUSettingsFrame
+from src.structs.sample_block import SampleBlock
+
+from .common import make_frame
+
+logger = getLogger(__name__)
+
+# A legacy settings frame is followed by the next command within this time
+SETTINGS_FRAME_TIMEOUT = 0.05
+
+
+@dataclass
+class EmulatorStats:
+    frames: int = 0
+    samples: int = 0
+    bytes: int = 0
+    garbage_bytes: int = 0
+    dropped_bytes: int = 0
+    bad_checksums: int = 0
+    # Bytes lost because the reader did not empty the pty in time (UART overrun)
+    overrun_bytes: int = 0
+    handshakes: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+
+class MCUEmulator:
+    """
+    Pseudo-terminal speaking the MCU protocol of the Reader:
+
+    - a settings frame (0xCC 0xDD ...) is echoed back and sets the sampling rate (unless
+      a fixed `rate` was given) and the frame format. With `legacy_firmware` only the
+      first 6 bytes are understood and echoed, like the firmware without version 2;
+    - frames are only streamed while a heartbeat byte (0x01) arrived in the last
+      `heartbeat_timeout` seconds, like the firmware does;
+    - every channel carries a sine wave plus gaussian noise of `noise` counts.
+
+    Writes never block: when the reader falls behind, the bytes that don't fit in the
+    pty are lost and counted as overruns, like on a real UART.
+    """
+    def __init__(
+        self,
+        rate: int | None = None,
+        amplitude: float = 20000,
+        noise: float = 1000,
+        garbage: float = 0.0,
+        drop: float = 0.0,
+        bad_checksum: float = 0.0,
+        heartbeat_timeout: float = 1.0,
+        legacy_firmware: bool = False,
+        seed: int = 0
+    ):
+        self.fixed_rate = rate
+        self.rate = rate
+        self.amplitude = amplitude
+        self.noise = noise
+        self.garbage = garbage
+        self.drop = drop
+        self.bad_checksum = bad_checksum
+        self.heartbeat_timeout = heartbeat_timeout
+        self.legacy_firmware = legacy_firmware
+
+        # Negotiated frame format
+        self.frame_version = 1
+        self.n_channels = 3
+        self.samples_per_frame = 1
+        self.sequence = 0
+
+        self.rng = np.random.default_rng(seed)
+        self.stats = EmulatorStats()
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+
+        self._received = bytearray()
+        self._settings_since = None
+        self._last_heartbeat = None
+        # Sample clock, restarted when the stream (re)starts
+        self._stream_start = None
+        self._sample_count = 0
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self, duration: float | None = None, stats_interval: float = 5.0):
+        logger.info("MCU emulator listening on %s", self.port)
+        stop_at = time.monotonic() + duration if duration else None
+        next_stats = time.monotonic() + stats_interval
+
+        while stop_at is None or time.monotonic() < stop_at:
+            self.poll()
+
+            if time.monotonic() >= next_stats:
+                self.log_stats()
+                next_stats += stats_interval
+
+            time.sleep(0.001)
+
+    def poll(self):
+        """Handles the received bytes and sends the frames due since the last call."""
+        self._read_commands()
+
+        now = time.monotonic()
+        streaming = (
+            self.rate
+            and self._last_heartbeat is not None
+            and now - self._last_heartbeat < self.heartbeat_timeout
+        )
+
+        if not streaming:
+            self._stream_start = None
+            return
+
+        if self._stream_start is None:
+            self._stream_start = now
+            self._sample_count = 0
+
+        due = int((now - self._stream_start) * self.rate) - self._sample_count
+        # Only whole frames are sent
+        due -= due % self.samples_per_frame
+        if due > 0:
+            self._write(self._frames(due))
+
+    def log_stats(self):
+        s = self.stats
+        elapsed = time.monotonic() - s.started
+        logger.info(
+            "%d frames, %d samples (%.1f/s), %d bytes, %d garbage, %d dropped, %d bad checksums, "
+            "%d overrun, %d handshakes",
+            s.frames, s.samples, s.samples / elapsed, s.bytes, s.garbage_bytes, s.dropped_bytes,
+            s.bad_checksums, s.overrun_bytes, s.handshakes
+        )
+
+    def _read_commands(self):
+        try:
+            data = os.read(self.master, 4096)
+        except BlockingIOError:
+            data = b""
+        self._received.extend(data)
+
+        while self._received:
+            if self._received[0] == 0x01:
+                self._last_heartbeat = time.monotonic()
+                del self._received[0]
+            elif self._received[0] == 0xCC:
+                size = self._settings_frame_size()
+                if size is None:
+                    return
+                self._handshake(bytes(self._received[:size]))
+                del self._received[:size]
+            else:
+                del self._received[0]
+
+    def _settings_frame_size(self) -> int | None:
+        """Length of the settings frame at the start of the received bytes, None if incomplete."""
+        legacy_size = MCUSettingsFrame.PACKET_SIZE
+        extended_size = legacy_size + 3
+
+        if self.legacy_firmware:
+            return legacy_size if len(self._received) >= legacy_size else None
+
+        if self._settings_since is None:
+            self._settings_since = time.monotonic()
+
+        if len(self._received) > legacy_size and self._received[legacy_size] != SampleBlock.VERSION:
+            # Followed by another command, not by a frame version
+            size = legacy_size
+        elif len(self._received) >= extended_size:
+            size = extended_size
+        elif len(self._received) == legacy_size and time.monotonic() - self._settings_since > SETTINGS_FRAME_TIMEOUT:
+            size = legacy_size
+        else:
+            return None
+
+        self._settings_since = None
+        return size
+
+    def _handshake(self, frame: bytes):
+        settings, _ = MCUSettingsFrame.from_bytes(frame[:MCUSettingsFrame.PACKET_SIZE])
+        if settings.header_2 != 0xDD:
+            return
+
+        if len(frame) > MCUSettingsFrame.PACKET_SIZE:
+            self.frame_version, self.n_channels, self.samples_per_frame = frame[MCUSettingsFrame.PACKET_SIZE:]
+        else:
+            self.frame_version, self.n_channels, self.samples_per_frame = 1, 3, 1
+
+        if self.fixed_rate is None:
+            self.rate = settings.sampling_speed
+
+        self.stats.handshakes += 1
+        logger.info(
+            "Settings received: %d Hz, gain %d, data rate %d, frame version %d with %d channels and "
+            "%d samples per frame (streaming at %d Hz)",
+            settings.sampling_speed, settings.adc_gain, settings.adc_data_rate, self.frame_version, self.n_channels,
+            self.samples_per_frame, self.rate
+        )
+
+        # The firmware restarts streaming after a new configuration
+        self._stream_start = None
+        self.sequence = 0
+        # Echo, the reader compares it with what it sent
+        self._write(frame)
+        # The settings frame counts as the first heartbeat
+        self._last_heartbeat = time.monotonic()
+
+    def _signal(self, count: int) -> np.ndarray:
+        t = (self._sample_count + np.arange(count)) / self.rate
+        phases = 2 * np.pi * np.arange(self.n_channels) / self.n_channels
+        values = (
+            self.amplitude * np.sin(2 * np.pi * 1.0 * t[:, None] + phases)
+            + self.rng.normal(0, self.noise, (count, self.n_channels))
+        ).astype(np.int32)
+        self._sample_count += count
+
+        return values
+
+    def _frames(self, count: int) -> bytes:
+        values = self._signal(count)
+
+        if self.frame_version == 1:
+            frames = [make_frame(*row) for row in values.tolist()]
+        else:
+            frames = []
+            for block in values.reshape(-1, self.samples_per_frame, self.n_channels):
+                frames.append(SampleBlock(self.sequence, block).to_bytes())
+                self.sequence = (self.sequence + 1) % 65536
+
+        stream = bytearray()
+        for frame in frames:
+            frame = bytearray(frame)
+
+            if self.garbage and self.rng.random() < self.garbage:
+                noise = self.rng.integers(0, 256, self.rng.integers(1, 9), dtype=np.uint8).tobytes()
+                stream.extend(noise)
+                self.stats.garbage_bytes += len(noise)
+            if self.bad_checksum and self.rng.random() < self.bad_checksum:
+                frame[-1] ^= 0xFF
+                self.stats.bad_checksums += 1
+            if self.drop and self.rng.random() < self.drop:
+                del frame[self.rng.integers(0, len(frame))]
+                self.stats.dropped_bytes += 1
+
+            stream.extend(frame)
+
+        self.stats.frames += len(frames)
+        self.stats.samples += count
+        return bytes(stream)
+
+    def _write(self, data: bytes):
+        try:
+            written = os.write(self.master, data)
+        except BlockingIOError:
+            written = 0
+
+        self.stats.bytes += written
+        self.stats.overrun_bytes += len(data) - written
+
+
+def main():
+    parser = ArgumentParser(description="Emulate the rpi-seism MCU on a pseudo-terminal.")
+    parser.add_argument("--rate", type=int,
+                        help="sampling rate in Hz (default: the one sent by the reader)")
+    parser.add_argument("--amplitude", type=float, default=20000, help="sine amplitude in counts")
+    parser.add_argument("--noise", type=float, default=1000, help="gaussian noise in counts")
+    parser.add_argument("--garbage", type=float, default=0.0,
+                        help="probability of garbage bytes before a frame")
+    parser.add_argument("--drop", type=float, default=0.0,
+                        help="probability of dropping a byte of a frame")
+    parser.add_argument("--bad-checksum", type=float, default=0.0,
+                        help="probability of corrupting the checksum of a frame")
+    parser.add_argument("--legacy-firmware", action="store_true",
+                        help="only support the version 1 frames")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--stats-interval", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    emulator = MCUEmulator(
+        rate=args.rate,
+        amplitude=args.amplitude,
+        noise=args.noise,
+        garbage=args.garbage,
+        drop=args.drop,
+        bad_checksum=args.bad_checksum,
+        legacy_firmware=args.legacy_firmware,
+        seed=args.seed
+    )
+    # Printed on its own line so scripts can read it
+    print(emulator.port, flush=True)
+
+    try:
+        emulator.run(args.duration, args.stats_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.log_stats()
+        emulator.close()
+
+
+if __name__ == "__main__":
+    main()
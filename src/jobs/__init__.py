@@ -1,5 +1,27 @@
-from .msed_writer import MSeedWriter
-from .reader import Reader
-from .websocket_sender import WebSocketSender
-from .trigger_processor import TriggerProcessor
-from .notifier_sender import NotifierSender
\ No newline at end of file
+from importlib import import_module
+
+
+# Jobs are imported on first access, so importing one job doesn't load the
+# (heavy) dependencies of all the others
+_JOBS = {
+    "MSeedWriter": ".msed_writer",
+    "DataSource": ".data_source",
+    "Reader": ".reader",
+    "MSeedReplay": ".mseed_replay",
+    "WebSocketSender": ".websocket_sender",
+    "TriggerProcessor": ".trigger_processor",
+    "NotifierSender": ".notifier_sender",
+    "ConfigWatcher": ".config_watcher",
+    "MetricsServer": ".metrics_server",
+    "SeedLinkServer": ".seedlink_server",
+    "ArchiveManager": ".archive_manager",
+}
+
+__all__ = list(_JOBS)
+
+
+def __getattr__(name):
+    if name in _JOBS:
+        return getattr(import_module(_JOBS[name], __name__), name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,313 @@
+from threading import Thread, Event
+from datetime import datetime, timezone
+from pathlib import Path
+from logging import getLogger
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+from src.jobs.reconfigurable import Reconfigurable
+from src.settings import Settings
+from src.utils.event_catalog import EventCatalog
+from src.utils.metrics import REGISTRY
+
+logger = getLogger(__name__)
+
+# Files of the MSeedWriter: continuous data (data_20240101T000000.mseed), its decimated
+# bands (data_20240101T000000_B.mseed) and the event files (data_EQ_20240101T010203.mseed,
+# with the codes of the digitizer when there are several)
+FILE_PATTERN = re.compile(r"^data_(?P<event>EQ_)?(?P<day>\d{8})T\d{6}(?:_(?P<suffix>\w+))?\.mseed$")
+# Day volumes of the ArchiveManager: data_20240101.mseed, data_20240101_B.mseed, data_EQ_20240101.mseed
+VOLUME_PATTERN = re.compile(r"^data_(?P<event>EQ_)?(?P<day>\d{8})(?:_(?P<suffix>[A-Z]))?\.mseed$")
+
+DAY = 86400
+CHUNK_SIZE = 256 * 1024
+
+
+class _Interrupted(Exception):
+    """The shutdown event was set during a compaction."""
+
+
+class ArchiveFile:
+    """A file of the archive with the volume it belongs to."""
+    def __init__(self, path: Path, match: re.Match, is_volume: bool):
+        self.path = path
+        self.is_volume = is_volume
+        self.is_event = bool(match["event"])
+        # Decimated band code, None for the recorded channels and the events
+        self.band_code = match["suffix"] if not self.is_event else None
+        self.day = match["day"]
+        stat = path.stat()
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+    @property
+    def day_start(self) -> float:
+        return datetime.strptime(self.day, "%Y%m%d").replace(tzinfo=timezone.utc).timestamp()
+
+    @property
+    def volume_name(self) -> str:
+        if self.is_event:
+            return f"data_EQ_{self.day}.mseed"
+        if self.band_code:
+            return f"data_{self.day}_{self.band_code}.mseed"
+        return f"data_{self.day}.mseed"
+
+
+class ArchiveManager(Reconfigurable, Thread):
+    """
+    Thread that keeps the MiniSEED archive within its disk budget.
+
+    Once a day is over (and `settle_sec` later, when the writer can't add to it
+    anymore), the 30-minute files of the day are merged in day volumes: one for the
+    recorded channels, one per decimated band and one for the event files. MiniSEED
+    records are self-contained, so a volume is the plain concatenation of the files:
+    they are copied sequentially, in large chunks, into a temporary file that replaces
+    the volume once synced, and only then deleted. The catalog follows the moves.
+    A journal written before the replace lists the merged files and the size of the
+    new volume: after a crash, the next run completes the merge (the volume has that
+    size) or drops it (it hasn't), so no record is ever merged twice.
+
+    When the archive is larger than `quota_gb` or the disk has less than
+    `min_free_gb` free, the oldest continuous data is deleted first: the recorded
+    channels, then the decimated bands from the highest rate, the event files only
+    when nothing else is left. The data of the last `settle_sec` is never deleted.
+
+    The job runs every `check_interval_sec` at the lowest CPU (and so I/O) priority
+    and reads and writes at most `max_io_mb_per_sec`, so the live writer is never
+    delayed by it.
+    """
+    def __init__(
+        self,
+        settings: Settings,
+        data_dir: Path,
+        shutdown_event: Event,
+        catalog: EventCatalog,
+        settle_sec: float = 2 * 3600
+    ):
+        super().__init__()
+        self.settings = settings
+        self.data_dir = data_dir
+        self.shutdown_event = shutdown_event
+        self.catalog = catalog
+        self.settle_sec = settle_sec
+
+        # Time at which the I/O done so far is paid for
+        self._io_time = 0.0
+
+        self._archive_bytes = REGISTRY.gauge(
+            "rpi_seism_archive_bytes", "Size of the MiniSEED archive"
+        )
+        self._compacted_files = REGISTRY.counter(
+            "rpi_seism_archive_compacted_files_total", "Archive files merged in day volumes"
+        )
+        self._deleted_bytes = REGISTRY.counter(
+            "rpi_seism_archive_deleted_bytes_total", "Bytes of archive files deleted to stay within the quota"
+        )
+
+    def run(self):
+        logger.info("Archive Manager started.")
+
+        # Lowest priority for this thread only, the I/O scheduler follows it
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+
+        while not self.shutdown_event.wait(self.settings.archive.check_interval_sec):
+            self._apply_pending_settings()
+
+            try:
+                if self.settings.archive.compact:
+                    self._compact()
+                self._enforce_quota()
+            except _Interrupted:
+                break
+            except Exception:
+                logger.exception("Error in Archive Manager")
+
+        logger.info("Archive Manager stopped.")
+
+    def _files(self) -> list[ArchiveFile]:
+        files = []
+        for path in self.data_dir.glob("data_*.mseed"):
+            volume = VOLUME_PATTERN.match(path.name)
+            match = volume or FILE_PATTERN.match(path.name)
+            if match is None:
+                continue
+
+            try:
+                files.append(ArchiveFile(path, match, is_volume=volume is not None))
+            except FileNotFoundError:
+                continue
+
+        return sorted(files, key=lambda f: f.path.name)
+
+    def _settled(self, file: ArchiveFile) -> bool:
+        """True once the writer can't add to the day of the file anymore."""
+        return file.day_start + DAY + self.settle_sec < time.time()
+
+    def _compact(self):
+        for journal in self.data_dir.glob("data_*.journal"):
+            self._recover(journal)
+
+        volumes: dict[str, list[ArchiveFile]] = {}
+        for file in self._files():
+            if not file.is_volume and self._settled(file):
+                volumes.setdefault(file.volume_name, []).append(file)
+
+        for name, files in sorted(volumes.items()):
+            self._write_volume(self.data_dir / name, files)
+
+    def _write_volume(self, path: Path, files: list[ArchiveFile]):
+        """Appends the files to the day volume `path` through a temporary copy."""
+        temp_path = path.with_suffix(".tmp")
+        sources = ([path] if path.exists() else []) + [f.path for f in files]
+
+        started = time.monotonic()
+        try:
+            with open(temp_path, "wb") as output:
+                for source in sources:
+                    self._copy(source, output)
+
+                output.flush()
+                os.fsync(output.fileno())
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+        # From here the merge is completed after a crash, see _recover
+        journal = path.with_suffix(".journal")
+        with open(journal, "w", encoding="UTF-8") as output:
+            json.dump({"size": temp_path.stat().st_size, "sources": [f.path.name for f in files]}, output)
+            output.flush()
+            os.fsync(output.fileno())
+        self._sync_dir()
+
+        os.replace(temp_path, path)
+        self._sync_dir()
+
+        self._finish_merge(journal, path, [f.path for f in files])
+
+        logger.info("%d files merged in %s (%.1f MB in %.1f s)", len(files), path.name,
+                    path.stat().st_size / 1e6, time.monotonic() - started)
+
+    def _finish_merge(self, journal: Path, path: Path, sources: list[Path]):
+        """Points the catalog to the volume, then deletes the merged files and the journal."""
+        try:
+            self.catalog.move_archive(sources, path)
+        except Exception:
+            logger.exception("Unable to update the event catalog for %s", path)
+
+        for source in sources:
+            source.unlink(missing_ok=True)
+        self._sync_dir()
+        journal.unlink()
+        self._compacted_files.inc(len(sources))
+
+    def _recover(self, journal: Path):
+        """Completes or drops a merge interrupted by a crash."""
+        path = journal.with_suffix(".mseed")
+        try:
+            entry = json.loads(journal.read_text(encoding="UTF-8"))
+            size = path.stat().st_size if path.exists() else None
+        except ValueError:
+            # Crashed while writing the journal, before the replace
+            entry, size = None, None
+
+        if entry is not None and size == entry["size"]:
+            logger.warning("Completing the interrupted merge of %s.", path.name)
+            self._finish_merge(journal, path, [self.data_dir / name for name in entry["sources"]])
+        else:
+            # The volume wasn't replaced, the files are merged again
+            logger.warning("Dropping the interrupted merge of %s.", path.name)
+            path.with_suffix(".tmp").unlink(missing_ok=True)
+            journal.unlink()
+
+    def _copy(self, source: Path, output):
+        with open(source, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                output.write(chunk)
+                self._throttle(2 * len(chunk))
+
+            # The copied data is not read again, keep the page cache for the live data
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+    def _throttle(self, size: int):
+        """Sleeps for the I/O of `size` bytes to average `max_io_mb_per_sec`."""
+        now = time.monotonic()
+        self._io_time = max(self._io_time, now) + size / (self.settings.archive.max_io_mb_per_sec * 1e6)
+
+        if self.shutdown_event.wait(max(0.0, self._io_time - now)):
+            raise _Interrupted()
+
+    def _sync_dir(self):
+        """Makes the renames of the folder durable."""
+        fd = os.open(self.data_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _deletion_order(self, files: list[ArchiveFile]) -> list[ArchiveFile]:
+        """Recorded channels first, then the bands from the highest rate, events last; oldest first."""
+        bands = [d.band_code for d in self.settings.decimated_channels]
+
+        def tier(file: ArchiveFile) -> int:
+            if file.is_event:
+                return len(bands) + 2
+            if file.band_code is None:
+                return 0
+            # Bands not configured anymore go before the configured ones
+            return bands.index(file.band_code) + 1 if file.band_code in bands else 0
+
+        return sorted(files, key=lambda f: (tier(f), f.day, f.path.name))
+
+    def _enforce_quota(self):
+        archive = self.settings.archive
+        files = self._files()
+        total = sum(f.size for f in files)
+        self._archive_bytes.set(total)
+
+        def excess() -> float:
+            over = 0.0
+            if archive.quota_gb is not None:
+                over = max(over, total - archive.quota_gb * 1e9)
+            if archive.min_free_gb is not None:
+                over = max(over, archive.min_free_gb * 1e9 - shutil.disk_usage(self.data_dir).free)
+            return over
+
+        if excess() <= 0:
+            return
+
+        # The last hours are still being written or may be needed for an event (the day
+        # volumes are recent files of settled days)
+        recent = time.time() - self.settle_sec
+        deletable = [f for f in files if f.mtime < recent or self._settled(f)]
+        for file in self._deletion_order(deletable):
+            if excess() <= 0:
+                break
+
+            if file.is_event:
+                logger.warning("Only event files are left, deleting %s to stay within the disk budget.",
+                               file.path.name)
+
+            file.path.unlink(missing_ok=True)
+            total -= file.size
+            self._deleted_bytes.inc(file.size)
+            logger.info("Deleted %s (%.1f MB) to stay within the disk budget.", file.path.name, file.size / 1e6)
+
+            try:
+                self.catalog.unlink_archive(file.path)
+            except Exception:
+                logger.exception("Unable to update the event catalog for %s", file.path)
+
+        self._archive_bytes.set(total)
+        if excess() > 0:
+            logger.error("The archive is still over its disk budget, only recent data is left.")
@@ -0,0 +1,90 @@
+from threading import Thread, Event
+from pathlib import Path
+from logging import getLogger
+
+from pydantic import ValidationError
+import yaml
+
+from src.jobs.reconfigurable import Reconfigurable
+from src.settings import Settings, CONFIG_PATH
+from src.utils.file_watch import FileWatch
+
+logger = getLogger(__name__)
+
+
+class ConfigWatcher(Thread):
+    """
+    Thread that watches the YAML configuration file and applies the new settings
+    to the running jobs. Invalid configurations are logged and ignored, every job
+    decides on its own which part of its state must be rebuilt, so the serial
+    stream keeps flowing unless the MCU settings change.
+
+    The thread sleeps until the file changes (inotify), it only polls its modification
+    time every `poll_interval` seconds where inotify is not available.
+    """
+    def __init__(
+        self,
+        settings: Settings,
+        jobs: list[Reconfigurable],
+        shutdown_event: Event,
+        config_path: Path = CONFIG_PATH,
+        poll_interval: float = 1.0
+    ):
+        super().__init__(daemon=True)
+        self.settings = settings
+        self.jobs = jobs
+        self.shutdown_event = shutdown_event
+        self.config_path = config_path
+        self.poll_interval = poll_interval
+
+        self._last_mtime = self._get_mtime()
+
+    def run(self):
+        logger.info("Watching %s for configuration changes.", self.config_path)
+
+        watch = FileWatch(self.config_path)
+        if not watch.available:
+            logger.info("inotify is not available, polling %s every %g s.", self.config_path, self.poll_interval)
+
+        while not self.shutdown_event.is_set():
+            if watch.available:
+                watch.wait()
+            elif self.shutdown_event.wait(self.poll_interval):
+                break
+
+            mtime = self._get_mtime()
+            if mtime == self._last_mtime:
+                continue
+
+            self._last_mtime = mtime
+            self._reload()
+
+    def _get_mtime(self) -> float | None:
+        try:
+            return self.config_path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _reload(self):
+        try:
+            with open(self.config_path, "r", encoding="UTF-8") as yml_file:
+                new = Settings(**yaml.safe_load(yml_file))
+        except FileNotFoundError:
+            return
+        except (ValidationError, yaml.YAMLError, TypeError) as e:
+            logger.error("Invalid configuration in %s, keeping the current settings:\n%s", self.config_path, e)
+            return
+
+        if new == self.settings:
+            return
+
+        changed = [
+            field for field in Settings.model_fields
+            if getattr(new, field) != getattr(self.settings, field)
+        ]
+        logger.info("Configuration changed (%s), applying it.", ", ".join(changed))
+
+        for job in self.jobs:
+            job.reconfigure(new)
+
+        self.settings = new
@@ -0,0 +1,62 @@
+from threading import Thread, Event
+from queue import Queue
+from logging import getLogger
+
+from src.jobs.reconfigurable import Reconfigurable
+from src.settings import Settings
+from src.utils.metrics import REGISTRY
+
+logger = getLogger(__name__)
+
+
+class DataSource(Reconfigurable, Thread):
+    """
+    Base class of the jobs that feed the pipeline. A source builds packets
+    ({"index", "timestamp", "measurements": [{"channel", "value"}, ...]}) and hands
+    them to `_publish`, which stamps the stream of the digitizer ("stream": "NET.STA.LOC")
+    and the settings it was produced under ("settings", see `Reconfigurable._follow_packet`)
+    and puts them in every consumer queue.
+
+    "index" counts the samples acquired by the digitizer: it starts from
+    `sample_index` and skips the samples that were lost, so consumers detect a gap
+    when a packet doesn't follow the previous one.
+    The source sets the shutdown event when it stops, so the pipeline stops with it.
+
+    `settings` are the settings of a single digitizer (see `Settings.streams`).
+    """
+    def __init__(self, settings: Settings, queues: list[Queue], shutdown_event: Event, stage: str):
+        super().__init__()
+        self.settings = settings
+        self.queues = queues
+        self.shutdown_event = shutdown_event
+
+        # Index of the next sample, lets consumers address samples by index
+        self.sample_index = 0
+
+        # Every source runs in its own thread, counters can't be shared between them
+        self._samples_published = REGISTRY.counter(
+            "rpi_seism_samples_total", "Samples processed by each stage", stage=stage, stream=settings.stream_id
+        )
+
+    def reconfigure(self, settings: Settings) -> None:
+        """Schedule the new settings of this source's digitizer."""
+        stream = settings.stream(self.settings.stream_id)
+        if stream is None:
+            logger.warning("%s is not configured anymore, restart to remove it.", self.settings.stream_id)
+            return
+
+        super().reconfigure(stream)
+
+    def _publish(self, packet: dict):
+        packet["stream"] = self.settings.stream_id
+        packet["settings"] = self.settings
+
+        for q in self.queues:
+            q.put(packet)
+
+        self.sample_index = packet["index"] + 1
+        self._samples_published.inc()
+
+    def queue_depth(self) -> int:
+        """Packets waiting in the most loaded consumer queue."""
+        return max((q.qsize() for q in self.queues), default=0)
@@ -0,0 +1,122 @@
+from threading import Thread, Event
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from logging import getLogger
+import socket
+
+from src.utils.metrics import MetricsRegistry, REGISTRY
+from src.utils.profiling import Profiler
+
+logger = getLogger(__name__)
+
+
+class MetricsServer(Thread):
+    """
+    Thread that serves the pipeline metrics on a local HTTP endpoint (/metrics)
+    in the Prometheus text exposition format. With a profiler it also serves the
+    /debug/stacks, /debug/profile and /debug/memory diagnostics.
+    """
+    def __init__(
+        self,
+        shutdown_event: Event,
+        host: str = "127.0.0.1",
+        port: int = 9108,
+        registry: MetricsRegistry = REGISTRY,
+        profiler: Profiler | None = None
+    ):
+        super().__init__(daemon=True)
+        self.shutdown_event = shutdown_event
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.profiler = profiler
+
+    def run(self):
+        registry = self.registry
+        debug = self._debug
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+
+                if url.path == "/metrics":
+                    self._reply(200, registry.render(), "text/plain; version=0.0.4; charset=utf-8")
+                    return
+
+                reply = debug(url.path, parse_qs(url.query, keep_blank_values=True))
+                if reply is None:
+                    self.send_error(404)
+                    return
+
+                self._reply(*reply, "text/plain; charset=utf-8")
+
+            def _reply(self, status: int, text: str, content_type: str):
+                body = text.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("%s - %s", self.address_string(), format % args)
+
+        with ThreadingHTTPServer((self.host, self.port), Handler) as server:
+            # Stop serving as soon as the shutdown event is set
+            Thread(target=self._stop_on_shutdown, args=(server,), daemon=True).start()
+
+            logger.info("Metrics endpoint started on http://%s:%d/metrics", self.host, self.port)
+            # Blocks until a request arrives, unlike `serve_forever` which polls for
+            # its shutdown twice a second
+            while not self.shutdown_event.is_set():
+                server.handle_request()
+
+    def _debug(self, path: str, query: dict[str, list[str]]) -> tuple[int, str] | None:
+        """Runs a /debug command, returns the status and the text of the reply."""
+        profiler = self.profiler
+        if profiler is None:
+            return None
+
+        if path == "/debug/stacks":
+            return 200, profiler.dump_stacks().read_text(encoding="UTF-8")
+
+        if path == "/debug/profile":
+            try:
+                seconds = float(query.get("seconds", ["30"])[0])
+            except ValueError:
+                seconds = 0
+            if not 0 < seconds < float("inf"):
+                return 400, "seconds must be a positive number\n"
+
+            output = profiler.start_sampling(seconds)
+            if output is None:
+                return 409, "A profiling session is already running\n"
+            return 202, f"Profiling for {seconds:g} s, results in {output}\n"
+
+        if path == "/debug/profile/stop":
+            if not profiler.stop_sampling():
+                return 409, "No profiling session running\n"
+            return 200, "Profiling stopped\n"
+
+        if path == "/debug/memory":
+            output = profiler.memory_snapshot(reset="reset" in query)
+            if output is None:
+                return 200, "tracemalloc baseline taken\n"
+            return 200, output.read_text(encoding="UTF-8")
+
+        if path == "/debug/memory/stop":
+            profiler.stop_memory()
+            return 200, "tracemalloc stopped\n"
+
+        return None
+
+    def _stop_on_shutdown(self, server: ThreadingHTTPServer):
+        self.shutdown_event.wait()
+
+        # An empty connection wakes up the request loop to see the shutdown
+        host, port = server.server_address[:2]
+        try:
+            with socket.create_connection((host, port), timeout=1.0):
+                pass
+        except OSError:
+            pass
@@ -4,27 +4,230 @@ from queue import Queue, Empty
 from pathlib import Path
 from logging import getLogger
 
-from obspy import Stream, Trace, UTCDateTime
 import numpy as np
 
+from src.jobs.reconfigurable import Reconfigurable
 from src.settings import Settings
+from src.settings.decimated_channels import DecimatedChannels
+from src.structs.trigger_event import TriggerEvent, TriggerEventType
+from src.utils.event_bus import EventBus
+from src.utils.decimation import DecimationChain
+from src.utils.event_catalog import EventCatalog
+from src.utils.metrics import REGISTRY
+from src.utils.packets import packet_values
+from src.utils.ring_buffer import RingBuffer
+from src.utils.scheduling import Inbox
 
 logger = getLogger(__name__)
 
-class MSeedWriter(Thread):
+# A sample further than this (in sample periods) from one period after the previous
+# one is a gap or an overlap, and starts a new trace
+MAX_TIME_ERROR = 0.5
+
+
+class DecimatedArchive:
+    """Lower-rate copy of the channels of a digitizer: its decimation chain and the data of the current file."""
+    def __init__(self, decimated: DecimatedChannels, input_rate: int, channel_names: list[str]):
+        self.band_code = decimated.band_code
+        self.sampling_rate = decimated.sampling_rate
+        self.channel_names = [decimated.channel_name(name) for name in channel_names]
+        self.chain = DecimationChain(input_rate, decimated.sampling_rate, len(channel_names))
+
+        # Buffer structure: { channel_name: [value1, value2, ...] }
+        self.buffer = {}
+        self.start_time = None
+        # Traces of the current file closed by a gap: [(start time, buffer), ...]
+        self.segments = []
+        # Samples produced since the chain started, dates the next ones
+        self.count = 0
+
+    def add(self, values: np.ndarray, first_time: float):
+        """Stores decimated samples, `first_time` being the time of the first sample the chain produced."""
+        if not len(values):
+            return
+
+        if not self.buffer:
+            self.start_time = first_time + self.count / self.sampling_rate
+
+        for i, name in enumerate(self.channel_names):
+            self.buffer.setdefault(name, []).extend(values[:, i].tolist())
+
+        self.count += len(values)
+
+    def split(self):
+        """Closes the current trace at a gap, the filter restarts from the next sample."""
+        if self.buffer:
+            self.segments.append((self.start_time, self.buffer))
+
+        self.buffer = {}
+        self.start_time = None
+        self.count = 0
+        self.chain = DecimationChain(self.chain.input_rate, self.sampling_rate, len(self.channel_names))
+
+    def file_segments(self) -> list[tuple[float, dict]]:
+        """Contiguous traces of the current file: [(start time, {channel: values}), ...]."""
+        if self.buffer:
+            return self.segments + [(self.start_time, self.buffer)]
+        return list(self.segments)
+
+    def clear(self):
+        self.buffer = {}
+        self.start_time = None
+        self.segments = []
+
+
+class StreamArchive:
+    """Buffers of one digitizer: the data of the current file and the rolling event window."""
+    def __init__(self, settings: Settings, pre_event_sec: int, post_event_sec: int):
+        self.settings = settings
+        self.stream_id = settings.stream_id
+
+        # Rolling window used to cut the event files
+        self.pre_event_samples = pre_event_sec * settings.mcu.sampling_rate
+        self.post_event_samples = post_event_sec * settings.mcu.sampling_rate
+
+        self.channel_names = [ch.name for ch in settings.channels]
+        self._columns = {name: i for i, name in enumerate(self.channel_names)}
+        # 30s of headroom absorb the delay between a sample and its trigger record
+        self.event_buffer = RingBuffer(
+            self.pre_event_samples + self.post_event_samples + 30 * settings.mcu.sampling_rate,
+            len(self.channel_names)
+        )
+
+        # Buffer structure: { channel_name: [value1, value2, ...] }
+        self.buffer = {}
+        # Track the start time of the current batch
+        self.start_time = None
+        # Traces of the current file closed by a gap or an overlap: [(start time, buffer), ...]
+        self.segments = []
+
+        # Index and time expected for the next sample
+        self.period = 1.0 / settings.mcu.sampling_rate
+        self.next_index = None
+        self.next_time = None
+
+        # Events waiting for their post-event window:
+        # [{"onset_index": int, "onset_time": float, "event_ids": [int, ...]}, ...]
+        self.pending_events = []
+
+        # Cascade of lower-rate channels, each one decimated from the previous
+        self.decimated = []
+        rate = settings.mcu.sampling_rate
+        for decimated in settings.decimated_channels:
+            self.decimated.append(DecimatedArchive(decimated, rate, self.channel_names))
+            rate = decimated.sampling_rate
+
+        # Samples waiting to go through the decimation (in blocks of one second),
+        # and the time of the first sample the chain received
+        self._to_decimate = []
+        self._decimation_start = None
+
+    def add(self, packet: dict):
+        ts = packet["timestamp"]
+
+        if self.next_index is not None and (
+            packet["index"] != self.next_index or abs(ts - self.next_time) > MAX_TIME_ERROR * self.period
+        ):
+            self.split(packet["index"], ts)
+        self.next_index = packet["index"] + 1
+        self.next_time = ts + self.period
+
+        # Set the start time for this file if it's a new buffer
+        if not self.buffer:
+            self.start_time = ts
+
+        for item in packet["measurements"]:
+            self.buffer.setdefault(item["channel"].name, []).append(item["value"])
+
+        values = packet_values(packet, self._columns)
+        self.event_buffer.append(packet["index"], ts, values)
+
+        if self.decimated:
+            if self._decimation_start is None:
+                self._decimation_start = ts
+
+            self._to_decimate.append(values)
+            if len(self._to_decimate) >= self.settings.mcu.sampling_rate:
+                self.decimate()
+
+    def split(self, index: int, timestamp: float):
+        """Closes the current trace before a sample that doesn't follow the previous one."""
+        error = timestamp - self.next_time
+        logger.warning(
+            "%s of %.3f s (%d samples) in %s, starting a new trace",
+            "Gap" if error > 0 else "Overlap", abs(error), index - self.next_index, self.stream_id
+        )
+
+        # The filters only run over contiguous samples
+        self.decimate()
+        for level in self.decimated:
+            level.split()
+        self._decimation_start = None
+
+        if self.buffer:
+            self.segments.append((self.start_time, self.buffer))
+        self.buffer = {}
+        self.start_time = None
+
+    def file_segments(self) -> list[tuple[float, dict]]:
+        """Contiguous traces of the current file: [(start time, {channel: values}), ...]."""
+        if self.buffer and self.start_time is not None:
+            return self.segments + [(self.start_time, self.buffer)]
+        return list(self.segments)
+
+    def clear(self):
+        self.buffer = {}
+        self.start_time = None
+        self.segments = []
+
+    def decimate(self):
+        """Runs the waiting samples through the decimation cascade."""
+        if not self._to_decimate:
+            return
+
+        block = np.array(self._to_decimate, dtype=np.float64)
+        self._to_decimate.clear()
+
+        # Output j of a chain is centred on its input sample offset + j * factor
+        first_time = self._decimation_start
+        rate = self.settings.mcu.sampling_rate
+        for level in self.decimated:
+            first_time += level.chain.offset / rate
+            block = level.chain.process(block)
+            level.add(block, first_time)
+            rate = level.sampling_rate
+
+    @property
+    def file_label(self) -> str:
+        """Codes of the digitizer for the file names, e.g. "XX_RPI3"."""
+        s = self.settings
+        return "_".join(code for code in (s.network, s.station, s.location) if code)
+
+
+class MSeedWriter(Reconfigurable, Thread):
     """
     Thread that buffers incoming seismic data packets and writes them to MiniSEED files at
-    regular intervals. It also handles earthquake events by ensuring that a file is saved
-    immediately when an event is detected, and then continues with the regular saving schedule.
+    regular intervals. It also keeps a rolling in-memory window of the latest samples, so
+    that when an event is detected an exactly bounded event file (pre_event_sec before to
+    post_event_sec after the onset) is written straight from memory, without disturbing
+    the regular saving schedule.
+
+    The data of every digitizer is buffered separately and written in the same files,
+    each trace with the codes of its digitizer.
     """
+    follows_packets = True
+
     def __init__(
         self,
         settings: Settings,
         data_queue: Queue,
         output_dir: Path,
         shutdown_event: Event,
-        earthquake_event: Event,
-        write_interval_sec: int = 1800
+        event_bus: EventBus,
+        catalog: EventCatalog,
+        write_interval_sec: int = 1800,
+        pre_event_sec: int = 60,
+        post_event_sec: int = 240
     ):
         super().__init__()
         self.settings = settings
@@ -32,103 +235,259 @@ class MSeedWriter(Thread):
         self.output_dir = output_dir
         self.write_interval_sec = write_interval_sec
         self.shutdown_event = shutdown_event
-        self.earthquake_event = earthquake_event
+        self.inbox = Inbox(data_queue, "mseed")
+        self.events = event_bus.subscribe(self.inbox)
+        self.catalog = catalog
 
-        # Buffer structure: { channel_name: [value1, value2, ...] }
-        self._buffer = {}
-        # Track the start time of the current batch
-        self._start_time = None
-        self._recording_until = None
-        self.is_processing_event = False
+        self.pre_event_sec = pre_event_sec
+        self.post_event_sec = post_event_sec
+        self.streams = {
+            s.stream_id: StreamArchive(s, pre_event_sec, post_event_sec)
+            for s in settings.streams()
+        }
 
-    def run(self):
-        next_write_time = time.time() + self.write_interval_sec
+        self._samples_processed = REGISTRY.counter(
+            "rpi_seism_samples_total", "Samples processed by each stage", stage="mseed"
+        )
+        self._processing_time = REGISTRY.histogram(
+            "rpi_seism_processing_seconds", "Processing time of a unit of work of each stage", stage="mseed"
+        )
 
-        while not self.shutdown_event.is_set():
-            now = time.time()
+    def _on_settings_changed(self, new: Settings):
+        def layout(s: Settings):
+            return (s.channels, s.mcu.sampling_rate, s.decimated_channels)
 
-            # collect data from the queue
-            try:
-                while True:
-                    # Expecting: {"timestamp": float, "measurements": [{"channel": obj, "value": int}, ...]}
-                    packet = self.data_queue.get_nowait()
+        new_streams = {s.stream_id: s for s in new.streams()}
+        if (
+            new_streams.keys() == self.streams.keys()
+            and all(layout(new_streams[k]) == layout(v.settings) for k, v in self.streams.items())
+        ):
+            for stream_id, state in self.streams.items():
+                state.settings = new_streams[stream_id]
+            return
 
-                    ts = packet["timestamp"]
+        # The buffered data was recorded with the old settings, save it before switching
+        logger.info("Stream settings changed, saving the buffered data.")
+        for state in self.streams.values():
+            for pending in list(state.pending_events):
+                self._write_event(state, pending)
 
-                    # Set the start time for this file if it's a new buffer
-                    if not self._buffer:
-                        self._start_time = ts
+        self._write_mseed()
+        self.streams = {
+            stream_id: StreamArchive(s, self.pre_event_sec, self.post_event_sec)
+            for stream_id, s in new_streams.items()
+        }
 
-                    for item in packet["measurements"]:
-                        ch_name = item["channel"].name
-                        val = item["value"]
+    def run(self):
+        next_write_time = time.monotonic() + self.write_interval_sec
 
-                        if ch_name not in self._buffer:
-                            self._buffer[ch_name] = []
+        while not self.inbox.closed:
+            self._apply_pending_settings()
 
-                        self._buffer[ch_name].append(val)
+            # Sleeps until data, a trigger record or the next file write
+            for packet in self.inbox.get(next_write_time):
+                # Expecting: {"stream": str, "index": int, "timestamp": float, "measurements": [...]}
+                self._follow_packet(packet)
+                state = self.streams.get(packet["stream"])
+                if state is not None:
+                    state.add(packet)
 
-                    self.data_queue.task_done()
-            except Empty:
-                pass
+                self._samples_processed.inc()
 
-            # We only trigger this if we aren't already in an EQ countdown
-            if self.earthquake_event.is_set() and not self.is_processing_event:
-                # Force the next write to happen in exactly 300 seconds
-                next_write_time = now + 300
-                self.is_processing_event = True
+                # Handle triggers as soon as possible so that the pre-event window
+                # is still in the rolling buffer when catching up with a backlog
+                self._collect_events()
+                self._write_completed_events()
 
-                logger.warning("Earthquake detected! Saving file in 5 minutes.")
+            self._collect_events()
+            self._write_completed_events()
 
-            # Check if it's time to write (Scheduled OR Earthquake deadline)
+            # Check if it's time to write
+            now = time.monotonic()
             if now >= next_write_time:
+                started = time.perf_counter()
                 self._write_mseed()
+                self._processing_time.observe(time.perf_counter() - started)
 
                 # Reset for next interval
                 next_write_time = now + self.write_interval_sec
-                self.is_processing_event = False
 
-            time.sleep(0.01)
+        # final write on shutdown, events get whatever post-event data is available
+        for state in self.streams.values():
+            for pending in list(state.pending_events):
+                self._write_event(state, pending)
 
-        # final write on shutdown
         self._write_mseed()
 
+    def _collect_events(self):
+        """Collect trigger records and register the new events."""
+        try:
+            while True:
+                event = self.events.get_nowait()
+
+                state = self.streams.get(event.stream)
+                if state is not None and event.type == TriggerEventType.TRIGGER_ON:
+                    self._add_pending_event(state, event)
+        except Empty:
+            pass
+
+    def _write_completed_events(self):
+        """Write the events whose post-event window is complete."""
+        for state in self.streams.values():
+            for pending in list(state.pending_events):
+                if state.event_buffer.end_index >= pending["onset_index"] + state.post_event_samples:
+                    self._write_event(state, pending)
+
+    def _add_pending_event(self, state: StreamArchive, event: TriggerEvent):
+        # A new onset inside the window of a pending event is saved in the same file
+        for pending in state.pending_events:
+            if pending["onset_index"] <= event.onset_index < pending["onset_index"] + state.post_event_samples:
+                if event.event_id is not None:
+                    pending["event_ids"].append(event.event_id)
+                return
+
+        state.pending_events.append({
+            "onset_index": event.onset_index,
+            "onset_time": event.onset_time,
+            "event_ids": [event.event_id] if event.event_id is not None else []
+        })
+
+        logger.warning(
+            "Earthquake detected on %s! Saving event file in %d seconds.",
+            state.stream_id, self.post_event_sec
+        )
+
+    def _build_trace(
+        self, settings: Settings, values: np.ndarray, start_time: float, ch_name: str,
+        sampling_rate: float | None = None
+    ):
+        from obspy import Trace, UTCDateTime
+
+        # Create Trace
+        # Using int32 or float32 depending on your ADC precision
+        trace = Trace(data=np.asarray(values, dtype=np.float32))
+
+        # Header Info
+        trace.stats.starttime = UTCDateTime(start_time)
+        trace.stats.sampling_rate = sampling_rate or settings.mcu.sampling_rate
+        trace.stats.channel = ch_name
+        trace.stats.station = settings.station
+        trace.stats.network = settings.network
+        trace.stats.location = settings.location
+
+        return trace
+
+    def _write_event(self, state: StreamArchive, pending: dict):
+        """Write the pre/post-event window of a pending event from the rolling buffer."""
+        from obspy import Stream, UTCDateTime
+
+        state.pending_events.remove(pending)
+
+        onset = pending["onset_index"]
+        start = max(state.event_buffer.start_index, onset - state.pre_event_samples)
+        stop = min(state.event_buffer.end_index, onset + state.post_event_samples)
+
+        if stop <= start:
+            logger.error("No data available for the event at %s", UTCDateTime(pending["onset_time"]))
+            return
+
+        timestamps, values = state.event_buffer.window(start, stop)
+
+        # The indices of the window are contiguous, a step of the clock still starts a new trace
+        breaks = np.flatnonzero(np.abs(np.diff(timestamps) - state.period) > MAX_TIME_ERROR * state.period) + 1
+        stream = Stream([
+            self._build_trace(state.settings, values[first:last, i], timestamps[first], ch_name)
+            for first, last in zip([0, *breaks.tolist()], [*breaks.tolist(), len(timestamps)])
+            for i, ch_name in enumerate(state.channel_names)
+        ])
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        timestamp_str = UTCDateTime(pending["onset_time"]).strftime('%Y%m%dT%H%M%S')
+        # With several digitizers their events may start in the same second
+        suffix = f"_{state.file_label}" if len(self.streams) > 1 else ""
+        filename = self.output_dir / f"data_EQ_{timestamp_str}{suffix}.mseed"
+
+        stream.write(str(filename), format='MSEED')
+        logger.info("Event file saved: %s", filename)
+
+        try:
+            for event_id in pending["event_ids"]:
+                self.catalog.set_archive_path(event_id, filename)
+        except Exception:
+            logger.exception("Unable to link %s in the event catalog", filename)
+
     def _write_mseed(self):
-        if not self._buffer or self._start_time is None:
+        for state in self.streams.values():
+            state.decimate()
+
+        buffered = [s for s in self.streams.values() if s.file_segments()]
+        if not buffered:
             return
 
-        logger.info("Writing batch to MiniSEED (%d channels)...", len(self._buffer))
+        from obspy import Stream, UTCDateTime
+
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
         stream = Stream()
 
-        for ch_name, values in self._buffer.items():
-            if not values:
-                continue
+        for state in buffered:
+            for segment_start, buffer in state.file_segments():
+                for ch_name, values in buffer.items():
+                    if not values:
+                        continue
 
-            # Create Trace
-            # Using int32 or float32 depending on your ADC precision
-            trace = Trace(data=np.array(values, dtype=np.float32))
+                    stream.append(self._build_trace(state.settings, values, segment_start, ch_name))
 
-            # Header Info
-            trace.stats.starttime = UTCDateTime(self._start_time)
-            trace.stats.sampling_rate = self.settings.mcu.sampling_rate
-            trace.stats.channel = ch_name
-            trace.stats.station = self.settings.station
-            trace.stats.network = self.settings.network
-
-            stream.append(trace)
+        logger.info("Writing batch to MiniSEED (%d traces)...", len(stream))
+        start_time = min(segment[0] for s in buffered for segment in s.file_segments())
 
         if stream:
             # Generate filename based on actual data start time
-            triggered = "EQ_" if self.is_processing_event else "" 
-            timestamp_str = UTCDateTime(self._start_time).strftime('%Y%m%dT%H%M%S')
-            filename = self.output_dir / f"data_{triggered}_{timestamp_str}.mseed"
+            timestamp_str = UTCDateTime(start_time).strftime('%Y%m%dT%H%M%S')
+            filename = self.output_dir / f"data_{timestamp_str}.mseed"
 
             # Write to disk
             stream.write(str(filename), format='MSEED')
             logger.info("File saved: %s", filename)
 
+            # Point the cataloged events recorded in this file (and without an event file) to it
+            try:
+                self.catalog.link_archive(
+                    start_time,
+                    max(tr.stats.endtime for tr in stream).timestamp,
+                    filename
+                )
+            except Exception:
+                logger.exception("Unable to link %s in the event catalog", filename)
+
+            self._write_decimated(timestamp_str)
+
         # Reset state for next interval
-        self._buffer.clear()
-        self._start_time = None
+        for state in buffered:
+            state.clear()
+
+    def _write_decimated(self, timestamp_str: str):
+        """Writes the lower-rate channels next to the file of the same interval, one file per band."""
+        from obspy import Stream
+
+        bands = {}
+        for state in self.streams.values():
+            for level in state.decimated:
+                stream = bands.setdefault(level.band_code, Stream())
+
+                for segment_start, buffer in level.file_segments():
+                    for ch_name, values in buffer.items():
+                        if values:
+                            stream.append(self._build_trace(
+                                state.settings, values, segment_start, ch_name, level.sampling_rate
+                            ))
+
+                level.clear()
+
+        for band_code, stream in bands.items():
+            if not stream:
+                continue
+
+            filename = self.output_dir / f"data_{timestamp_str}_{band_code}.mseed"
+            stream.write(str(filename), format='MSEED')
+            logger.info("File saved: %s", filename)
@@ -0,0 +1,215 @@
+from threading import Event
+from queue import Queue
+from pathlib import Path
+from logging import getLogger
+import time
+
+import numpy as np
+
+from src.jobs.data_source import DataSource
+from src.settings import Settings
+
+logger = getLogger(__name__)
+
+
+class MSeedReplay(DataSource):
+    """
+    Data source that streams archived MiniSEED files through the consumer queues, as
+    if the samples were coming from the MCU. Packets keep the original sample times;
+    `speed` sets the pace relative to real time (1 = real time, 10 = ten times faster,
+    0 = as fast as the consumers can keep up).
+
+    When the files are over it waits for the consumers to empty their queues, logs
+    how many times real time they sustained and stops the pipeline.
+
+    The files are replayed in the order of their first sample. The time between two
+    files is skipped, not waited for: the packets only show it as a gap in the indices,
+    and the samples of a file overlapping the previous one are dropped.
+
+    Only the traces of the main digitizer (the top-level network, station, location
+    and channels) are replayed.
+    """
+    def __init__(
+        self,
+        files: list[Path],
+        settings: Settings,
+        queues: list[Queue],
+        shutdown_event: Event,
+        speed: float = 1.0,
+        max_queue_sec: float = 10.0,
+        block_sec: float = 0.1
+    ):
+        super().__init__(settings, queues, shutdown_event, stage="replay")
+        self.files = files
+        self.speed = speed
+        # At full speed the queues are only filled up to this many seconds of data
+        self.max_queue_sec = max_queue_sec
+        # Paced samples are released in blocks of this many seconds, like the MCU frames,
+        # so the consumers wake up once per block
+        self.block_sec = block_sec
+
+        # Replay clock: wall time and sample time of the first sample of the current file
+        self._wall_start = None
+        self._data_start = None
+        # Wall time of the first replayed sample
+        self._replay_start = None
+        # Time of the sample following the last replayed one
+        self._next_time = None
+
+    def run(self):
+        logger.info("Replaying %d MiniSEED files at %s", len(self.files),
+                    f"{self.speed:g}x" if self.speed > 0 else "full speed")
+        replayed_sec = 0.0
+
+        try:
+            for path in sorted(self.files, key=self._start_time):
+                if self.shutdown_event.is_set():
+                    break
+
+                self._apply_pending_settings()
+                replayed_sec += self._replay_file(path)
+
+            self._wait_consumers(replayed_sec)
+
+        except Exception:
+            logger.exception("MiniSEED replay exception")
+        finally:
+            logger.info("MiniSEED replay stopped.")
+            self.shutdown_event.set()
+
+    def _start_time(self, path: Path) -> float:
+        """Time of the first sample of this stream in a file, from the record headers only."""
+        from obspy import read
+
+        codes = (self.settings.network, self.settings.station, self.settings.location)
+        try:
+            stream = read(str(path), headonly=True)
+        except Exception:
+            # Reported when the file is loaded
+            return float("inf")
+
+        return min((
+            tr.stats.starttime.timestamp for tr in stream
+            if (tr.stats.network, tr.stats.station, tr.stats.location) == codes
+        ), default=float("inf"))
+
+    def _load(self, path: Path) -> tuple[float, np.ndarray] | None:
+        """
+        Reads a file as a (start time, samples x channels) array ordered like the
+        configured channels. Gaps are interpolated and the channels are trimmed to
+        their common time span.
+        """
+        from obspy import read, Stream
+
+        sampling_rate = self.settings.mcu.sampling_rate
+        names = [ch.name for ch in self.settings.channels]
+
+        # Archives hold the traces of every digitizer, only replay the ones of this stream
+        codes = (self.settings.network, self.settings.station, self.settings.location)
+        stream = Stream([
+            tr for tr in read(str(path))
+            if tr.stats.channel in names and (tr.stats.network, tr.stats.station, tr.stats.location) == codes
+        ])
+        if not stream:
+            logger.warning("%s has none of the configured channels of %s, skipped", path, self.settings.stream_id)
+            return None
+
+        if any(tr.stats.sampling_rate != sampling_rate for tr in stream):
+            logger.error("%s was not recorded at %d Hz, skipped", path, sampling_rate)
+            return None
+
+        stream.merge(method=1, fill_value="interpolate")
+        stream.trim(max(tr.stats.starttime for tr in stream), min(tr.stats.endtime for tr in stream))
+
+        traces = {tr.stats.channel: tr for tr in stream}
+        missing = [name for name in names if name not in traces]
+        if missing:
+            logger.warning("%s has no data for %s, replayed as zeros", path, ", ".join(missing))
+
+        count = min(len(tr.data) for tr in stream)
+        data = np.zeros((count, len(names)), dtype=np.int32)
+        for i, name in enumerate(names):
+            if name in traces:
+                data[:, i] = np.rint(traces[name].data[:count])
+
+        return stream[0].stats.starttime.timestamp, data
+
+    def _replay_file(self, path: Path) -> float:
+        """Streams one file, returns the seconds of data replayed."""
+        loaded = self._load(path)
+        if loaded is None:
+            return 0.0
+
+        start_time, data = loaded
+        sampling_rate = self.settings.mcu.sampling_rate
+        channels = self.settings.channels
+        max_queue = self.max_queue_sec * sampling_rate
+        block = max(1, round(self.block_sec * sampling_rate))
+
+        logger.info("Replaying %s (%.1f s)", path, len(data) / sampling_rate)
+
+        # The samples missing between two files leave a gap in the indices, the ones
+        # already replayed by the previous file are dropped
+        if self._next_time is not None:
+            missing = round((start_time - self._next_time) * sampling_rate)
+            if missing > 0:
+                self.sample_index += missing
+            elif missing < 0:
+                data = data[-missing:]
+                start_time -= missing / sampling_rate
+                if not len(data):
+                    return 0.0
+        self._next_time = start_time + len(data) / sampling_rate
+
+        # The clock restarts with every file, so the time between two files is skipped
+        self._wall_start = time.monotonic()
+        self._data_start = start_time
+        if self._replay_start is None:
+            self._replay_start = self._wall_start
+
+        i = 0
+        while i < len(data) and not self.shutdown_event.is_set():
+            if self.speed > 0:
+                # Samples whose (scaled) time has come
+                replay_time = self._data_start + (time.monotonic() - self._wall_start) * self.speed
+                due = min(len(data), int((replay_time - start_time) * sampling_rate) + 1)
+
+                if due < min(i + block, len(data)):
+                    last_sample = start_time + (min(i + block, len(data)) - 1) / sampling_rate
+                    self.shutdown_event.wait((last_sample - replay_time) / self.speed)
+                    continue
+            else:
+                # Full speed, bounded by the slowest consumer
+                due = min(len(data), i + max(0, int(max_queue) - self.queue_depth()))
+
+                if due <= i:
+                    time.sleep(0.001)
+                    continue
+
+            for row in data[i:due].tolist():
+                self._publish({
+                    "index": self.sample_index,
+                    "timestamp": start_time + i / sampling_rate,
+                    "measurements": [
+                        {"channel": ch, "value": value}
+                        for ch, value in zip(channels, row)
+                    ]
+                })
+                i += 1
+
+        return i / sampling_rate
+
+    def _wait_consumers(self, replayed_sec: float):
+        if self._replay_start is None:
+            return
+
+        source_sec = time.monotonic() - self._replay_start
+        logger.info("Replayed %.1f s of data in %.1f s (%.1fx real time), waiting for the consumers...",
+                    replayed_sec, source_sec, replayed_sec / max(source_sec, 1e-9))
+
+        while self.queue_depth() > 0 and not self.shutdown_event.is_set():
+            time.sleep(0.05)
+
+        elapsed = time.monotonic() - self._replay_start
+        logger.info("Consumers processed %.1f s of data in %.1f s (%.1fx real time)",
+                    replayed_sec, elapsed, replayed_sec / max(elapsed, 1e-9))
@@ -1,117 +1,225 @@
 from threading import Thread, Event
-from queue import Queue
+from queue import Queue, Empty
 from io import BytesIO
-from collections import deque
 from logging import getLogger
 import time
-from datetime import datetime
 
 from tempfile import TemporaryDirectory
 from pathlib import Path
 
-from apprise import Apprise, NotifyFormat
-from plotly.subplots import make_subplots
-import plotly.graph_objects as go
-import pandas as pd
+import numpy as np
 
+from src.jobs.reconfigurable import Reconfigurable
 from src.settings import Settings
+from src.structs.trigger_event import TriggerEvent, TriggerEventType
+from src.utils.event_bus import EventBus
+from src.utils.packets import packet_values
+from src.utils.ring_buffer import RingBuffer
+from src.utils.scheduling import Inbox
 
 logger = getLogger(__name__)
 
 
-class NotifierSender(Thread):
+class EventWindow:
+    """Ring buffer of the latest samples of one digitizer: 60s before and 60s after the onset."""
+    def __init__(self, settings: Settings):
+        self.stream_id = settings.stream_id
+        self.pre_event_samples = settings.mcu.sampling_rate * 60
+        self.post_event_samples = settings.mcu.sampling_rate * 60
+
+        self.channel_names = [ch.name for ch in settings.channels]
+        self._columns = {name: i for i, name in enumerate(self.channel_names)}
+        self.buffer = RingBuffer(
+            self.pre_event_samples + self.post_event_samples,
+            len(self.channel_names)
+        )
+
+    def append(self, packet: dict):
+        values = packet_values(packet, self._columns)
+        self.buffer.append(packet['index'], packet['timestamp'], values)
+
+
+class NotifierSender(Reconfigurable, Thread):
+    follows_packets = True
+
     def __init__(
         self,
         settings: Settings,
         data_queue: Queue,
         shutdown_event: Event,
-        earthquake_event: Event
+        event_bus: EventBus
     ):
         super().__init__()
         self.settings = settings
         self.queue = data_queue
-        self.earthquake_event = earthquake_event
+        self.inbox = Inbox(data_queue, "notifier")
+        self.events = event_bus.subscribe(self.inbox)
         self.shutdown_event = shutdown_event
 
-        self.notifier = Apprise()
+        # Created in the thread, apprise is only loaded when the job runs
+        self.notifier = None
         self.last_notification = 0
+        # The alert is sent with the first magnitude estimate, or after this delay
+        self.max_alert_delay_sec = 10.0
+
+        self._configure(settings)
+
+    def _configure(self, settings: Settings):
+        # Event window of every digitizer, by stream id
+        self.streams = {s.stream_id: EventWindow(s) for s in settings.streams()}
+
+    def _on_settings_changed(self, new: Settings):
+        if new.notifiers != self.settings.notifiers:
+            logger.info("Notifier URLs changed, reloading them.")
+            self._initialize_notifier(new)
 
-        self.points_per_window = self.settings.mcu.sampling_rate * 60
-        self.total_capacity = self.points_per_window * 2
-        self.buffer = deque(maxlen=self.total_capacity)
+        def layout(s: Settings):
+            return (s.stream_id, s.mcu.sampling_rate, s.channels)
+
+        if [layout(s) for s in new.streams()] != [layout(s) for s in self.settings.streams()]:
+            logger.info("Notifier Sender reconfigured, rebuilding the event buffer.")
+            self._configure(new)
 
     def run(self):
         logger.info("Notifier Sender started.")
-        self._initialize_notifier()
+        self._initialize_notifier(self.settings)
+
+        while not self.inbox.closed:
+            self._apply_pending_settings()
 
-        while not self.shutdown_event.is_set():
             try:
-                try:
-                    # Small timeout so we can check shutdown_event regularly
-                    data_packet = self.queue.get(timeout=0.1)
-                    self.buffer.append(data_packet)
-                except Exception:
-                    data_packet = None
-
-                # Check for trigger (with 30s cooldown)
-                if self.earthquake_event.is_set() and (time.time() - self.last_notification > 30):
-                    self.notifier.notify(
-                        title="⚠️ Earthquake Alert",
-                        body='Significant seismic activity detected!',
-                        body_format=NotifyFormat.MARKDOWN
-                    )
-                    logger.info("Triggered! Collecting 60s post-event data...")
-                    self._handle_event()
-                    self.last_notification = time.time()
+                # Sleeps until data or a trigger record arrives
+                for data_packet in self.inbox.get():
+                    self._append_packet(data_packet)
+
+                while True:
+                    try:
+                        event = self.events.get_nowait()
+                    except Empty:
+                        break
+
+                    # Check for trigger (with 30s cooldown)
+                    if event.type == TriggerEventType.TRIGGER_ON and (time.time() - self.last_notification > 30):
+                        logger.info("Triggered! Collecting 60s post-event data...")
+                        self._handle_event(event)
+                        self.last_notification = time.time()
 
             except Exception:
                 logger.exception("Error in Notifier loop")
 
-    def _handle_event(self):
-        """Waits for post-event data, generates graph, and sends."""
-        # Record how many more samples we need to finish the 'after' window
-        # (Already have 60s in buffer, need 60s more)
-        target_count = len(self.buffer) + self.points_per_window
+    def _append_packet(self, packet: dict):
+        """Stores a packet in the ring buffer of its digitizer at its sample index."""
+        self._follow_packet(packet)
+        window = self.streams.get(packet['stream'])
+        if window is not None:
+            window.append(packet)
 
-        # Wait until buffer has the full 120s or shutdown occurs
-        while len(self.buffer) < target_count and not self.shutdown_event.is_set():
-            try:
-                data = self.queue.get(timeout=1.0)
-                self.buffer.append(data)
-            except Exception:
-                continue
+    def _handle_event(self, event: TriggerEvent):
+        """
+        Sends the alert with the first magnitude estimate, waits for post-event data,
+        generates graph, and sends it with the latest estimate.
+        """
+        window = self.streams.get(event.stream)
+        if window is None:
+            self._send_alert(event)
+            logger.warning("Event on %s, which is not configured anymore, skipping graph.", event.stream)
+            return
+
+        onset = event.onset_index
+        target_index = onset + window.post_event_samples
+
+        # Latest amplitudes of this event (trigger-update or trigger-off record), the
+        # alert waits for the first ones
+        latest = None
+        alert_deadline = time.monotonic() + self.max_alert_delay_sec
+        alerted = False
+        # Records of other events, handled once this one is sent
+        deferred = []
+
+        # Wait until the post-event window is filled or shutdown occurs
+        while True:
+            while True:
+                try:
+                    record = self.events.get_nowait()
+                except Empty:
+                    break
+
+                if (record.stream, record.onset_index) == (event.stream, event.onset_index) \
+                        and record.type != TriggerEventType.TRIGGER_ON:
+                    latest = record
+                else:
+                    deferred.append(record)
+
+            if not alerted and (latest is not None or time.monotonic() >= alert_deadline):
+                self._send_alert(latest or event)
+                alerted = True
+
+            if window.buffer.end_index >= target_index or self.inbox.closed:
+                break
+            if self.streams.get(event.stream) is not window:
+                # The digitizer switched to new settings, the graph ends with the old ones
+                break
+
+            for data in self.inbox.get(None if alerted else alert_deadline):
+                self._append_packet(data)
+
+        if not alerted:
+            self._send_alert(latest or event)
+
+        for record in deferred:
+            self.events.put(record)
+
+        start = max(window.buffer.start_index, onset - window.pre_event_samples)
+        stop = min(window.buffer.end_index, target_index)
+        if stop <= start:
+            logger.warning("No data available for the event window, skipping graph.")
+            return
 
         # Generate and Send
-        graph_bytes = self._generate_plotly_graph()
-        self._send_notification(graph_bytes)
-
-    def _generate_plotly_graph(self) -> BytesIO:
-        """Parses buffer into DataFrame and creates a multi-channel Plotly graph."""
-        # Flatten the complex dict structure into a list for Pandas
-        rows = []
-        for packet in self.buffer:
-            ts = packet['timestamp']
-            for m in packet['measurements']:
-                rows.append({
-                    "time": datetime.fromtimestamp(ts),
-                    "channel": m['channel'].name, # e.g., "Channel Z"
-                    "value": m['value']
-                })
-
-        df = pd.DataFrame(rows)
-        channels = df['channel'].unique()
+        timestamps, values = window.buffer.window(start, stop)
+        graph_bytes = self._generate_plotly_graph(window, timestamps, values)
+        self._send_notification(graph_bytes, latest or event)
+
+    def _send_alert(self, event: TriggerEvent):
+        from apprise import NotifyFormat
+
+        self.notifier.notify(
+            title="⚠️ Earthquake Alert",
+            body="Significant seismic activity detected!" + self._describe(event),
+            body_format=NotifyFormat.MARKDOWN
+        )
+
+    def _describe(self, event: TriggerEvent) -> str:
+        """Markdown lines with the magnitude and the peak ground velocities of a record."""
+        lines = []
+        if event.magnitude is not None:
+            lines.append(f"**ML {event.magnitude:.1f}** (assuming {self.settings.trigger.magnitude_distance_km:g} km)")
+        if event.amplitudes:
+            lines.append("Peak ground velocity: " + ", ".join(
+                f"{name} {a.peak_velocity * 1e3:.3f} mm/s" for name, a in event.amplitudes.items()
+            ))
+
+        return "".join(f"\n\n{line}" for line in lines)
+
+    def _generate_plotly_graph(self, window: EventWindow, timestamps: np.ndarray, values: np.ndarray) -> BytesIO:
+        """Creates a multi-channel Plotly graph from an event window of the ring buffer."""
+        from plotly.subplots import make_subplots
+        import plotly.graph_objects as go
+
+        times = (timestamps * 1e6).astype("datetime64[us]")
 
         # Create subplots (one for each axis/channel)
-        fig = make_subplots(rows=len(channels), cols=1, shared_xaxes=True, vertical_spacing=0.05)
+        n_channels = len(window.channel_names)
+        fig = make_subplots(rows=n_channels, cols=1, shared_xaxes=True, vertical_spacing=0.05)
 
-        for i, ch in enumerate(channels, 1):
-            ch_data = df[df['channel'] == ch]
+        for i, ch in enumerate(window.channel_names):
             fig.add_trace(
-                go.Scatter(x=ch_data['time'], y=ch_data['value'], name=ch),
-                row=i, col=1
+                go.Scatter(x=times, y=values[:, i], name=ch),
+                row=i + 1, col=1
             )
 
-        fig.update_layout(height=200*len(channels), title_text="Seismic Event Detail (120s)")
+        duration = timestamps[-1] - timestamps[0] if len(timestamps) else 0
+        fig.update_layout(height=200*n_channels, title_text=f"Seismic Event Detail {window.stream_id} ({duration:.0f}s)")
 
         # Return as PNG image bytes
         html = fig.to_html()
@@ -123,8 +231,10 @@ class NotifierSender(Thread):
 
         return traces_bytes
 
-    def _send_notification(self, image_stream):
+    def _send_notification(self, image_stream, event: TriggerEvent):
         """Sends the notification with the attached graph."""
+        from apprise import NotifyFormat
+
         # Apprise allows attaching file streams
         with TemporaryDirectory() as temp_dir:
             temp_dir_path = Path(temp_dir)
@@ -137,12 +247,15 @@ class NotifierSender(Thread):
 
             self.notifier.notify(
                 title="⚠️ Earthquake Alert",
-                body="Seismic activity exceeded threshold. See attached waveform.",
+                body="Seismic activity exceeded threshold. See attached waveform." + self._describe(event),
                 attach=str(temp_file),  # TY Apprise for NOT working correctly with in memory streams :(
                 body_format=NotifyFormat.MARKDOWN
             )
 
-    def _initialize_notifier(self):
-        for i in self.settings.notifiers:
+    def _initialize_notifier(self, settings: Settings):
+        from apprise import Apprise
+
+        self.notifier = Apprise()
+        for i in settings.notifiers:
             if i.enabled:
                 self.notifier.add(i.url)
@@ -1,88 +1,163 @@
-from threading import Thread, Event
+from threading import Event
 from queue import Queue
 from logging import getLogger
 
+import select
 import time
 
+import numpy as np
 import serial
 from gpiozero.pins.mock import MockFactory
 from gpiozero.exc import BadPinFactory
 from gpiozero import OutputDevice, Device
 
+from src.jobs.data_source import DataSource
 from src.settings import Settings
+from src.settings.mcu_settings import SERIAL_BAUDRATE, MCUSettings
 from src.structs.sample import Sample
-from src.structs.mcu_settings import MCUSettingsFrame
+from src.structs.sample_block import SampleBlock
+from src.utils.metrics import REGISTRY
+from src.utils.sample_clock import SampleClock
+from src.utils.scheduling import wakeup_counters
 
 logger = getLogger(__name__)
 
 
-class Reader(Thread):
-    def __init__(self, port: str, settings: Settings, queues: list[Queue], shutdown_event: Event):
+class Reader(DataSource):
+    def __init__(
+        self,
+        port: str,
+        settings: Settings,
+        queues: list[Queue],
+        shutdown_event: Event,
+        de_pin: int | None = 5
+    ):
         """
         Thread that continuously reads from the RS-485 serial port,
         processes incoming packets, and distributes data to queues.
+        `settings` are the settings of the digitizer on `port`, `de_pin` the GPIO
+        driving the MAX485 direction (None for adapters switching on their own).
         """
-        super().__init__()
+        super().__init__(settings, queues, shutdown_event, stage="reader")
         self.port = port
-        self.settings = settings
-        self.queues = queues
-        self.shutdown_event = shutdown_event
-        self.baudrate = 250000
+        self.baudrate = SERIAL_BAUDRATE
         self.heartbeat_interval = 0.5  # Send pulse every 500ms
-        self.last_heartbeat = 0
+
+        # MCU handshake: re-send the settings until the echo arrives
+        self.handshake_retry_interval = 0.25
+        self.handshake_timeout = 10
+        # Set when new MCU settings must be sent without closing the port
+        self._handshake_pending = False
+        # Settings accepted by the MCU, the frame version may fall back to 1
+        self.mcu_settings: MCUSettings = settings.mcu
+        # Sequence number expected in the next SampleBlock frame
+        self._next_sequence = None
+
+        # Sample times from the sample index, fitted to the arrival of the blocks
+        self.clock = SampleClock(settings.mcu.sampling_rate)
+        # Set when the stream restarts (handshake), the next block re-anchors the clock
+        self._resync = True
 
         # Initialize the DE/RE control pin
         # Set active_high=True (Standard for MAX485 DE pin)
         # initial_value=False (Start in Listen mode)
-        try:
-            self.max485_control = OutputDevice(5, active_high=True, initial_value=False)
-        except BadPinFactory:
-            Device.pin_factory = MockFactory()
-            self.max485_control = OutputDevice(5, active_high=True, initial_value=False)
+        self.max485_control = None
+        if de_pin is not None:
+            try:
+                self.max485_control = OutputDevice(de_pin, active_high=True, initial_value=False)
+            except BadPinFactory:
+                Device.pin_factory = MockFactory()
+                self.max485_control = OutputDevice(de_pin, active_high=True, initial_value=False)
+
+        self.channels = self.__map_channels(settings)
+
+        self._started_at = time.perf_counter()
+        self._first_sample = True
+
+        self._bytes_received = REGISTRY.counter(
+            "rpi_seism_serial_bytes_total", "Bytes read from the serial port", stream=settings.stream_id
+        )
+        self._checksum_failures = REGISTRY.counter(
+            "rpi_seism_checksum_failures_total", "Packets discarded because of a wrong checksum",
+            stream=settings.stream_id
+        )
+        self._frames_lost = REGISTRY.counter(
+            "rpi_seism_frames_lost_total", "SampleBlock frames missing from the sequence",
+            stream=settings.stream_id
+        )
+        self._clock_steps = REGISTRY.counter(
+            "rpi_seism_clock_steps_total", "Discontinuities of the sample clock (gaps, stalls, restarts)",
+            stream=settings.stream_id
+        )
+        self._clock_drift = REGISTRY.gauge(
+            "rpi_seism_clock_drift_ppm", "Deviation of the measured sampling rate from the nominal one",
+            stream=settings.stream_id
+        )
+        self._processing_time = REGISTRY.histogram(
+            "rpi_seism_processing_seconds", "Processing time of a unit of work of each stage",
+            stage="reader", stream=settings.stream_id
+        )
+        self._wakeups = wakeup_counters("reader", stream=settings.stream_id)
 
-        self.channels = self.__map_channels()
+    def _on_settings_changed(self, new: Settings):
+        if new.channels != self.settings.channels:
+            self.channels = self.__map_channels(new)
+
+        # Only a change of the MCU settings interrupts the stream
+        if new.mcu != self.settings.mcu:
+            self._handshake_pending = True
 
     def run(self):
+        self._started_at = time.perf_counter()
+        self._first_sample = True
+
         try:
             with serial.Serial(self.port, self.baudrate, timeout=0.1) as ser:
-                logger.info("Connected to RS-485 on %s at %d", self.port, self.baudrate)
+                logger.info("Connected to RS-485 on %s at %d (%s)", self.port, self.baudrate, self.settings.stream_id)
 
                 if not self._sendSettings(ser):
                     raise Exception("MCU failed to respond")
 
                 # Buffer to store incoming bytes
                 buffer = bytearray()
+                next_heartbeat = time.monotonic()
 
                 while not self.shutdown_event.is_set():
+                    self._apply_pending_settings()
+
+                    if self._handshake_pending:
+                        self._handshake_pending = False
+                        logger.info("MCU settings changed, sending them again.")
+                        buffer.clear()
+
+                        if not self._sendSettings(ser):
+                            raise Exception("MCU failed to respond")
+
                     # send Heartbeat to keep Arduino streaming
-                    if time.time() - self.last_heartbeat > self.heartbeat_interval:
-                        self.max485_control.on()   # Switch MAX485 to Transmit
-                        ser.write(b'\x01')         # Send pulse
-                        ser.flush()                # Wait for bits to leave the UART
-                        self.max485_control.off()  # Switch back to Listen immediately
-                        self.last_heartbeat = time.time()
+                    now = time.monotonic()
+                    if now >= next_heartbeat:
+                        self._transmit(ser, b'\x01')  # Send pulse
+                        next_heartbeat = now + self.heartbeat_interval
+
+                    # Sleep until bytes arrive or the next heartbeat is due
+                    readable, _, _ = select.select([ser.fileno()], [], [], max(0.0, next_heartbeat - time.monotonic()))
+                    if not readable:
+                        self._wakeups["deadline"].inc()
+                        continue
+                    self._wakeups["data"].inc()
 
                     # read available data
-                    if ser.in_waiting > 0:
-                        ser.rts = True
-                        buffer.extend(ser.read(ser.in_waiting))
+                    data = ser.read(ser.in_waiting)
+                    self._bytes_received.inc(len(data))
+                    buffer.extend(data)
 
                     # process buffer for packets
-                    while len(buffer) >= Sample.PACKET_SIZE:
-                        # Look for headers 0xAA 0xBB
-                        if buffer[0] == 0xAA and buffer[1] == 0xBB:
-                            packet_data = buffer[:Sample.PACKET_SIZE]
-
-                            sample, checksum = Sample.from_bytes(packet_data)
-                            if checksum:
-                                self._process_packet(sample)
-                                del buffer[:Sample.PACKET_SIZE] # Remove processed packet
-                            else:
-                                logger.warning("Checksum failed, shifting buffer")
-                                del buffer[0] # Slide window to find next header
-                        else:
-                            # Not a header, discard byte and keep looking
-                            del buffer[0]
+                    started = time.perf_counter()
+                    if self.mcu_settings.frame_version == 1:
+                        self._process_buffer(buffer)
+                    else:
+                        self._process_blocks(buffer)
+                    self._processing_time.observe(time.perf_counter() - started)
 
         except Exception:
             logger.exception("RS485 Reader exception")
@@ -90,62 +165,219 @@ class Reader(Thread):
             logger.info("RS485 Reader stopped.")
             self.shutdown_event.set()
 
-    def _process_packet(self, data: Sample):
-        timestamp = time.time()
-        packet = data.to_dict(timestamp, self.channels)
+    def _process_buffer(self, buffer: bytearray):
+        """Extracts every complete packet from the buffer, leaving the incomplete tail."""
+        received_at = time.monotonic()
+        samples = []
+
+        while len(buffer) >= Sample.PACKET_SIZE:
+            # Look for headers 0xAA 0xBB
+            if buffer[0] == 0xAA and buffer[1] == 0xBB:
+                packet_data = buffer[:Sample.PACKET_SIZE]
+
+                sample, checksum = Sample.from_bytes(packet_data)
+                if checksum:
+                    if self._first_sample:
+                        logger.info(
+                            "First sample received %.3f s after the reader started",
+                            time.perf_counter() - self._started_at
+                        )
+                        self._first_sample = False
+
+                    samples.append(sample)
+                    del buffer[:Sample.PACKET_SIZE] # Remove processed packet
+                else:
+                    logger.warning("Checksum failed, shifting buffer")
+                    self._checksum_failures.inc()
+                    del buffer[0] # Slide window to find next header
+            else:
+                # Not a header, discard byte and keep looking
+                del buffer[0]
+
+        if not samples:
+            return
+
+        # Version 1 frames carry no counter, lost samples are only seen by the clock
+        first_index, timestamps = self._stamp(self.sample_index, len(samples), received_at)
+        for i, (sample, timestamp) in enumerate(zip(samples, timestamps.tolist())):
+            self._publish(sample.to_dict(first_index + i, timestamp, self.channels))
+
+    def _process_blocks(self, buffer: bytearray):
+        """Decodes every complete SampleBlock frame of the buffer, leaving the incomplete tail."""
+        mcu = self.mcu_settings
+        received_at = time.monotonic()
+
+        values, sequences, crc_failures = SampleBlock.decode_stream(
+            buffer, mcu.n_channels, mcu.samples_per_frame
+        )
+
+        if crc_failures:
+            logger.warning("CRC failed on %d frames", crc_failures)
+            self._checksum_failures.inc(crc_failures)
+
+        # Index of the first sample of every frame, the lost frames leave a gap
+        frame_indices = []
+        index = self.sample_index
+        for sequence in sequences:
+            if self._next_sequence is not None and sequence != self._next_sequence:
+                lost = (sequence - self._next_sequence) % 65536
+                logger.warning("%d frames lost before frame %d", lost, sequence)
+                self._frames_lost.inc(lost)
+                index += lost * mcu.samples_per_frame
+            self._next_sequence = (sequence + 1) % 65536
+
+            frame_indices.append(index)
+            index += mcu.samples_per_frame
+
+        if not len(values):
+            return
+
+        if self._first_sample:
+            logger.info(
+                "First sample received %.3f s after the reader started",
+                time.perf_counter() - self._started_at
+            )
+            self._first_sample = False
 
-        for q in self.queues:
-            # Replicating your original tuple format
-            q.put(packet)
+        first_index, timestamps = self._stamp(frame_indices[0], index - frame_indices[0], received_at)
+        # A gap found by the clock moves all the frames of the block
+        shift = first_index - frame_indices[0]
+        indices = (
+            np.repeat(np.asarray(frame_indices) + shift, mcu.samples_per_frame)
+            + np.tile(np.arange(mcu.samples_per_frame), len(frame_indices))
+        )
+        # Times of the samples of the block, gaps included
+        timestamps = timestamps[indices - first_index]
+        columns = [(adc, channel) for adc, channel in self.channels.items() if adc < mcu.n_channels]
 
-    def __map_channels(self):
+        for index, timestamp, row in zip(indices.tolist(), timestamps.tolist(), values.tolist()):
+            self._publish({
+                "index": index,
+                "timestamp": timestamp,
+                "measurements": [
+                    {"channel": channel, "value": row[adc]}
+                    for adc, channel in columns
+                ]
+            })
+
+    def _stamp(self, first_index: int, count: int, received_at: float) -> tuple[int, np.ndarray]:
+        """
+        Feeds the arrival of a block of `count` samples to the clock model. Returns the
+        index of its first sample, moved forward when the clock shows that samples were
+        lost, and the times of its samples.
+        """
+        last_index = first_index + count - 1
+
+        if self._resync or not self.clock.synchronized:
+            # After a (re)start the samples resume from now, the pause is a gap
+            step = received_at - self.clock.predict(last_index) if self.clock.synchronized else 0.0
+            self._resync = False
+            self.clock.anchor(last_index, received_at)
+        else:
+            step = self.clock.update(last_index, received_at)
+
+        if step:
+            self._clock_steps.inc()
+            missing = round(step / self.clock.period)
+            if missing > 0:
+                # Samples acquired by the MCU that never arrived
+                logger.warning("Gap of %d samples (%.3f s) in %s", missing, step, self.settings.stream_id)
+                first_index += missing
+                last_index += missing
+                self.clock.anchor(last_index, received_at)
+            elif missing < 0:
+                logger.warning("Samples %.3f s earlier than expected in %s, the clock was re-anchored",
+                               -step, self.settings.stream_id)
+
+        self._clock_drift.set((self.clock.nominal_period / self.clock.period - 1) * 1e6)
+        return first_index, self.clock.timestamps(first_index, count)
+
+    def __map_channels(self, settings: Settings):
         return {
             i.adc_channel: i
-            for i in self.settings.channels
+            for i in settings.channels
         }
 
-    def _sendSettings(self, ser: serial.Serial):
-        time.sleep(2)   # Wait to arduino to reboot
-        sent_bytes = self.settings.mcu.to_bytes  # This should be your 6-byte packet
+    def _transmit(self, ser: serial.Serial, data: bytes):
+        if self.max485_control is not None:
+            self.max485_control.on()   # Switch MAX485 to Transmit
+        ser.write(data)
+        ser.flush()                    # Block until UART buffer is physically empty
+        if self.max485_control is not None:
+            self.max485_control.off()  # Switch back to Listen IMMEDIATELY
 
-        logger.info("Sending settings to MCU: %s", sent_bytes.hex(' '))
+    def _sendSettings(self, ser: serial.Serial):
+        """
+        Sends the settings frame to the MCU and waits for its echo.
+        The Arduino may still be rebooting after the port was opened, so instead of
+        waiting a fixed time the frame is re-sent every `handshake_retry_interval`
+        until the MCU answers (or `handshake_timeout` expires).
 
-        # Transmit
-        self.max485_control.on()   # Switch MAX485 to Transmit
-        ser.write(sent_bytes)
-        ser.flush()                # Block until UART buffer is physically empty
-        self.max485_control.off()  # Switch back to Listen IMMEDIATELY
+        Firmware without the version 2 frames only echoes the legacy part of the
+        settings frame: the reader then falls back to the version 1 frames.
+        """
+        mcu = self.settings.mcu
+        sent_bytes = mcu.to_bytes
+        legacy_bytes = mcu.legacy.to_bytes
 
-        # Wait for Echo/Response
+        logger.info("Sending settings to MCU: %s", sent_bytes.hex(' '))
         logger.info("Waiting for MCU confirmation...")
 
         # We look for the headers (0xCC 0xDD) in the response to ensure alignment
         response = b""
+        received = bytearray()
         start_time = time.time()
+        next_send = start_time
+
+        while (time.time() - start_time) < self.handshake_timeout:
+            if time.time() >= next_send:
+                self._transmit(ser, sent_bytes)
+                next_send = time.time() + self.handshake_retry_interval
 
-        while (time.time() - start_time) < 10:
-            if ser.in_waiting >= MCUSettingsFrame.PACKET_SIZE:
-                # Check for header alignment
-                potential_header = ser.read(1)
-                if potential_header == b'\xcc':
-                    next_byte = ser.read(1)
-                    if next_byte == b'\xdd':
-                        # We found the start! Read the remaining bytes (MCUSettingsFrame.PACKET_SIZE - 2)
-                        remaining = ser.read(MCUSettingsFrame.PACKET_SIZE - 2)
-                        response = potential_header + next_byte + remaining
-                        break
-                # If not header, continue loop to effectively "drain" garbage bytes
+            # Blocks until a byte arrives or the read timeout expires
+            received.extend(ser.read(max(1, ser.in_waiting)))
+
+            header = received.find(b'\xcc\xdd')
+            if header == -1:
+                # Drain garbage bytes, keeping a possible first header byte
+                del received[:-1]
+                continue
+
+            if len(received) - header >= len(sent_bytes):
+                response = bytes(received[header:header + len(sent_bytes)])
+                break
 
         # Verify
         if not response:
             logger.error("MCU failed to respond (Timeout)")
             return False
 
+        self._next_sequence = None
+        # The MCU restarts its stream, the clock resumes from the next block
+        self._resync = True
+        if mcu.sampling_rate != self.clock.sampling_rate:
+            self.clock = SampleClock(mcu.sampling_rate)
+
         if response == sent_bytes:
-            logger.info("MCU settings verified successfully!")
+            logger.info(
+                "MCU settings verified successfully in %.3f s (frame version %d)!",
+                time.time() - start_time, mcu.frame_version
+            )
+            self.mcu_settings = mcu
             return True
-        else:
-            logger.error("MCU verification failed!")
-            logger.error("Sent:     %s", sent_bytes.hex())
-            logger.error("Received: %s", response.hex())
-            return False
+
+        if mcu.frame_version > 1 and response.startswith(legacy_bytes):
+            if mcu.n_channels != 3 or mcu.sampling_rate * Sample.PACKET_SIZE * 10 > self.baudrate:
+                logger.error("The MCU firmware doesn't support frame version %d, required by these settings.",
+                             mcu.frame_version)
+                return False
+
+            logger.warning("The MCU firmware doesn't support frame version %d, falling back to version 1.",
+                           mcu.frame_version)
+            self.mcu_settings = mcu.legacy
+            return True
+
+        logger.error("MCU verification failed!")
+        logger.error("Sent:     %s", sent_bytes.hex())
+        logger.error("Received: %s", response.hex())
+        return False
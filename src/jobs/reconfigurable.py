@@ -0,0 +1,77 @@
+from threading import Lock
+
+from src.settings import Settings
+from src.utils.scheduling import Inbox
+
+
+class Reconfigurable:
+    """
+    Mixin for jobs that can apply new settings while running.
+
+    `reconfigure` can be called from any thread: the settings are only stored and
+    the job applies them from its own thread, at a safe point of its loop, by
+    calling `_apply_pending_settings`. Jobs override `_on_settings_changed` to
+    rebuild the state derived from the settings that actually changed.
+    A job blocked on its `inbox` is woken up to apply them.
+
+    The queues still hold packets produced under the old settings when a consumer
+    is reconfigured, so consumers (`follows_packets`) keep the channels and MCU
+    settings of every digitizer until `_follow_packet` sees the first packet its
+    source produced under the new ones.
+    """
+    # Take the settings of each digitizer from its packets, see `_follow_packet`
+    follows_packets = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._settings_lock = Lock()
+        self._pending_settings: Settings | None = None
+        self.inbox: Inbox | None = None
+
+        # Settings of the last packet of every digitizer, by stream id
+        self._packet_settings: dict[str, Settings] = {}
+
+    def reconfigure(self, settings: Settings) -> None:
+        """Schedule new settings, a newer call replaces settings not applied yet."""
+        with self._settings_lock:
+            self._pending_settings = settings
+
+        if self.inbox is not None:
+            self.inbox.wake()
+
+    def _apply_pending_settings(self) -> None:
+        if self._pending_settings is None:
+            return
+
+        with self._settings_lock:
+            new, self._pending_settings = self._pending_settings, None
+
+        if self.follows_packets:
+            # The digitizers switch with their packets
+            for stream in self.settings.streams():
+                new = new.with_stream(stream)
+
+        self._switch_settings(new)
+
+    def _follow_packet(self, packet: dict) -> None:
+        """
+        Switches the packet's digitizer to the settings the packet was produced under,
+        before the packet is processed. Costs a lookup when they didn't change.
+        """
+        settings = packet.get("settings")
+        if settings is None or self._packet_settings.get(packet["stream"]) is settings:
+            return
+
+        self._packet_settings[packet["stream"]] = settings
+        self._switch_settings(self.settings.with_stream(settings))
+
+    def _switch_settings(self, new: Settings) -> None:
+        if new == self.settings:
+            return
+
+        # self.settings still holds the old values while the hook runs
+        self._on_settings_changed(new)
+        self.settings = new
+
+    def _on_settings_changed(self, new: Settings) -> None:
+        """Rebuild the derived state affected by the new settings."""
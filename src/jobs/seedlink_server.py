@@ -0,0 +1,605 @@
+from threading import Thread, Event
+from queue import Queue
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+from io import BytesIO
+from logging import getLogger
+import xml.etree.ElementTree as ET
+import asyncio
+import re
+import struct
+import time
+
+import numpy as np
+
+from src.jobs.reconfigurable import Reconfigurable
+from src.settings import Settings
+from src.utils.metrics import REGISTRY
+from src.utils.record_ring import RecordRing, SeedLinkRecord
+from src.utils.scheduling import Inbox
+
+logger = getLogger(__name__)
+
+RECORD_SIZE = 512
+# A sample arriving further than this from its expected time starts a new record
+MAX_TIME_ERROR = 0.5
+
+
+class ChannelPacker:
+    """
+    Samples of one channel waiting to be packed in 512-byte Steim-2 records. Only
+    full records are released, the samples of the last (partial) record wait for
+    the next ones unless the caller asks for a flush.
+    """
+    def __init__(self, settings: Settings, channel: str):
+        self.network = settings.network
+        self.station = settings.station
+        self.location = settings.location
+        self.channel = channel
+        self.sampling_rate = settings.mcu.sampling_rate
+
+        self.samples: list[int] = []
+        # Time of the first pending sample, and when it was received (for the flush latency)
+        self.start_time: float | None = None
+        self.pending_since: float | None = None
+        # Sample index expected next
+        self.next_index: int | None = None
+
+    def is_contiguous(self, index: int, timestamp: float) -> bool:
+        if not self.samples:
+            return True
+
+        expected = self.start_time + len(self.samples) / self.sampling_rate
+        return index == self.next_index and abs(timestamp - expected) <= MAX_TIME_ERROR
+
+    def add(self, index: int, timestamp: float, value: int):
+        if not self.samples:
+            self.start_time = timestamp
+            self.pending_since = time.monotonic()
+
+        self.samples.append(value)
+        self.next_index = index + 1
+
+    def pack(self, flush: bool = False) -> list[tuple[float, float, bytes]]:
+        """Encodes the pending samples, returns (start time, end time, record) of the released records."""
+        if not self.samples:
+            return []
+
+        from obspy import Trace, UTCDateTime
+
+        trace = Trace(data=np.array(self.samples, dtype=np.int32))
+        trace.stats.starttime = UTCDateTime(self.start_time)
+        trace.stats.sampling_rate = self.sampling_rate
+        trace.stats.network = self.network
+        trace.stats.station = self.station
+        trace.stats.location = self.location
+        trace.stats.channel = self.channel
+
+        buffer = BytesIO()
+        trace.write(buffer, format="MSEED", reclen=RECORD_SIZE, encoding="STEIM2", byteorder=">")
+        data = buffer.getvalue()
+
+        records = [data[i:i + RECORD_SIZE] for i in range(0, len(data), RECORD_SIZE)]
+        if not flush:
+            # Every record but the last one is full
+            records = records[:-1]
+
+        released = []
+        packed = 0
+        for record in records:
+            # Number of samples, in the fixed header
+            count, = struct.unpack_from(">H", record, 30)
+            start = self.start_time + packed / self.sampling_rate
+            released.append((start, start + (count - 1) / self.sampling_rate, record))
+            packed += count
+
+        del self.samples[:packed]
+        if self.samples:
+            self.start_time += packed / self.sampling_rate
+            if packed:
+                self.pending_since = time.monotonic()
+        else:
+            self.start_time = None
+            self.pending_since = None
+
+        return released
+
+
+@dataclass
+class StationRequest:
+    """Records requested by a client for one STATION command (or for the uni-station mode)."""
+    network: str
+    station: str
+    selectors: list[str] = field(default_factory=list)
+    # Ring position of the first record to send
+    start: int = 0
+    # TIME window
+    start_time: float | None = None
+    end_time: float | None = None
+
+    def matches(self, record: SeedLinkRecord) -> bool:
+        if not (fnmatchcase(record.network, self.network) and fnmatchcase(record.station, self.station)):
+            return False
+
+        if self.start_time is not None and record.end_time < self.start_time:
+            return False
+        if self.end_time is not None and record.start_time >= self.end_time:
+            return False
+
+        included = [s for s in self.selectors if not s.startswith("!")]
+        excluded = [s[1:] for s in self.selectors if s.startswith("!")]
+
+        if included and not any(_selector_matches(s, record) for s in included):
+            return False
+        return not any(_selector_matches(s, record) for s in excluded)
+
+
+def _selector_matches(selector: str, record: SeedLinkRecord) -> bool:
+    """Matches a [LL]CCC[.T] selector, '?' matching any character. Only data records (type D) exist."""
+    pattern, _, record_type = selector.partition(".")
+    if record_type and record_type.upper() != "D":
+        return False
+
+    location, channel = (pattern[:-3], pattern[-3:]) if len(pattern) > 3 else (None, pattern.ljust(3, "?"))
+    if location is not None and not fnmatchcase(record.location.ljust(2), location.ljust(2)):
+        return False
+
+    return fnmatchcase(record.channel, channel)
+
+
+@dataclass
+class SeedLinkSession:
+    stations: list[StationRequest] = field(default_factory=list)
+    # Station being configured by SELECT/DATA/FETCH/TIME
+    current: StationRequest | None = None
+    batch: bool = False
+    # Set by STATION, the transfer then starts with END
+    multi_station: bool = False
+    # FETCH: stop when the client is up to date
+    dialup: bool = False
+    streaming: bool = False
+
+    def wants(self, position: int, record: SeedLinkRecord) -> bool:
+        return any(position >= st.start and st.matches(record) for st in self.stations)
+
+
+class SeedLinkServer(Reconfigurable, Thread):
+    """
+    Thread that serves the live data to SeedLink clients (slinktool, SeisComP,
+    ObsPy...). Samples are packed in 512-byte Steim-2 MiniSEED records as soon as
+    a record is full (or after `flush_sec` seconds) and kept in a ring of
+    `ring_records` sequence-numbered records, so clients can resume after a
+    disconnection with DATA <sequence>. Records are packed once and the same bytes
+    are sent to every client.
+    """
+    SOFTWARE = "SeedLink v3.1 (rpi-seism)"
+    CAPABILITIES = (
+        "dialup", "multistation", "window-extraction",
+        "info:id", "info:capabilities", "info:stations", "info:streams"
+    )
+
+    follows_packets = True
+
+    def __init__(
+        self,
+        settings: Settings,
+        data_queue: Queue,
+        shutdown_event: Event,
+        host: str = "0.0.0.0",
+        port: int = 18000,
+        ring_records: int = 20000,
+        flush_sec: float = 10.0
+    ):
+        super().__init__(daemon=True)
+        self.settings = settings
+        self.data_queue = data_queue
+        self.inbox = Inbox(data_queue, "seedlink")
+        self.shutdown_event = shutdown_event
+        self.host = host
+        self.port = port
+        self.flush_sec = flush_sec
+        # Records are released once per second, a full record doesn't wait longer than that
+        self.pack_interval = 1.0
+
+        self.ring = RecordRing(ring_records)
+        self.started = datetime.now(timezone.utc)
+
+        self._clients = set()
+        # Set (and replaced) every time records are added to the ring
+        self._records_available: asyncio.Event | None = None
+
+        self._configure(settings)
+
+        self._samples_processed = REGISTRY.counter(
+            "rpi_seism_samples_total", "Samples processed by each stage", stage="seedlink"
+        )
+        self._processing_time = REGISTRY.histogram(
+            "rpi_seism_processing_seconds", "Processing time of a unit of work of each stage", stage="seedlink"
+        )
+        self._records_packed = REGISTRY.counter(
+            "rpi_seism_seedlink_records_total", "MiniSEED records added to the SeedLink ring"
+        )
+        REGISTRY.gauge(
+            "rpi_seism_seedlink_clients", "Connected SeedLink clients", callback=lambda: len(self._clients)
+        )
+
+    def _configure(self, settings: Settings):
+        # Settings of every digitizer, by stream id
+        self.streams = {s.stream_id: s for s in settings.streams()}
+        # Pending samples of every channel: { ("XX.RPI3.", "EHZ"): ChannelPacker }
+        self.packers: dict[tuple[str, str], ChannelPacker] = {}
+
+    def _on_settings_changed(self, new: Settings):
+        def layout(s: Settings):
+            return (s.stream_id, s.mcu.sampling_rate, s.channels)
+
+        if [layout(s) for s in new.streams()] != [layout(s) for s in self.streams.values()]:
+            logger.info("SeedLink Server reconfigured, flushing the pending records.")
+            self._pack(flush=True)
+            self._configure(new)
+        else:
+            self.streams = {s.stream_id: s for s in new.streams()}
+
+    def run(self):
+        asyncio.run(self._main_loop())
+
+    async def _main_loop(self):
+        self._records_available = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+
+        async with server:
+            logger.info("SeedLink Server started on %s:%d", self.host, self.port)
+            await self._producer_loop()
+
+            for writer in list(self._clients):
+                writer.close()
+
+        logger.info("SeedLink Server stopped.")
+
+    async def _producer_loop(self):
+        loop = asyncio.get_running_loop()
+        next_pack = time.monotonic() + self.pack_interval
+
+        while not self.inbox.closed:
+            self._apply_pending_settings()
+
+            # Full records are packed when data arrives, only the flush of the pending
+            # samples of a stalled stream has a deadline
+            pending = [packer.pending_since for packer in self.packers.values() if packer.pending_since is not None]
+            flush_time = max(min(pending) + self.flush_sec, next_pack) if pending else None
+
+            try:
+                # Sleeps (in the executor) until data or the flush. A bounded number of
+                # packets per wakeup, so a backlog doesn't delay the packing
+                packets = await loop.run_in_executor(None, self.inbox.get, flush_time, 1000)
+
+                # Expecting: {"stream": str, "index": int, "timestamp": float, "measurements": [...]}
+                for packet in packets:
+                    self._add_packet(packet)
+            except Exception:
+                logger.exception("Error in SeedLink producer loop")
+
+            if time.monotonic() >= next_pack:
+                started = time.perf_counter()
+                self._pack()
+                self._processing_time.observe(time.perf_counter() - started)
+                next_pack = time.monotonic() + self.pack_interval
+
+        self._pack(flush=True)
+
+    def _add_packet(self, packet: dict):
+        self._samples_processed.inc()
+        self._follow_packet(packet)
+
+        settings = self.streams.get(packet["stream"])
+        if settings is None:
+            return
+
+        ts = packet["timestamp"]
+        for item in packet["measurements"]:
+            key = (packet["stream"], item["channel"].name)
+
+            packer = self.packers.get(key)
+            if packer is None:
+                packer = self.packers[key] = ChannelPacker(settings, item["channel"].name)
+
+            # A gap (or a jump of the clock) ends the current record
+            if not packer.is_contiguous(packet["index"], ts):
+                self._publish(packer, packer.pack(flush=True))
+
+            packer.add(packet["index"], ts, item["value"])
+
+    def _pack(self, flush: bool = False):
+        """Moves the full records (all of them when flushing or late) to the ring and wakes the clients."""
+        now = time.monotonic()
+
+        for packer in self.packers.values():
+            late = packer.pending_since is not None and now - packer.pending_since >= self.flush_sec
+            self._publish(packer, packer.pack(flush or late))
+
+    def _publish(self, packer: ChannelPacker, records: list[tuple[float, float, bytes]]):
+        if not records:
+            return
+
+        for start_time, end_time, record in records:
+            self.ring.append(
+                packer.network, packer.station, packer.location, packer.channel, start_time, end_time, record
+            )
+
+        self._records_packed.inc(len(records))
+
+        if self._records_available is not None:
+            available, self._records_available = self._records_available, asyncio.Event()
+            available.set()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        session = SeedLinkSession()
+        streamer = None
+        self._clients.add(writer)
+        logger.info("SeedLink client connected: %s", peer)
+
+        try:
+            async for command in self._read_commands(reader):
+                if command.upper() == "BYE":
+                    break
+
+                response = self._handle_command(session, command)
+                if response:
+                    writer.write(response)
+                    await writer.drain()
+
+                if session.streaming and streamer is None:
+                    streamer = asyncio.create_task(self._stream(session, writer))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception("Error in SeedLink connection %s", peer)
+        finally:
+            if streamer is not None:
+                streamer.cancel()
+            self._clients.discard(writer)
+            writer.close()
+            logger.info("SeedLink client disconnected: %s", peer)
+
+    async def _read_commands(self, reader: asyncio.StreamReader):
+        """Yields the command lines, clients end them with CR, LF or CR LF."""
+        buffer = b""
+
+        while True:
+            data = await reader.read(1024)
+            if not data:
+                return
+
+            buffer += data
+            *lines, buffer = re.split(rb"\r\n|\r|\n", buffer)
+            for line in lines:
+                if line.strip():
+                    yield line.decode("ascii", errors="replace").strip()
+
+            if len(buffer) > 1024:
+                logger.warning("SeedLink command too long, closing the connection.")
+                return
+
+    def _handle_command(self, session: SeedLinkSession, command: str) -> bytes | None:
+        """Applies a command to the session, returns the response."""
+        name, *args = command.split()
+        name = name.upper()
+
+        ok = None if session.batch else b"OK\r\n"
+        error = b"ERROR\r\n"
+
+        if name == "HELLO":
+            return (
+                f"{self.SOFTWARE} :: SLPROTO:3.1 CAP\r\n"
+                f"rpi-seism {self.settings.network}.{self.settings.station}\r\n"
+            ).encode()
+
+        if name == "INFO":
+            return self._info(args[0].upper() if args else "ID")
+
+        if name == "CAT":
+            stations = "".join(f"{net} {sta}\r\n" for net, sta in self._stations())
+            return stations.encode() + b"END"
+
+        if name == "BATCH":
+            session.batch = True
+            return b"OK\r\n"
+
+        if session.streaming:
+            # Only INFO and BYE are accepted during the transfer
+            return error
+
+        if name == "STATION" and args:
+            network = args[1] if len(args) > 1 else self.settings.network
+            if not any(fnmatchcase(net, network) and fnmatchcase(sta, args[0]) for net, sta in self._stations()):
+                return error
+
+            session.current = StationRequest(network, args[0], start=self.ring.end)
+            session.stations.append(session.current)
+            session.multi_station = True
+            return ok
+
+        if name == "SELECT":
+            if session.current is None:
+                # Uni-station mode
+                session.current = StationRequest("*", "*", start=self.ring.end)
+                session.stations.append(session.current)
+
+            if not args:
+                session.current.selectors.clear()
+            elif re.fullmatch(r"!?[A-Za-z0-9?]{1,5}(\.[A-Za-z])?", args[0]):
+                session.current.selectors.append(args[0])
+            else:
+                return error
+            return ok
+
+        if name in ("DATA", "FETCH", "TIME"):
+            if session.current is None:
+                session.current = StationRequest("*", "*", start=self.ring.end)
+                session.stations.append(session.current)
+
+            try:
+                self._set_start(session.current, name, args)
+            except ValueError:
+                return error
+
+            session.dialup = session.dialup or name == "FETCH"
+            # In uni-station mode the action command starts the transfer
+            session.streaming = not session.multi_station
+            return ok
+
+        if name == "END":
+            if not session.stations:
+                return error
+
+            session.streaming = True
+            return None
+
+        return error
+
+    def _set_start(self, station: StationRequest, action: str, args: list[str]):
+        if action == "TIME":
+            if not args:
+                raise ValueError("TIME needs a start time")
+
+            station.start_time = _parse_time(args[0])
+            station.end_time = _parse_time(args[1]) if len(args) > 1 else None
+            station.start = self.ring.find_time(station.start_time)
+        elif args:
+            # Clients send the sequence of the next record they want, with or without 0x
+            station.start = self.ring.find_sequence(int(args[0], 16) % RecordRing.SEQUENCE_MODULO)
+        else:
+            station.start = self.ring.end
+
+    async def _stream(self, session: SeedLinkSession, writer: asyncio.StreamWriter):
+        """Sends the matching records of the ring, then every new one as it is packed."""
+        position = min(st.start for st in session.stations)
+
+        try:
+            while not writer.is_closing():
+                if position < self.ring.start:
+                    logger.warning(
+                        "SeedLink client %s fell behind, %d records lost",
+                        writer.get_extra_info("peername"), self.ring.start - position
+                    )
+                    position = self.ring.start
+
+                if position >= self.ring.end:
+                    if session.dialup or self._windows_over(session):
+                        writer.write(b"END")
+                        await writer.drain()
+                        return
+
+                    await self._records_available.wait()
+                    continue
+
+                stop = min(self.ring.end, position + 64)
+                for position in range(position, stop):
+                    record = self.ring.get(position)
+                    if session.wants(position, record):
+                        writer.write(record.packet)
+                position = stop
+
+                await writer.drain()
+        except ConnectionError:
+            writer.close()
+
+    def _windows_over(self, session: SeedLinkSession) -> bool:
+        """True once every station has a TIME window whose end has been packed."""
+        if any(st.end_time is None for st in session.stations):
+            return False
+
+        # Records of the window end are packed at most flush_sec after it
+        end = max(st.end_time for st in session.stations)
+        return time.time() > end + self.flush_sec + self.pack_interval
+
+    def _stations(self) -> list[tuple[str, str]]:
+        return list(dict.fromkeys((s.network, s.station) for s in self.streams.values()))
+
+    def _info(self, level: str) -> bytes:
+        """INFO response: the XML document in ASCII MiniSEED records with SLINFO headers."""
+        root = ET.Element("seedlink", {
+            "software": self.SOFTWARE,
+            "organization": "rpi-seism",
+            "started": self.started.strftime("%Y/%m/%d %H:%M:%S.%f")[:-2]
+        })
+
+        if level == "CAPABILITIES":
+            for capability in self.CAPABILITIES:
+                ET.SubElement(root, "capability", name=capability)
+        elif level in ("STATIONS", "STREAMS"):
+            last = self.ring.end - 1
+            streams = self._ring_streams() if level == "STREAMS" else {}
+
+            for network, station in self._stations():
+                element = ET.SubElement(root, "station", {
+                    "name": station,
+                    "network": network,
+                    "description": "rpi-seism",
+                    "begin_seq": f"{self.ring.sequence(self.ring.start):06X}",
+                    "end_seq": f"{self.ring.sequence(max(last, self.ring.start)):06X}",
+                    "stream_check": "enabled"
+                })
+                for (net, sta, location, channel), (begin, end) in streams.items():
+                    if (net, sta) == (network, station):
+                        ET.SubElement(element, "stream", {
+                            "location": location,
+                            "seedname": channel,
+                            "type": "D",
+                            "begin_time": _format_time(begin),
+                            "end_time": _format_time(end),
+                            "begin_recno": "0",
+                            "end_recno": "0",
+                            "gap_check": "disabled",
+                            "gap_treshold": "0"
+                        })
+        elif level != "ID":
+            return b"ERROR\r\n"
+
+        document = b'<?xml version="1.0"?>\n' + ET.tostring(root)
+        return self._info_records(document)
+
+    def _ring_streams(self) -> dict[tuple[str, str, str, str], tuple[float, float]]:
+        """Time span of every channel in the ring."""
+        spans = {}
+        for position in range(self.ring.start, self.ring.end):
+            record = self.ring.get(position)
+            key = (record.network, record.station, record.location, record.channel)
+            begin, end = spans.get(key, (record.start_time, record.end_time))
+            spans[key] = (min(begin, record.start_time), max(end, record.end_time))
+
+        return spans
+
+    def _info_records(self, document: bytes) -> bytes:
+        from obspy import Trace
+
+        trace = Trace(data=np.frombuffer(document, dtype="S1"))
+        trace.stats.network = self.settings.network
+        trace.stats.station = self.settings.station
+        trace.stats.channel = "LOG"
+
+        buffer = BytesIO()
+        trace.write(buffer, format="MSEED", reclen=RECORD_SIZE, encoding="ASCII", byteorder=">")
+        data = buffer.getvalue()
+
+        records = [data[i:i + RECORD_SIZE] for i in range(0, len(data), RECORD_SIZE)]
+        # "*" marks the records followed by more of the same response
+        return b"".join(
+            (b"SLINFO *" if i < len(records) - 1 else b"SLINFO  ") + record
+            for i, record in enumerate(records)
+        )
+
+
+def _parse_time(value: str) -> float:
+    """SeedLink time, "YYYY,MM,DD,hh,mm,ss" in UTC."""
+    fields = [int(v) for v in value.split(",")]
+    if len(fields) < 3:
+        raise ValueError(f"Invalid SeedLink time {value}")
+
+    return datetime(*fields[:6], tzinfo=timezone.utc).timestamp()
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y/%m/%d %H:%M:%S.%f")[:-2]
@@ -1,110 +1,306 @@
-from collections import deque
 from threading import Thread, Event
-from queue import Empty, Queue
+from queue import Queue
 from logging import getLogger
+import time
 
-import numpy as np
-
-# ObsPy's recursive STA/LTA is faster and better for continuous data
-from obspy.signal.trigger import recursive_sta_lta
-
+from src.jobs.reconfigurable import Reconfigurable
 from src.settings import Settings
+from src.settings.enums import ChannelOrientation
+from src.structs.trigger_event import TriggerEvent, TriggerEventType
+from src.utils.event_bus import EventBus
+from src.utils.event_catalog import EventCatalog
+from src.utils.magnitude import AmplitudeEstimator
+from src.utils.metrics import REGISTRY
+from src.utils.packets import packet_values
+from src.utils.scheduling import Inbox
 
 logger = getLogger(__name__)
 
-class TriggerProcessor(Thread):
+
+class StreamTrigger:
+    """
+    Recursive STA/LTA state of one digitizer. The averages are updated with every
+    sample (the same recursion as ObsPy's recursive_sta_lta), so the cost of a sample
+    doesn't depend on the window lengths.
+    """
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.stream_id = settings.stream_id
+
+        # Configuration from settings
+        self.sampling_rate = settings.mcu.sampling_rate
+        self.channel_names = [ch.name for ch in settings.channels]
+        self._columns = {name: i for i, name in enumerate(self.channel_names)}
+
+        # Ground motion of all channels, measured from the onset of every event
+        self.amplitude = AmplitudeEstimator(len(self.channel_names), self.sampling_rate, settings.trigger.lta_sec)
+        # Sample index of the next trigger-update record, and the Wood-Anderson peak
+        # of the last one
+        self.next_update_index = 0
+        self.reported_peak = 0.0
+
+        self.configure_trigger(settings)
+
+        self.last_trigger = False
+
+        # Onset record of the event in progress, used to build the trigger-off record
+        self.current_event: TriggerEvent | None = None
+        self.peak_ratio = 0.0
+
+        # Index and timestamp of the latest sample
+        self.last_index = 0
+        self.last_timestamp = 0.0
+
+    def configure_trigger(self, settings: Settings):
+        """Applies the trigger settings, keeping the averages unless the channel changed."""
+        trigger = settings.trigger
+
+        # The trigger section is shared by the digitizers, one without the trigger
+        # channel uses its first vertical channel
+        channel = trigger.channel
+        if channel not in self._columns:
+            channel = next(
+                (ch.name for ch in settings.channels if ch.orientation == ChannelOrientation.VERTICAL), None
+            )
+
+        if channel != getattr(self, "trigger_channel", None):
+            self.sta = 0.0
+            self.lta = 1e-99
+            self.count = 0
+
+        self.trigger_channel = channel
+        self.trigger_column = self._columns.get(channel)
+
+        # Trigger thresholds
+        self.thr_on = trigger.thr_on   # Ratio to trigger
+        self.thr_off = trigger.thr_off  # Ratio to clear trigger
+
+        # STA/LTA window lengths in samples
+        self.nsta = int(trigger.sta_sec * self.sampling_rate)
+        self.nlta = int(trigger.lta_sec * self.sampling_rate)
+        self.csta = 1.0 / self.nsta
+        self.clta = 1.0 / self.nlta
+
+    def add(self, packet: dict) -> float | None:
+        """Stores a packet, returns the STA/LTA ratio once a full LTA window was seen."""
+        values = packet_values(packet, self._columns)
+        self.amplitude.add(values.tolist())
+        self.last_index = packet["index"]
+        self.last_timestamp = packet["timestamp"]
+
+        if self.trigger_column is None:
+            return None
+
+        sq = float(values[self.trigger_column]) ** 2
+        self.sta += self.csta * (sq - self.sta)
+        self.lta += self.clta * (sq - self.lta)
+        self.count += 1
+
+        if self.count < self.nlta:
+            return None
+
+        return self.sta / self.lta
+
+
+class TriggerProcessor(Reconfigurable, Thread):
     """
-    Thread that processes incoming seismic data packets using ObsPy's recursive STA/LTA.
-    Uses a rolling buffer to maintain the state required for the algorithm.
+    Thread that runs a recursive STA/LTA on the trigger channel of every digitizer
+    and publishes the trigger-on/trigger-off records of each one.
     """
+    follows_packets = True
+
     def __init__(
         self,
         settings: Settings,
         data_queue: Queue,
         shutdown_event: Event,
-        earthquake_event: Event
+        event_bus: EventBus,
+        catalog: EventCatalog
     ):
         super().__init__()
+        self.settings = settings
         self.data_queue = data_queue
-        self.earthquake_event = earthquake_event
+        self.inbox = Inbox(data_queue, "trigger")
+        self.event_bus = event_bus
+        self.catalog = catalog
         self.shutdown_event = shutdown_event
 
-        # Configuration from settings
-        self.sampling_rate = settings.mcu.sampling_rate
-        self.trigger_channel = "EHZ"
+        # STA/LTA state of every digitizer, by stream id
+        self.streams = {s.stream_id: StreamTrigger(s) for s in settings.streams()}
 
-        # STA/LTA Window lengths in seconds
-        self.sta_sec = 0.5
-        self.lta_sec = 10.0
+        self._samples_processed = REGISTRY.counter(
+            "rpi_seism_samples_total", "Samples processed by each stage", stage="trigger"
+        )
+        self._processing_time = REGISTRY.histogram(
+            "rpi_seism_processing_seconds", "Processing time of a unit of work of each stage", stage="trigger"
+        )
+        self._latency = REGISTRY.histogram(
+            "rpi_seism_latency_seconds", "Delay between the serial receive of a sample and its use",
+            stage="trigger"
+        )
 
-        # Trigger thresholds
-        self.thr_on = 3.5   # Ratio to trigger
-        self.thr_off = 1.5  # Ratio to clear trigger
+    def _on_settings_changed(self, new: Settings):
+        streams = {}
 
-        # Convert seconds to sample counts for ObsPy
-        self.nsta = int(self.sta_sec * self.sampling_rate)
-        self.nlta = int(self.lta_sec * self.sampling_rate)
+        for settings in new.streams():
+            state = self.streams.get(settings.stream_id)
+            layout_changed = state is None or (
+                settings.mcu.sampling_rate != state.settings.mcu.sampling_rate
+                or settings.channels != state.settings.channels
+            )
 
-        # Buffer: We need at least nlta samples to establish a baseline.
-        # We keep a slightly larger buffer (e.g., 2x LTA) to ensure stable ratios.
-        self.buffer_size = self.nlta * 2
-        self.data_buffer = deque(maxlen=self.buffer_size)
+            # The buffered samples don't match the new settings, close the event in progress
+            if state is not None and state.last_trigger and (
+                layout_changed or settings.trigger.channel != state.settings.trigger.channel
+            ):
+                logger.warning("Settings of %s changed during an event, closing it.", state.stream_id)
+                self._publish_trigger_off(state)
 
-        self.last_trigger = False
+            if layout_changed:
+                logger.info("Trigger Processor reconfigured, rebuilding the STA/LTA state of %s.",
+                            settings.stream_id)
+                state = StreamTrigger(settings)
+            elif settings.trigger != state.settings.trigger:
+                # Only thresholds, windows or trigger channel changed
+                state.configure_trigger(settings)
+                logger.info("Trigger settings of %s updated: on %.2f, off %.2f",
+                            settings.stream_id, state.thr_on, state.thr_off)
 
-    def run(self):
-        logger.info("Trigger Processor (ObsPy Recursive STA/LTA) started.")
-
-        while not self.shutdown_event.is_set():
-            try:
-                # Expecting: {"timestamp": float, "measurements": [{"channel": obj, "value": int}, ...]}
-                packet = self.data_queue.get(timeout=0.5)
-
-                # Extract the value for the trigger channel
-                trigger_value = next(
-                    (item["value"] for item in packet["measurements"]
-                     if item["channel"].name == self.trigger_channel),
-                    None
-                )
+            state.settings = settings
+            streams[settings.stream_id] = state
 
-                if trigger_value is None:
-                    self.data_queue.task_done()
-                    continue
+        for stream_id, state in self.streams.items():
+            if stream_id not in streams and state.last_trigger:
+                self._publish_trigger_off(state)
 
-                # Add new sample to the rolling buffer
-                self.data_buffer.append(float(trigger_value))
+        self.streams = streams
 
-                # Process if we have enough data for the LTA window
-                if len(self.data_buffer) >= self.nlta:
-                    self._update_trigger_state()
+    def run(self):
+        logger.info("Trigger Processor (recursive STA/LTA) started.")
 
-                self.data_queue.task_done()
+        while not self.inbox.closed:
+            self._apply_pending_settings()
 
-            except Empty:
-                continue
-            except Exception:
-                logger.exception("Error in Trigger Processor loop")
+            for packet in self.inbox.get():
+                try:
+                    # Expecting: {"stream": str, "index": int, "timestamp": float, "measurements": [...]}
+                    self._follow_packet(packet)
+                    state = self.streams.get(packet["stream"])
+                    if state is not None:
+                        started = time.perf_counter()
+                        self._process_packet(state, packet)
+                        self._processing_time.observe(time.perf_counter() - started)
+                        self._latency.observe(time.time() - packet["timestamp"])
 
-        logger.info("Trigger Processor stopped.")
+                    self._samples_processed.inc()
 
-    def _update_trigger_state(self):
-        """Calculates the characteristic function and handles event state."""
-        # Convert buffer to numpy array for ObsPy processing
-        data_arr = np.array(self.data_buffer)
+                except Exception:
+                    logger.exception("Error in Trigger Processor loop")
 
-        # ObsPy's recursive_sta_lta returns the 'Characteristic Function' (the ratios)
-        cft = recursive_sta_lta(data_arr, self.nsta, self.nlta)
+        logger.info("Trigger Processor stopped.")
 
-        # The latest ratio is the last element of the array
-        current_ratio = cft[-1]
+    def _process_packet(self, state: StreamTrigger, packet: dict):
+        """Updates the STA/LTA of the packet's digitizer and handles its event state."""
+        current_ratio = state.add(packet)
+        if current_ratio is None:
+            return
 
         # Handle State Changes (Edge Detection) with Dual Thresholds (Hysteresis)
-        if current_ratio > self.thr_on and not self.last_trigger:
-            logger.warning(f"EARTHQUAKE DETECTED: STA/LTA ratio {current_ratio:.2f} > {self.thr_on}")
-            self.earthquake_event.set()
-            self.last_trigger = True
-
-        elif current_ratio < self.thr_off and self.last_trigger:
-            logger.info(f"Trigger cleared: Signal ratio {current_ratio:.2f} returned below {self.thr_off}")
-            self.earthquake_event.clear()
-            self.last_trigger = False
+        if current_ratio > state.thr_on and not state.last_trigger:
+            logger.warning(
+                f"EARTHQUAKE DETECTED on {state.stream_id}: STA/LTA ratio {current_ratio:.2f} > {state.thr_on}"
+            )
+            state.current_event = TriggerEvent(
+                type=TriggerEventType.TRIGGER_ON,
+                onset_index=state.last_index,
+                onset_time=state.last_timestamp,
+                peak_ratio=current_ratio,
+                channels=[state.trigger_channel],
+                stream=state.stream_id
+            )
+            state.peak_ratio = current_ratio
+            state.current_event.event_id = self._open_catalog_event(state.current_event)
+            self.event_bus.publish(state.current_event)
+            state.last_trigger = True
+
+            state.amplitude.start()
+            state.next_update_index = state.last_index + int(
+                state.settings.trigger.magnitude_delay_sec * state.sampling_rate
+            )
+            state.reported_peak = 0.0
+
+        elif state.last_trigger:
+            # Keep track of the largest ratio reached during the event
+            state.peak_ratio = max(state.peak_ratio, current_ratio)
+
+            # First estimate after `magnitude_delay_sec`, then once per second while
+            # the amplitudes grow
+            if state.last_index >= state.next_update_index:
+                state.next_update_index = state.last_index + state.sampling_rate
+                if state.amplitude.wood_anderson_peak > state.reported_peak:
+                    self._publish_trigger_update(state)
+
+            if current_ratio < state.thr_off:
+                logger.info(
+                    f"Trigger cleared on {state.stream_id}: Signal ratio {current_ratio:.2f} "
+                    f"returned below {state.thr_off}"
+                )
+                self._publish_trigger_off(state)
+
+    def _publish_trigger_update(self, state: StreamTrigger):
+        amplitudes = state.amplitude.amplitudes(state.settings)
+        event = TriggerEvent(
+            type=TriggerEventType.TRIGGER_UPDATE,
+            onset_index=state.current_event.onset_index,
+            onset_time=state.current_event.onset_time,
+            peak_ratio=state.peak_ratio,
+            channels=state.current_event.channels,
+            event_id=state.current_event.event_id,
+            stream=state.stream_id,
+            amplitudes=amplitudes,
+            magnitude=state.amplitude.magnitude(state.settings, amplitudes)
+        )
+        state.reported_peak = state.amplitude.wood_anderson_peak
+
+        if event.magnitude is not None:
+            logger.info("Event on %s: ML %.1f %.1f s after the onset", state.stream_id, event.magnitude,
+                        (state.last_index - event.onset_index) / state.sampling_rate)
+        self.event_bus.publish(event)
+
+    def _publish_trigger_off(self, state: StreamTrigger):
+        amplitudes = state.amplitude.amplitudes(state.settings)
+        state.amplitude.stop()
+
+        event = TriggerEvent(
+            type=TriggerEventType.TRIGGER_OFF,
+            onset_index=state.current_event.onset_index,
+            onset_time=state.current_event.onset_time,
+            peak_ratio=state.peak_ratio,
+            channels=state.current_event.channels,
+            offset_index=state.last_index,
+            offset_time=state.last_timestamp,
+            event_id=state.current_event.event_id,
+            stream=state.stream_id,
+            amplitudes=amplitudes,
+            magnitude=state.amplitude.magnitude(state.settings, amplitudes)
+        )
+        self._close_catalog_event(event)
+        self.event_bus.publish(event)
+        state.current_event = None
+        state.last_trigger = False
+
+    def _open_catalog_event(self, event: TriggerEvent) -> int | None:
+        try:
+            return self.catalog.open_event(event)
+        except Exception:
+            logger.exception("Unable to store the event in the catalog")
+            return None
+
+    def _close_catalog_event(self, event: TriggerEvent):
+        if event.event_id is None:
+            return
+
+        try:
+            self.catalog.close_event(event)
+        except Exception:
+            logger.exception("Unable to update the event in the catalog")
@@ -1,58 +1,123 @@
 from threading import Thread, Event
 from queue import Queue, Empty
 from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
 from logging import getLogger
 import json
+import time
 import asyncio
 
 import numpy as np
-import websockets
-from obspy import UTCDateTime, Trace
 
+from src.jobs.reconfigurable import Reconfigurable
 from src.settings import Settings
+from src.utils.dataselect import ArchiveReader, DataSelectQuery
+from src.utils.event_bus import EventBus
+from src.utils.metrics import REGISTRY
+from src.utils.scheduling import Inbox
 
 logger = getLogger(__name__)
 
-class WebSocketSender(Thread):
+DATASELECT_PATH = "/fdsnws/dataselect/1/"
+DATASELECT_VERSION = "1.1.0"
+
+HTTP_REASONS = {
+    200: "OK", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"
+}
+
+class WebSocketSender(Reconfigurable, Thread):
     """Thread that serves a WebSocket endpoint to broadcast decimated seismic data
-    in real-time to connected clients. It maintains a sliding window buffer for each channel,
+    in real-time to connected clients. It maintains a sliding window buffer for each channel of every digitizer,
     applies decimation, and sends downsampled data every second.
+
+    With a `data_dir`, the same event loop serves the archive on `http_port` as an
+    FDSN dataselect service (/fdsnws/dataselect/1/query): the matching records are
+    read in batches in the executor and sent with chunked transfer as the client
+    takes them, at most `max_dataselect_requests` at a time.
     """
+    follows_packets = True
+
     def __init__(
         self,
         settings: Settings,
         data_queue: Queue,
         shutdown_event: Event,
-        earthquake_event: Event,
+        event_bus: EventBus,
         host: str = "0.0.0.0",
-        port: int = 8765
+        port: int = 8765,
+        data_dir: Path | None = None,
+        http_port: int = 8080,
+        max_dataselect_requests: int = 4
     ):
         super().__init__(daemon=True)
         self.data_queue = data_queue
         self.shutdown_event = shutdown_event
-        self.earthquake_event = earthquake_event
+        self.inbox = Inbox(data_queue, "websocket")
+        self.events = event_bus.subscribe(self.inbox)
         self.host = host
         self.port = port
         self.settings = settings
+        self.data_dir = data_dir
+        self.http_port = http_port
+        self.max_dataselect_requests = max_dataselect_requests
 
         self._clients = set()
+        self._dataselect_requests = 0
 
-        # Sliding Window Config
-        # window_size: 5s buffer for filter stability
-        # step_size: 1s update interval
-        self.window_size = int(self.settings.mcu.sampling_rate * 5)
-        self.step_size = int(self.settings.mcu.sampling_rate)
+        self._configure(settings)
 
-        # Per-channel state: { "EHZ": {"data": deque, "time": deque, "counter": 0}, ... }
+        self._samples_processed = REGISTRY.counter(
+            "rpi_seism_samples_total", "Samples processed by each stage", stage="websocket"
+        )
+        self._processing_time = REGISTRY.histogram(
+            "rpi_seism_processing_seconds", "Processing time of a unit of work of each stage", stage="websocket"
+        )
+        self._latency = REGISTRY.histogram(
+            "rpi_seism_latency_seconds", "Delay between the serial receive of a sample and its use",
+            stage="websocket"
+        )
+        self._dataselect_bytes = REGISTRY.counter(
+            "rpi_seism_dataselect_bytes_total", "MiniSEED bytes sent by the dataselect service"
+        )
+
+    def _configure(self, settings: Settings):
+        # Settings of every digitizer, by stream id
+        self.streams = {s.stream_id: s for s in settings.streams()}
+
+        # Per-channel state: { ("XX.RPI3.", "EHZ"): {"data": deque, "time": deque, "counter": 0}, ... }
         self.channels_state = {}
 
+    def _on_settings_changed(self, new: Settings):
+        # The windows depend on the sampling rate, the channel names on the channels
+        def layout(s: Settings):
+            return (s.stream_id, s.mcu.sampling_rate, s.channels)
+
+        if [layout(s) for s in new.streams()] != [layout(s) for s in self.streams.values()]:
+            logger.info("WebSocket Sender reconfigured, resetting the sliding windows.")
+            self._configure(new)
+        else:
+            self.streams = {s.stream_id: s for s in new.streams()}
+
     def run(self):
         asyncio.run(self._main_loop())
 
     async def _main_loop(self):
+        import websockets
+
         async with websockets.serve(self._handle_connection, self.host, self.port):
             logger.info("WebSocket Server started on ws://%s:%d", self.host, self.port)
-            await self._producer_loop()
+
+            if self.data_dir is None:
+                await self._producer_loop()
+                return
+
+            async with await asyncio.start_server(self._handle_http, self.host, self.http_port):
+                logger.info("FDSN dataselect service started on http://%s:%d%squery",
+                            self.host, self.http_port, DATASELECT_PATH)
+                await self._producer_loop()
 
     async def _handle_connection(self, websocket):
         self._clients.add(websocket)
@@ -61,51 +126,206 @@ class WebSocketSender(Thread):
         finally:
             self._clients.discard(websocket)
 
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serves one HTTP request, then closes the connection."""
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=30)
+                method, target, version = head.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+            except asyncio.LimitOverrunError:
+                await self._http_reply(writer, 413, "Request header too large")
+            except ValueError:
+                await self._http_reply(writer, 400, "Malformed request line")
+            else:
+                await self._handle_request(writer, method, target, version)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, writer: asyncio.StreamWriter, method: str, target: str, version: str):
+        url = urlsplit(target)
+        status = None
+
+        try:
+            if method != "GET":
+                status = 405
+                await self._http_reply(writer, 405, f"{method} is not supported, use GET")
+            elif url.path == DATASELECT_PATH + "version":
+                await self._http_reply(writer, 200, DATASELECT_VERSION)
+            elif url.path == DATASELECT_PATH + "query":
+                status = await self._dataselect(writer, url.query, version == "HTTP/1.1", target)
+            else:
+                status = 404
+                await self._http_reply(writer, 404, f"Unknown path {url.path}")
+        except ConnectionError:
+            status = "aborted"
+        except Exception:
+            logger.exception("Error in dataselect request %s", target)
+            status = "error"
+
+        if status is not None:
+            REGISTRY.counter(
+                "rpi_seism_dataselect_requests_total", "Dataselect queries, by response status",
+                status=str(status)
+            ).inc()
+
+    async def _dataselect(self, writer: asyncio.StreamWriter, query_string: str, chunked: bool, target: str):
+        """Streams the records matching the query, returns the response status."""
+        params = parse_qs(query_string, keep_blank_values=True)
+        nodata = 404 if params.get("nodata", ["204"])[-1] == "404" else 204
+
+        try:
+            query = DataSelectQuery.from_params(params)
+        except ValueError as e:
+            await self._http_reply(writer, 400, self._fdsn_error(400, str(e), target))
+            return 400
+
+        if self._dataselect_requests >= self.max_dataselect_requests:
+            await self._http_reply(writer, 503, self._fdsn_error(503, "Too many requests, retry later", target))
+            return 503
+
+        loop = asyncio.get_running_loop()
+        self._dataselect_requests += 1
+        archive = None
+        try:
+            # Listing the archive touches the disk as well
+            archive = await loop.run_in_executor(None, ArchiveReader, self.data_dir, query)
+
+            # The headers wait for the first records, so an empty selection gets its status
+            batch = await loop.run_in_executor(None, archive.read)
+            if not batch:
+                await self._http_reply(writer, nodata, self._fdsn_error(nodata, "No data selected", target))
+                return nodata
+
+            name = datetime.fromtimestamp(query.start_time, timezone.utc).strftime("%Y%m%dT%H%M%S")
+            await self._http_head(writer, 200, "application/vnd.fdsn.mseed", [
+                ("Content-Disposition", f'attachment; filename="dataselect_{name}.mseed"'),
+                ("Connection", "close")
+            ] + ([("Transfer-Encoding", "chunked")] if chunked else []))
+
+            while batch:
+                writer.write(b"%X\r\n%b\r\n" % (len(batch), batch) if chunked else batch)
+                # Slow clients pause the reads, only one batch is in memory
+                await writer.drain()
+                self._dataselect_bytes.inc(len(batch))
+
+                batch = await loop.run_in_executor(None, archive.read)
+
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+            return 200
+        finally:
+            if archive is not None:
+                archive.close()
+            self._dataselect_requests -= 1
+
+    @staticmethod
+    def _fdsn_error(status: int, detail: str, target: str) -> str:
+        """Error body of the FDSN web services."""
+        return (
+            f"Error {status}: {HTTP_REASONS[status]}\n\n{detail}\n\n"
+            f"Request:\n{target}\n\n"
+            f"Request Submitted:\n{datetime.now(timezone.utc).isoformat()}\n\n"
+            f"Service version:\n{DATASELECT_VERSION}\n"
+        )
+
+    async def _http_reply(self, writer: asyncio.StreamWriter, status: int, text: str):
+        body = text.encode("utf-8") if status != 204 else b""
+        await self._http_head(writer, status, "text/plain; charset=utf-8", [
+            ("Content-Length", str(len(body))), ("Connection", "close")
+        ])
+        writer.write(body)
+        await writer.drain()
+
+    @staticmethod
+    async def _http_head(writer: asyncio.StreamWriter, status: int, content_type: str,
+                         headers: list[tuple[str, str]]):
+        lines = [f"HTTP/1.1 {status} {HTTP_REASONS[status]}", f"Content-Type: {content_type}"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
     async def _producer_loop(self):
         loop = asyncio.get_running_loop()
 
-        while not self.shutdown_event.is_set():
+        while not self.inbox.closed:
+            self._apply_pending_settings()
+
+            # Forward trigger records to the clients as soon as they are published
+            await self._broadcast_events()
+
             try:
-                # Expecting: {"timestamp": float, "measurements": [{"channel": obj, "value": int}, ...]}
-                packet = await loop.run_in_executor(None, self.data_queue.get, True, 0.5)
+                # Sleeps (in the executor) until data or a trigger record arrives
+                packets = await loop.run_in_executor(None, self.inbox.get)
+
+                # Expecting: {"stream": str, "timestamp": float, "measurements": [{"channel": obj, "value": int}, ...]}
+                for packet in packets:
+                    await self._add_packet(packet)
 
-                ts = packet["timestamp"]
+            except Exception:
+                logger.exception("Error in WebSocket producer loop")
+
+    async def _add_packet(self, packet: dict):
+        ts = packet["timestamp"]
+        self._samples_processed.inc()
+        self._follow_packet(packet)
+
+        settings = self.streams.get(packet["stream"])
+        if settings is None:
+            return
+
+        # Sliding Window Config
+        # window_size: 5s buffer for filter stability
+        # step_size: 1s update interval
+        window_size = int(settings.mcu.sampling_rate * 5)
+        step_size = int(settings.mcu.sampling_rate)
 
-                # update each channel's buffer
-                for item in packet["measurements"]:
-                    ch_name = item["channel"].name
-                    val = item["value"]
+        # update each channel's buffer
+        for item in packet["measurements"]:
+            key = (packet["stream"], item["channel"].name)
+            val = item["value"]
 
-                    if ch_name not in self.channels_state:
-                        self.channels_state[ch_name] = {
-                            "data": deque(maxlen=self.window_size),
-                            "time": deque(maxlen=self.window_size),
-                            "counter": 0
-                        }
+            if key not in self.channels_state:
+                self.channels_state[key] = {
+                    "data": deque(maxlen=window_size),
+                    "time": deque(maxlen=window_size),
+                    "counter": 0
+                }
 
-                    state = self.channels_state[ch_name]
-                    state["data"].append(float(val))
-                    state["time"].append(ts)
-                    state["counter"] += 1
+            state = self.channels_state[key]
+            state["data"].append(float(val))
+            state["time"].append(ts)
+            state["counter"] += 1
 
-                    # 3. Process every STEP_SIZE samples for THIS specific channel
-                    if (len(state["data"]) == self.window_size and 
-                        state["counter"] % self.step_size == 0):
-                        await self._process_and_broadcast(ch_name)
+            # 3. Process every STEP_SIZE samples for THIS specific channel
+            if (len(state["data"]) == window_size and
+                state["counter"] % step_size == 0):
+                started = time.perf_counter()
+                await self._process_and_broadcast(settings, key[1])
+                self._processing_time.observe(time.perf_counter() - started)
 
+    async def _broadcast_events(self):
+        """Broadcast pending trigger-on/trigger-off records."""
+        while True:
+            try:
+                event = self.events.get_nowait()
             except Empty:
-                continue
-            except Exception:
-                logger.exception("Error in WebSocket producer loop")
+                return
+
+            await self._broadcast(json.dumps(event.to_dict()))
+
+    async def _process_and_broadcast(self, settings: Settings, channel_name: str):
+        """Perform decimation and broadcast for a specific channel of a digitizer."""
+        from obspy import UTCDateTime, Trace
 
-    async def _process_and_broadcast(self, channel_name):
-        """Perform decimation and broadcast for a specific channel."""
-        state = self.channels_state[channel_name]
+        state = self.channels_state[(settings.stream_id, channel_name)]
 
         # Create Trace from current buffer
         data_array = np.array(state["data"])
         tr = Trace(data=data_array)
-        tr.stats.sampling_rate = self.settings.mcu.sampling_rate
+        tr.stats.sampling_rate = settings.mcu.sampling_rate
         tr.stats.starttime = UTCDateTime(state["time"][0])
 
         # Decimate (Anti-Alias filter applied)
@@ -119,11 +339,12 @@ class WebSocketSender(Thread):
             return
 
         # Extract the new batch of downsampled samples
-        new_samples_count = int(self.step_size / self.settings.decimation_factor)
+        new_samples_count = int(settings.mcu.sampling_rate / self.settings.decimation_factor)
         downsampled_values = tr_decimated.data[-new_samples_count:]
 
         # Construct and send the message
         message = json.dumps({
+            "stream": settings.stream_id,
             "channel": channel_name,
             "timestamp": tr_decimated.stats.endtime.isoformat(),
             "fs": tr_decimated.stats.sampling_rate, # This is the original rate
@@ -131,6 +352,7 @@ class WebSocketSender(Thread):
         })
 
         await self._broadcast(message)
+        self._latency.observe(time.time() - state["time"][-1])
 
     async def _broadcast(self, message):
         if not self._clients:
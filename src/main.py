@@ -1,12 +1,26 @@
+import time
+
+# Taken before the project imports to measure the cold start
+STARTUP_TIME = time.perf_counter()
+
 import signal
 
+from argparse import ArgumentParser
 from queue import Queue
 from pathlib import Path
 from threading import Event
 import logging
 
 from src.settings import Settings
-from src.jobs import Reader, MSeedWriter, WebSocketSender, TriggerProcessor, NotifierSender
+from src.jobs import (
+    Reader, MSeedReplay, MSeedWriter, WebSocketSender, TriggerProcessor, NotifierSender, ConfigWatcher, MetricsServer,
+    SeedLinkServer, ArchiveManager
+)
+from src.utils.event_bus import EventBus
+from src.utils.event_catalog import EventCatalog
+from src.utils.metrics import REGISTRY
+from src.utils.profiling import Profiler
+from src.utils.scheduling import SHUTDOWN
 
 
 logger = logging.getLogger(__name__)
@@ -19,13 +33,34 @@ def main():
     writing to MiniSEED files, sending data over WebSocket, and processing triggers.
     It also handles graceful shutdown on receiving termination signals.
     """
+    parser = ArgumentParser(description="Seismic data acquisition for the Raspberry Pi.")
+    parser.add_argument("--port", default="/dev/ttyUSB0",
+                        help="serial port of the main MCU (default: %(default)s), "
+                             "the other devices use the port in the settings")
+    parser.add_argument("--replay", nargs="+", type=Path, metavar="MSEED",
+                        help="stream these MiniSEED files instead of reading the MCU")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed relative to real time, 0 for as fast as possible (default: 1)")
+    parser.add_argument("--data-dir", type=Path, default=Path(__file__).parent.parent / "data",
+                        help="folder of the MiniSEED files and of the event catalog (default: data/)")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s [%(threadName)s] %(name)s: %(message)s"
+    )
+    logger.info("Modules imported in %.3f s", time.perf_counter() - STARTUP_TIME)
+
     # Define paths and load settings
-    data_base_folder = Path(__file__).parent.parent / "data"
+    data_base_folder = args.data_dir
     settings = Settings.load_settings()
 
     # Create a global shutdown event
     shutdown_event = Event()
-    earthquake_event = Event()
+    # Trigger records (onset/offset) are delivered to every subscribed job
+    event_bus = EventBus()
+    # Persistent catalog of the detected events
+    catalog = EventCatalog(data_base_folder / "events.sqlite")
 
     # Define a signal handler for systemd (SIGTERM)
     def handle_exit(sig, frame):
@@ -35,20 +70,58 @@ def main():
     signal.signal(signal.SIGTERM, handle_exit)
     signal.signal(signal.SIGINT, handle_exit)
 
+    # On-demand diagnostics written to data/profiles:
+    # SIGUSR1 dumps the thread stacks and a tracemalloc diff (the first one takes the baseline),
+    # SIGUSR2 starts a 30 s sampling profiler (or stops the running one)
+    profiler = Profiler(data_base_folder / "profiles")
+
+    def handle_dump(sig, frame):
+        profiler.dump_stacks()
+        profiler.memory_snapshot()
+
+    def handle_profile(sig, frame):
+        if not profiler.stop_sampling():
+            profiler.start_sampling(30)
+
+    signal.signal(signal.SIGUSR1, handle_dump)
+    signal.signal(signal.SIGUSR2, handle_profile)
+
     # Create queues for communication between jobs
     msed_writer_queue = Queue()
     websocket_queue = Queue()
     trigger_queue = Queue()
     notifier_queue = Queue()
-
-    # Create and start the Reader job thread (reads from ADC, puts data in the queues)
-    reader_job = Reader(
-        "/dev/ttyUSB0",
-        settings,
-        [msed_writer_queue, websocket_queue, trigger_queue, notifier_queue],
-        shutdown_event
-    )
-    reader_job.start()
+    seedlink_queue = Queue()
+
+    # Expose the depth of every queue, read at scrape time
+    for name, queue in (
+        ("mseed", msed_writer_queue),
+        ("websocket", websocket_queue),
+        ("trigger", trigger_queue),
+        ("notifier", notifier_queue),
+        ("seedlink", seedlink_queue)
+    ):
+        REGISTRY.gauge("rpi_seism_queue_depth", "Packets waiting in each consumer queue",
+                       callback=queue.qsize, queue=name)
+
+    # Create and start the metrics endpoint (Prometheus text format)
+    metrics_job = MetricsServer(shutdown_event, profiler=profiler)
+    metrics_job.start()
+
+    # Create and start the data source threads: a Reader for every MCU or the replay of
+    # archived files, all put the data in the same queues
+    queues = [msed_writer_queue, websocket_queue, trigger_queue, notifier_queue, seedlink_queue]
+    if args.replay:
+        source_jobs = [MSeedReplay(args.replay, settings, queues, shutdown_event, speed=args.speed)]
+    else:
+        main_settings, *device_settings = settings.streams()
+        source_jobs = [Reader(args.port, main_settings, queues, shutdown_event)] + [
+            Reader(device.port, stream, queues, shutdown_event, de_pin=device.de_pin)
+            for device, stream in zip(settings.devices, device_settings)
+        ]
+
+    for source_job in source_jobs:
+        source_job.start()
 
     # Create and start the MSeedWriter job thread (writes data to MiniSEED file)
     m_seed_writer_job = MSeedWriter(
@@ -56,18 +129,20 @@ def main():
         msed_writer_queue,
         data_base_folder,
         shutdown_event,
-        earthquake_event,
+        event_bus,
+        catalog,
         write_interval_sec=1800
     )
     m_seed_writer_job.start()
 
-    # Create and start the WebSocketSender job thread (sends data over WebSocket)
+    # Create and start the WebSocketSender job thread (sends data over WebSocket, serves the archive over HTTP)
     websocket_job = WebSocketSender(
         settings,
         websocket_queue,
         shutdown_event,
-        earthquake_event,
-        host="0.0.0.0"
+        event_bus,
+        host="0.0.0.0",
+        data_dir=data_base_folder
     )
     websocket_job.start()
 
@@ -76,7 +151,8 @@ def main():
         settings,
         trigger_queue,
         shutdown_event,
-        earthquake_event
+        event_bus,
+        catalog
     )
     trigger_processor_job.start()
 
@@ -85,19 +161,56 @@ def main():
         settings,
         notifier_queue,
         shutdown_event,
-        earthquake_event
+        event_bus
     )
     notifier_job.start()
 
+    # Create and start the SeedLinkServer job thread (serves MiniSEED records to SeedLink clients)
+    seedlink_job = SeedLinkServer(
+        settings,
+        seedlink_queue,
+        shutdown_event,
+        host="0.0.0.0"
+    )
+    seedlink_job.start()
+
+    # Create and start the ArchiveManager job thread (compacts the archive and keeps it within its disk budget)
+    archive_job = ArchiveManager(
+        settings,
+        data_base_folder,
+        shutdown_event,
+        catalog
+    )
+    archive_job.start()
+
+    jobs = [
+        *source_jobs, m_seed_writer_job, websocket_job, trigger_processor_job, notifier_job, seedlink_job, archive_job
+    ]
+    # The memory reports list the size of the containers held by the jobs
+    profiler.jobs = jobs
+
+    # Apply changes of data/config.yml to the running jobs
+    config_watcher_job = ConfigWatcher(settings, jobs, shutdown_event)
+    config_watcher_job.start()
+
+    logger.info("All jobs started %.3f s after startup", time.perf_counter() - STARTUP_TIME)
 
     # Gracefully stop all threads
-    reader_job.join()
+    for source_job in source_jobs:
+        source_job.join()
+
+    # The consumers sleep on their queues: they stop once the packets queued before
+    # the token are processed
+    for queue in queues:
+        queue.put(SHUTDOWN)
 
     # Wait for all threads to finish
     m_seed_writer_job.join()
     websocket_job.join()
     trigger_processor_job.join()
     notifier_job.join()
+    seedlink_job.join()
+    archive_job.join()
 
     logger.debug("All threads stopped and the main script has finished.")
 
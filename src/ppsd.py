@@ -0,0 +1,84 @@
+"""
+Noise analysis of the archive: probabilistic power spectral densities (PPSD) from an
+incremental cache of PSD segments.
+
+    uv run python -m src.ppsd update                 # process the new archive files
+    uv run python -m src.ppsd plot XX.RPI3..EHZ --start 2024-01-01 --end 2024-01-08
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from pathlib import Path
+import logging
+
+from src.settings import Settings
+from src.utils.ppsd_cache import PPSDCache
+
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_time(value: str) -> float:
+    """ISO date or time, UTC unless an offset is given (2024-01-01, 2024-01-01T12:00)."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def main():
+    parser = ArgumentParser(description="Probabilistic power spectral densities of the rpi-seism archive.")
+    parser.add_argument("--data-dir", type=Path, default=Path(__file__).parent.parent / "data",
+                        help="folder of the MiniSEED files (default: data/)")
+    parser.add_argument("--cache-dir", type=Path,
+                        help="folder of the PSD cache (default: <data-dir>/ppsd)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    update = commands.add_parser("update", help="compute the PSD segments of the new archive files")
+    update.add_argument("--workers", type=int,
+                        help="worker processes for the backlog (default: one per CPU)")
+
+    plot = commands.add_parser("plot", help="plot the PPSD of a channel from the cache")
+    plot.add_argument("seed_id", nargs="?",
+                      help="channel, e.g. XX.RPI3..EHZ (default: list the cached channels)")
+    plot.add_argument("--start", type=_parse_time, help="first day or time, UTC (default: oldest cached)")
+    plot.add_argument("--end", type=_parse_time, help="last day or time, UTC (default: newest cached)")
+    plot.add_argument("--output", type=Path,
+                      help="image file (default: ppsd_<SEED id>.png in the cache folder)")
+    plot.add_argument("--percentiles", action="store_true", help="also draw the 10/50/90 percentiles")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    cache = PPSDCache(args.data_dir, Settings.load_settings(), folder=args.cache_dir)
+
+    if args.command == "update":
+        added = cache.update(workers=args.workers)
+        logger.info("%d new PSD segments cached in %s", added, cache.folder)
+        return
+
+    if not args.seed_id:
+        for seed_id in cache.seed_ids():
+            print(seed_id)
+        return
+
+    ppsd = cache.load(args.seed_id, args.start, args.end)
+    if ppsd is None or not len(ppsd.current_times_used):
+        logger.error("No cached PSD segments for %s in this range, run the update first.", args.seed_id)
+        return
+
+    # Headless, the plot is only written to a file
+    import matplotlib
+    matplotlib.use("Agg")
+
+    output = args.output or cache.folder / f"ppsd_{args.seed_id}.png"
+    ppsd.plot(
+        filename=str(output),
+        show_percentiles=args.percentiles,
+        percentiles=[10, 50, 90],
+        show=False
+    )
+    logger.info("PPSD of %d segments written to %s", len(ppsd.current_times_used), output)
+
+
+if __name__ == "__main__":
+    main()
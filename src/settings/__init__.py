@@ -1,11 +1,18 @@
 from pathlib import Path
 
 import yaml
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 
+from .archive import ArchiveSettings
 from .channel import Channel
+from .decimated_channels import DecimatedChannels
+from .device import Device
 from .mcu_settings import MCUSettings
 from .notifier import Notifier
+from .trigger import TriggerSettings
+
+
+CONFIG_PATH = Path(__file__).parent.parent.parent / "data/config.yml"
 
 
 class Settings(BaseModel):
@@ -16,20 +23,133 @@ class Settings(BaseModel):
     """
     network: str
     station: str
+    location: str = ""
 
     decimation_factor: int
     channels: list[Channel]
     mcu: MCUSettings
     notifiers: list[Notifier]
+    trigger: TriggerSettings = TriggerSettings()
+
+    # Digitizers besides the main one (described by network, station, channels and mcu)
+    devices: list[Device] = []
+
+    # Lower-rate copies of the channels archived by the MSeedWriter, each one decimated
+    # from the previous (higher) rate
+    decimated_channels: list[DecimatedChannels] = []
+
+    # Compaction and retention of the MiniSEED archive
+    archive: ArchiveSettings = ArchiveSettings()
+
+    @model_validator(mode='after')
+    def validate_adc_channels(self) -> 'Settings':
+        for channel in self.channels:
+            if not 0 <= channel.adc_channel < self.mcu.n_channels:
+                raise ValueError(
+                    f"Channel {channel.name} uses ADC channel {channel.adc_channel}, "
+                    f"but the MCU samples {self.mcu.n_channels} channels."
+                )
+
+        for device in self.devices:
+            for channel in device.channels:
+                if not 0 <= channel.adc_channel < device.mcu.n_channels:
+                    raise ValueError(
+                        f"Channel {channel.name} of {device.station} uses ADC channel {channel.adc_channel}, "
+                        f"but its MCU samples {device.mcu.n_channels} channels."
+                    )
+        return self
+
+    @model_validator(mode='after')
+    def validate_devices(self) -> 'Settings':
+        stream_ids = [self.stream_id] + [
+            f"{d.network}.{d.station}.{d.location}" for d in self.devices
+        ]
+        if len(set(stream_ids)) != len(stream_ids):
+            raise ValueError("Every device needs its own network, station and location codes.")
+
+        ports = [d.port for d in self.devices]
+        if len(set(ports)) != len(ports):
+            raise ValueError("Every device needs its own serial port.")
+
+        # GPIO 5 drives the MAX485 of the main digitizer
+        pins = [5] + [d.de_pin for d in self.devices if d.de_pin is not None]
+        if len(set(pins)) != len(pins):
+            raise ValueError("Devices can't share the same DE/RE pin (GPIO 5 is used by the main digitizer).")
+        return self
+
+    @model_validator(mode='after')
+    def validate_decimated_channels(self) -> 'Settings':
+        rates = [d.sampling_rate for d in self.decimated_channels]
+        if rates != sorted(set(rates), reverse=True):
+            raise ValueError("Decimated channels must be listed from the highest to the lowest rate.")
+
+        for stream in [self] + self.devices:
+            rate = stream.mcu.sampling_rate
+            names = {ch.name for ch in stream.channels}
+
+            for decimated in self.decimated_channels:
+                if rate % decimated.sampling_rate:
+                    raise ValueError(
+                        f"{decimated.sampling_rate} Hz is not an integer division of {rate} Hz "
+                        f"({stream.station}), the decimation factor must be an integer."
+                    )
+                rate = decimated.sampling_rate
+
+                decimated_names = {decimated.channel_name(name) for name in names}
+                if decimated_names & names:
+                    raise ValueError(f"Band code {decimated.band_code} gives the name of a recorded channel.")
+                names |= decimated_names
+
+        return self
+
+    @property
+    def stream_id(self) -> str:
+        """Network, station and location codes, e.g. "XX.RPI3." """
+        return f"{self.network}.{self.station}.{self.location}"
+
+    def streams(self) -> list["Settings"]:
+        """
+        Settings of every digitizer: the main one first, then the `devices`. Each one
+        has the codes, channels and MCU settings of its digitizer and shares the
+        others (trigger, notifiers, ...).
+        """
+        return [self.model_copy(update={"devices": []})] + [
+            self.model_copy(update={
+                "network": device.network,
+                "station": device.station,
+                "location": device.location,
+                "channels": device.channels,
+                "mcu": device.mcu,
+                "devices": []
+            })
+            for device in self.devices
+        ]
+
+    def stream(self, stream_id: str) -> "Settings | None":
+        """Settings of the digitizer with the given codes, None if it is not configured."""
+        return next((s for s in self.streams() if s.stream_id == stream_id), None)
+
+    def with_stream(self, stream: "Settings") -> "Settings":
+        """
+        Copy of the settings where the channels and MCU settings of the digitizer of
+        `stream` (one of `streams()`) are replaced by the ones of `stream`.
+        """
+        update = {"channels": stream.channels, "mcu": stream.mcu}
+        if stream.stream_id == self.stream_id:
+            return self.model_copy(update=update)
+
+        return self.model_copy(update={"devices": [
+            device.model_copy(update=update)
+            if f"{device.network}.{device.station}.{device.location}" == stream.stream_id else device
+            for device in self.devices
+        ]})
 
     def export_settings(self):
         """
         Export the current settings to a YAML file. This method serializes the settings
         to a YAML format and saves it to a predefined location.
         """
-        settings_file_path = Path(__file__).parent.parent.parent / "data/config.yml"
-
-        with open(settings_file_path, "w", encoding="UTF-8") as settings_file:
+        with open(CONFIG_PATH, "w", encoding="UTF-8") as settings_file:
             yaml.dump(self.model_dump(mode='json'), settings_file, indent=2)
 
     def update_from(self, new: "Settings") -> None:
@@ -50,7 +170,7 @@ class Settings(BaseModel):
         If the file exists, it reads the YAML content and initializes a
         Settings instance with the loaded values.
         """
-        base_path = Path(__file__).parent.parent.parent / "data/config.yml"
+        base_path = CONFIG_PATH
 
         # If YAML config does not exist
         if not base_path.exists():
@@ -107,7 +227,14 @@ class Settings(BaseModel):
                     "url": "tgram://{bot_token}/{chat_id}/",
                     "enabled": True
                 }
-            ]
+            ],
+            "trigger": {
+                "channel": "EHZ",
+                "sta_sec": 0.5,
+                "lta_sec": 10.0,
+                "thr_on": 3.5,
+                "thr_off": 1.5
+            }
         }
 
         return cls(**data)
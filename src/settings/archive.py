@@ -0,0 +1,30 @@
+from pydantic import BaseModel, model_validator
+
+
+class ArchiveSettings(BaseModel):
+    """
+    Pydantic model for the management of the MiniSEED archive by the ArchiveManager.
+    The files of past days are merged in day volumes when `compact` is set. The
+    oldest continuous data is deleted when the archive grows over `quota_gb` or the
+    free space of the disk falls under `min_free_gb` (both disabled when unset).
+    The job reads and writes at most `max_io_mb_per_sec` and checks the archive
+    every `check_interval_sec` seconds.
+    """
+    compact: bool = True
+    quota_gb: float | None = None
+    min_free_gb: float | None = None
+
+    max_io_mb_per_sec: float = 2.0
+    check_interval_sec: float = 600.0
+
+    @model_validator(mode='after')
+    def validate_limits(self) -> 'ArchiveSettings':
+        for name in ("quota_gb", "min_free_gb"):
+            value = getattr(self, name)
+            if value is not None and value <= 0:
+                raise ValueError(f"'{name}' must be positive.")
+
+        if self.max_io_mb_per_sec <= 0 or self.check_interval_sec <= 0:
+            raise ValueError("'max_io_mb_per_sec' and 'check_interval_sec' must be positive.")
+
+        return self
@@ -12,3 +12,6 @@ class Channel(BaseModel):
     name: str
     adc_channel: int
     orientation: ChannelOrientation
+
+    # Sensor sensitivity in V/(m/s), the default matches a common 4.5 Hz geophone
+    sensitivity: float = 28.8
@@ -0,0 +1,22 @@
+from pydantic import BaseModel, field_validator
+
+
+class DecimatedChannels(BaseModel):
+    """
+    Pydantic model for a lower-rate copy of the channels archived by the MSeedWriter.
+    Every channel is decimated to `sampling_rate` and archived under the same name
+    with the `band_code` as first letter, e.g. EHZ -> BHZ at 20 Hz or LHZ at 1 Hz.
+    """
+    band_code: str
+    sampling_rate: int
+
+    @field_validator("band_code")
+    @classmethod
+    def validate_band_code(cls, value: str) -> str:
+        if len(value) != 1 or not value.isalpha():
+            raise ValueError("The band code must be a single letter.")
+
+        return value.upper()
+
+    def channel_name(self, name: str) -> str:
+        return self.band_code + name[1:]
@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+
+from .channel import Channel
+from .mcu_settings import MCUSettings
+
+
+class Device(BaseModel):
+    """
+    Pydantic model for an additional digitizer (MCU) connected to the host. Every
+    device is read on its own serial port and identified by its network, station
+    and location codes; its channels are routed by these codes into the shared jobs.
+    """
+    port: str
+    # GPIO driving the DE/RE pins of the MAX485, None for adapters switching on their own
+    de_pin: int | None = None
+
+    network: str
+    station: str
+    location: str = ""
+
+    channels: list[Channel]
+    mcu: MCUSettings
@@ -1,7 +1,8 @@
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, Field, model_validator
 
 from src.settings.enums import DataRate, PGA
 from src.structs.mcu_settings import MCUSettingsFrame
+from src.structs.sample_block import SampleBlock
 
 
 # Map the Enum index to the actual frequency value (SPS)
@@ -25,19 +26,43 @@ SPS_MAPPING = {
 }
 
 
+# Map the PGA setting to the ADC full scale input range (± volts)
+FULL_SCALE_MAPPING = {
+    PGA.PGA_1: 5.0,
+    PGA.PGA_2: 2.5,
+    PGA.PGA_4: 1.25,
+    PGA.PGA_8: 0.625,
+    PGA.PGA_16: 0.3125,
+    PGA.PGA_32: 0.15625,
+    PGA.PGA_64: 0.078125,
+}
+
+# Largest positive value of the 24-bit ADC
+ADC_MAX_COUNTS = 2 ** 23 - 1
+
+# RS-485 line speed, every byte takes 10 bits (start, 8 data, stop)
+SERIAL_BAUDRATE = 250000
+
+
 class MCUSettings(BaseModel):
     sampling_rate: int
 
     adc_gain: PGA = PGA.PGA_64
     adc_sample_rate: DataRate = DataRate.DRATE_2000SPS
 
+    # Wire format: 1 = one 3-channel Sample per frame, 2 = blocks of `samples_per_frame`
+    # samples of `n_channels` channels (firmware without version 2 falls back to 1)
+    frame_version: int = Field(default=2, ge=1, le=2)
+    n_channels: int = Field(default=3, ge=1, le=255)
+    samples_per_frame: int = Field(default=10, ge=1, le=255)
+
     @model_validator(mode='after')
     def validate_timing_margin(self) -> 'MCUSettings':
         actual_sps = SPS_MAPPING[self.adc_sample_rate]
 
-        # Total time to cycle 3 channels (3 readings * 3 filter cycles each)
+        # Total time to cycle the channels (3 filter cycles for each reading)
         # We add a 10% safety margin for SPI overhead
-        estimated_conversion_time = (9.0 / actual_sps) * 1.10
+        estimated_conversion_time = (3.0 * self.n_channels / actual_sps) * 1.10
         available_time = 1.0 / self.sampling_rate
 
         if estimated_conversion_time > available_time:
@@ -54,13 +79,42 @@ class MCUSettings(BaseModel):
 
             raise ValueError(
                 f"Sampling Rate ({self.sampling_rate}Hz) is too high for the current ADC speed ({actual_sps} SPS)!\n"
-                f"Multiplexing 3 channels requires ~{estimated_conversion_time*1000:.2f}ms, "
+                f"Multiplexing {self.n_channels} channels requires ~{estimated_conversion_time*1000:.2f}ms, "
                 f"but your loop only allows {available_time*1000:.2f}ms.\n\n"
                 f"RECOMMENDATION: Increase 'adc_sample_rate' to "
                 f"{SPS_MAPPING[suggestion]} SPS (Index: {suggestion}) to ensure the ADC can keep up."
             )
         return self
 
+    @model_validator(mode='after')
+    def validate_bandwidth(self) -> 'MCUSettings':
+        if self.frame_version == 1 and self.n_channels != 3:
+            raise ValueError("Frame version 1 carries exactly 3 channels, use frame_version 2.")
+
+        max_rate = SERIAL_BAUDRATE / 10 / self.bytes_per_sample
+        if self.sampling_rate > max_rate:
+            raise ValueError(
+                f"Sampling Rate ({self.sampling_rate}Hz) is too high for the serial line!\n"
+                f"With frame version {self.frame_version} and {self.samples_per_frame} samples per frame "
+                f"{SERIAL_BAUDRATE} baud carry at most {max_rate:.0f} samples/s."
+            )
+        return self
+
+    @property
+    def bytes_per_sample(self) -> float:
+        """Bytes sent on the serial line for every sample, headers included."""
+        # Imported here, src.structs.sample depends on the settings package
+        from src.structs.sample import Sample
+
+        if self.frame_version == 1:
+            return Sample.PACKET_SIZE
+        return SampleBlock.frame_size(self.n_channels, self.samples_per_frame) / self.samples_per_frame
+
+    @property
+    def volts_per_count(self) -> float:
+        """Input voltage corresponding to one ADC count with the configured gain."""
+        return FULL_SCALE_MAPPING[self.adc_gain] / ADC_MAX_COUNTS
+
     @property
     def to_bytes(self) -> bytes:
         return MCUSettingsFrame(
@@ -68,5 +122,13 @@ class MCUSettings(BaseModel):
             0xDD,
             self.sampling_rate,
             self.adc_gain,
-            self.adc_sample_rate
+            self.adc_sample_rate,
+            self.frame_version,
+            self.n_channels,
+            self.samples_per_frame
         ).to_bytes()
+
+    @property
+    def legacy(self) -> 'MCUSettings':
+        """The same settings with the version 1 frames, for firmware without version 2."""
+        return self.model_copy(update={"frame_version": 1, "samples_per_frame": 1})
@@ -0,0 +1,36 @@
+from pydantic import BaseModel, model_validator
+
+
+class TriggerSettings(BaseModel):
+    """
+    Pydantic model for the STA/LTA trigger configuration. Window lengths are in seconds,
+    the trigger turns on when the STA/LTA ratio exceeds `thr_on` and off when it
+    returns below `thr_off`.
+
+    The local magnitude is first estimated `magnitude_delay_sec` after the onset. A
+    single station can't locate the event, the magnitude assumes an hypocentral
+    distance of `magnitude_distance_km`.
+    """
+    channel: str = "EHZ"
+
+    sta_sec: float = 0.5
+    lta_sec: float = 10.0
+
+    thr_on: float = 3.5
+    thr_off: float = 1.5
+
+    magnitude_delay_sec: float = 3.0
+    magnitude_distance_km: float = 20.0
+
+    @model_validator(mode='after')
+    def validate_windows(self) -> 'TriggerSettings':
+        if self.sta_sec >= self.lta_sec:
+            raise ValueError("The STA window must be shorter than the LTA window.")
+
+        if self.thr_off >= self.thr_on:
+            raise ValueError("'thr_off' must be lower than 'thr_on'.")
+
+        if self.magnitude_distance_km <= 0:
+            raise ValueError("'magnitude_distance_km' must be positive.")
+
+        return self
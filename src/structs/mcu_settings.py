@@ -9,10 +9,18 @@ class MCUSettingsFrame:
     sampling_speed: int
     adc_gain: int
     adc_data_rate: int
+    # Frame format negotiated with the MCU: 1 = one Sample per frame (legacy firmware),
+    # 2 = SampleBlock frames of `samples_per_frame` samples of `n_channels` channels
+    frame_version: int = 1
+    n_channels: int = 3
+    samples_per_frame: int = 1
 
     # The format string for struct (little-endian)
     PACKET_FORMAT = "<BBHBB"
     PACKET_SIZE = struct.calcsize(PACKET_FORMAT)
+    # Version 2 appends the frame version, the number of channels and samples per frame,
+    # the legacy firmware echoes the first PACKET_SIZE bytes only
+    EXTENSION_FORMAT = "<BBB"
 
     @classmethod
     def from_bytes(cls, data: bytes):
@@ -36,7 +44,12 @@ class MCUSettingsFrame:
         """
         Convert the Sample instance to bytes for transmission or storage.
         """
-        return struct.pack(self.PACKET_FORMAT, self.header_1, self.header_2, self.sampling_speed, self.adc_gain, self.adc_data_rate)
+        data = struct.pack(self.PACKET_FORMAT, self.header_1, self.header_2, self.sampling_speed, self.adc_gain, self.adc_data_rate)
+
+        if self.frame_version > 1:
+            data += struct.pack(self.EXTENSION_FORMAT, self.frame_version, self.n_channels, self.samples_per_frame)
+
+        return data
 
     def verify_checksum(self, data: bytes):
         """
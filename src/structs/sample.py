@@ -51,8 +51,9 @@ class Sample:
             calculated ^= b
         return calculated == data[-1]
 
-    def to_dict(self, timestamp: int, channels: Dict[int, Channel]):
+    def to_dict(self, index: int, timestamp: float, channels: Dict[int, Channel]):
         return {
+            "index": index,
             "timestamp": timestamp,
             "measurements": [
                 {"channel": channels.get(0), "value": self.ch0},
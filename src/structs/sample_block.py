@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+import struct
+import zlib
+
+import numpy as np
+
+
+@dataclass
+class SampleBlock:
+    """
+    Frame of the version 2 wire format: `n_samples` consecutive samples of `n_channels`
+    channels under a single header.
+
+        0xAA 0xBC  version  n_channels  n_samples  sequence (uint16)  payload  crc32 (uint32)
+
+    The payload holds the samples in order, every sample holds its channels in order,
+    every value is a 24-bit little-endian two's complement integer. The sequence counter
+    wraps at 65536 and the CRC-32 covers everything between the headers and the CRC.
+    """
+    sequence: int
+    values: np.ndarray  # shape (n_samples, n_channels), int32
+
+    HEADER = b"\xaa\xbc"
+    VERSION = 2
+    # The format string for struct (little-endian): headers, version, channels, samples, sequence
+    HEADER_FORMAT = "<BBBBBH"
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+    CRC_SIZE = 4
+    VALUE_SIZE = 3
+
+    @classmethod
+    def frame_size(cls, n_channels: int, n_samples: int) -> int:
+        return cls.HEADER_SIZE + n_samples * n_channels * cls.VALUE_SIZE + cls.CRC_SIZE
+
+    def to_bytes(self) -> bytes:
+        """
+        Convert the block to bytes for transmission or storage.
+        """
+        n_samples, n_channels = self.values.shape
+        header = struct.pack(
+            self.HEADER_FORMAT, self.HEADER[0], self.HEADER[1],
+            self.VERSION, n_channels, n_samples, self.sequence & 0xFFFF
+        )
+        payload = self.values.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :self.VALUE_SIZE].tobytes()
+        crc = zlib.crc32(header[2:] + payload)
+
+        return header + payload + struct.pack("<I", crc)
+
+    @classmethod
+    def decode_stream(
+        cls, buffer: bytearray, n_channels: int, n_samples: int
+    ) -> tuple[np.ndarray, list[int], int]:
+        """
+        Extracts every complete frame from the buffer, leaving the incomplete tail.
+        Frames with a wrong CRC are skipped by looking for the next header.
+
+        Returns the samples of the valid frames (shape (frames * n_samples, n_channels),
+        int32), the sequence number of every frame and the number of CRC failures.
+        """
+        size = cls.frame_size(n_channels, n_samples)
+        prefix = cls.HEADER + bytes([cls.VERSION, n_channels, n_samples])
+        starts = []
+        sequences = []
+        crc_failures = 0
+        pos = 0
+
+        with memoryview(buffer) as view:
+            while len(buffer) - pos >= size:
+                if buffer.startswith(prefix, pos):
+                    crc, = struct.unpack_from("<I", buffer, pos + size - cls.CRC_SIZE)
+
+                    if zlib.crc32(view[pos + 2:pos + size - cls.CRC_SIZE]) == crc:
+                        sequences.append(struct.unpack_from("<H", buffer, pos + 5)[0])
+                        starts.append(pos)
+                        pos += size
+                        continue
+
+                    crc_failures += 1
+
+                # Not a (valid) frame, slide to the next header
+                pos = buffer.find(cls.HEADER, pos + 1)
+                if pos == -1:
+                    # Keep a possible first header byte
+                    pos = len(buffer) - 1
+                    break
+
+            # Decode all the payloads at once
+            data = np.frombuffer(view, dtype=np.uint8)
+            payload_size = n_samples * n_channels * cls.VALUE_SIZE
+            offsets = np.asarray(starts, dtype=np.intp)[:, None] + cls.HEADER_SIZE + np.arange(payload_size)
+            raw = data[offsets].reshape(-1, cls.VALUE_SIZE).astype(np.int32)
+            del data
+
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        # Sign extension of the 24-bit values
+        values = (values ^ 0x800000) - 0x800000
+
+        del buffer[:pos]
+
+        return values.reshape(-1, n_channels), sequences, crc_failures
@@ -0,0 +1,80 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from enum import StrEnum
+
+
+class TriggerEventType(StrEnum):
+    """Kind of record published on the event bus by the trigger."""
+    TRIGGER_ON = 'trigger_on'
+    TRIGGER_UPDATE = 'trigger_update'
+    TRIGGER_OFF = 'trigger_off'
+
+
+@dataclass
+class ChannelAmplitude:
+    """
+    Ground motion of one channel since the onset of an event: peak of the samples
+    (offset removed) in counts and in ground velocity (m/s), RMS velocity, and peak of
+    the Wood-Anderson simulation (static magnification 1) in nanometres.
+    """
+    peak_counts: int
+    peak_velocity: float
+    rms_velocity: float
+    wood_anderson_nm: float
+
+    def to_dict(self) -> dict:
+        return {
+            "peak_counts": self.peak_counts,
+            "peak_velocity": self.peak_velocity,
+            "rms_velocity": self.rms_velocity,
+            "wood_anderson_nm": self.wood_anderson_nm
+        }
+
+
+@dataclass
+class TriggerEvent:
+    """
+    Record describing a trigger transition. Onset/offset indices are absolute
+    sample indices as stamped by the Reader, times are UTC POSIX timestamps.
+    Offset fields are only populated on TRIGGER_OFF records, event_id is the
+    row of the event in the catalog (if it could be stored). Indices are counted
+    separately for every digitizer, identified by `stream` ("NET.STA.LOC").
+
+    TRIGGER_UPDATE records are published while the event goes on, a few seconds
+    after the onset and then whenever the amplitudes grow: `amplitudes` (by channel
+    name) and the local magnitude `magnitude` are measured from the onset to the
+    latest sample, they are final on the TRIGGER_OFF record.
+    """
+    type: TriggerEventType
+    onset_index: int
+    onset_time: float
+    peak_ratio: float
+    channels: list[str] = field(default_factory=list)
+    offset_index: int | None = None
+    offset_time: float | None = None
+    event_id: int | None = None
+    stream: str | None = None
+    amplitudes: dict[str, ChannelAmplitude] = field(default_factory=dict)
+    magnitude: float | None = None
+
+    @property
+    def onset_datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.onset_time, tz=timezone.utc)
+
+    def to_dict(self) -> dict:
+        return {
+            "type": str(self.type),
+            "event_id": self.event_id,
+            "stream": self.stream,
+            "onset_index": self.onset_index,
+            "onset_time": self.onset_datetime.isoformat(),
+            "peak_ratio": self.peak_ratio,
+            "channels": self.channels,
+            "offset_index": self.offset_index,
+            "offset_time": (
+                datetime.fromtimestamp(self.offset_time, tz=timezone.utc).isoformat()
+                if self.offset_time is not None else None
+            ),
+            "magnitude": self.magnitude,
+            "amplitudes": {name: a.to_dict() for name, a in self.amplitudes.items()}
+        }
@@ -0,0 +1,355 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+from pathlib import Path
+from logging import getLogger
+import bisect
+import re
+import struct
+
+logger = getLogger(__name__)
+
+# Continuous files and day volumes (data_20240101T000000.mseed, data_20240101_B.mseed...)
+# and event files (data_EQ_20240101T010203.mseed, data_EQ_20240101.mseed)
+ARCHIVE_FILE_PATTERN = re.compile(
+    r"^data_(?P<event>EQ_)?(?P<day>\d{8})(?:T(?P<time>\d{6}))?(?:_(?P<suffix>\w+))?\.mseed$"
+)
+
+DAY = 86400
+# Event files hold the data around the onset in their name (pre- and post-event windows)
+EVENT_FILE_MARGIN = 3600
+# The traces of the digitizers in a file don't start on the same sample
+SPAN_MARGIN = 60
+# Enough for the fixed header and the blockettes that precede blockette 1000
+HEADER_SIZE = 256
+
+# Fixed section of the data header and blockette header (type, offset of the next one),
+# without byte order: it is given by the record
+_FIXED_HEADER = "6sc1x5s2s3s2sHHBBBxHHhhBBBBlHH"
+_BLOCKETTE = "HH"
+
+
+@dataclass(frozen=True, slots=True)
+class RecordHeader:
+    """Codes and time span of a MiniSEED record, from its fixed header and blockette 1000."""
+    network: str
+    station: str
+    location: str
+    channel: str
+    start_time: float
+    end_time: float
+    sampling_rate: float
+    length: int
+
+    @property
+    def seed_id(self) -> str:
+        return f"{self.network}.{self.station}.{self.location}.{self.channel}"
+
+
+def _sampling_rate(factor: int, multiplier: int) -> float:
+    if factor == 0 or multiplier == 0:
+        return 0.0
+    if factor > 0:
+        return factor * multiplier if multiplier > 0 else -factor / multiplier
+    return -multiplier / factor if multiplier > 0 else 1.0 / (factor * multiplier)
+
+
+def read_header(data: bytes) -> RecordHeader:
+    """Parses the beginning of a MiniSEED record, ValueError if it isn't one."""
+    if len(data) < 64:
+        raise ValueError("Truncated record")
+
+    # The byte order is the one that gives a plausible year
+    for order in (">", "<"):
+        fields = struct.unpack_from(order + _FIXED_HEADER, data)
+        year, day = fields[6], fields[7]
+        if 1900 <= year <= 2500 and 1 <= day <= 366:
+            break
+    else:
+        raise ValueError("Not a MiniSEED record")
+
+    (_, quality, station, location, channel, network, year, day, hour, minute, second,
+     ten_thousandths, count, factor, multiplier, activity, _, _, _, correction, _, blockette) = fields
+    if quality not in b"DRQM":
+        raise ValueError("Not a data record")
+
+    # Record length from blockette 1000
+    length = None
+    while blockette and blockette + 7 <= len(data):
+        kind, following = struct.unpack_from(order + _BLOCKETTE, data, blockette)
+        if kind == 1000:
+            length = 1 << data[blockette + 6]
+            break
+        if following <= blockette:
+            break
+        blockette = following
+    if length is None:
+        raise ValueError("Record without blockette 1000")
+
+    start = datetime(year, 1, 1, tzinfo=timezone.utc).timestamp()
+    start += (day - 1) * DAY + hour * 3600 + minute * 60 + second + ten_thousandths / 1e4
+    # Bit 1 of the activity flags: the time correction is already in the start time
+    if not activity & 0x02:
+        start += correction / 1e4
+
+    rate = _sampling_rate(factor, multiplier)
+    end = start + (count - 1) / rate if rate > 0 and count > 0 else start
+
+    return RecordHeader(
+        network.decode("ascii", "replace").strip(),
+        station.decode("ascii", "replace").strip(),
+        location.decode("ascii", "replace").strip(),
+        channel.decode("ascii", "replace").strip(),
+        start, end, rate, length
+    )
+
+
+def parse_time(value: str) -> float:
+    """FDSN time, "YYYY-MM-DD[THH:MM:SS[.ffffff]]" in UTC."""
+    value = value.strip()
+    try:
+        moment = datetime.fromisoformat(value.removesuffix("Z"))
+    except ValueError:
+        raise ValueError(f"Invalid time {value!r}") from None
+
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _patterns(values: list[str], default: str = "*") -> list[str]:
+    """Comma-separated lists of codes with the ? and * wildcards, "--" is the empty location."""
+    patterns = [p.strip() for v in values for p in v.split(",") if p.strip()] or [default]
+    for pattern in patterns:
+        if not re.fullmatch(r"[A-Za-z0-9?*-]{1,5}", pattern):
+            raise ValueError(f"Invalid code {pattern!r}")
+
+    return ["" if p == "--" else p.upper() for p in patterns]
+
+
+@dataclass
+class DataSelectQuery:
+    """
+    Selection of an FDSN dataselect request: SEED codes (wildcards allowed) and a
+    time window. A record matches when its codes do and its span overlaps the window.
+    """
+    start_time: float
+    end_time: float
+    networks: list[str] = field(default_factory=lambda: ["*"])
+    stations: list[str] = field(default_factory=lambda: ["*"])
+    locations: list[str] = field(default_factory=lambda: ["*"])
+    channels: list[str] = field(default_factory=lambda: ["*"])
+
+    # Short and long names of the FDSN parameters
+    ALIASES = {
+        "net": "network", "sta": "station", "loc": "location", "cha": "channel",
+        "start": "starttime", "end": "endtime"
+    }
+
+    @classmethod
+    def from_params(cls, params: dict[str, list[str]]) -> 'DataSelectQuery':
+        """Builds the query from the URL parameters, ValueError on an invalid request."""
+        values: dict[str, list[str]] = {}
+        for name, value in params.items():
+            name = cls.ALIASES.get(name.lower(), name.lower())
+            values.setdefault(name, []).extend(value)
+
+        # The other FDSN options (quality, minimumlength, longestonly) are not implemented
+        unknown = set(values) - {
+            "network", "station", "location", "channel", "starttime", "endtime", "format", "nodata"
+        }
+        if unknown:
+            raise ValueError(f"Unsupported parameters: {', '.join(sorted(unknown))}")
+
+        if "starttime" not in values or "endtime" not in values:
+            raise ValueError("'starttime' and 'endtime' are required")
+        if values.get("format", ["miniseed"])[-1].lower() != "miniseed":
+            raise ValueError("Only the 'miniseed' format is available")
+
+        query = cls(
+            start_time=parse_time(values["starttime"][-1]),
+            end_time=parse_time(values["endtime"][-1]),
+            networks=_patterns(values.get("network", [])),
+            stations=_patterns(values.get("station", [])),
+            locations=_patterns(values.get("location", [])),
+            channels=_patterns(values.get("channel", []))
+        )
+        if query.end_time <= query.start_time:
+            raise ValueError("'endtime' must be after 'starttime'")
+
+        return query
+
+    def matches(self, header: RecordHeader) -> bool:
+        if header.end_time < self.start_time or header.start_time >= self.end_time:
+            return False
+
+        return (
+            any(fnmatchcase(header.network, p) for p in self.networks)
+            and any(fnmatchcase(header.station, p) for p in self.stations)
+            and any(fnmatchcase(header.location, p) for p in self.locations)
+            and any(fnmatchcase(header.channel, p) for p in self.channels)
+        )
+
+
+def archive_files(data_dir: Path, start_time: float, end_time: float) -> tuple[list[Path], list[Path]]:
+    """
+    Continuous files and event files of the archive that may hold data between
+    `start_time` and `end_time`, in time order. A continuous file (or day volume)
+    ends where the next one of the same channels starts.
+
+    A 30-minute file is named after its first sample. A day volume holds the files
+    named on its day, the last one running past midnight, so it starts with its first
+    record and not at midnight: that time is read from the record header.
+    """
+    groups: dict[str | None, list[tuple[float, Path]]] = {}
+    events = []
+
+    for path in data_dir.glob("data_*.mseed"):
+        match = ARCHIVE_FILE_PATTERN.match(path.name)
+        if match is None:
+            continue
+
+        moment = datetime.strptime(match["day"] + (match["time"] or "000000"), "%Y%m%d%H%M%S")
+        start = moment.replace(tzinfo=timezone.utc).timestamp()
+
+        if match["event"]:
+            end = start + (DAY if match["time"] is None else 0)
+            if start - EVENT_FILE_MARGIN <= end_time and end + EVENT_FILE_MARGIN >= start_time:
+                events.append((start, path))
+        else:
+            if match["time"] is None:
+                start = _first_record_time(path, start)
+            groups.setdefault(match["suffix"], []).append((start, path))
+
+    continuous = []
+    for files in groups.values():
+        files.sort()
+        for i, (start, path) in enumerate(files):
+            end = files[i + 1][0] if i + 1 < len(files) else float("inf")
+            if start - SPAN_MARGIN <= end_time and end + SPAN_MARGIN >= start_time:
+                continuous.append((start, path))
+
+    return [p for _, p in sorted(continuous)], [p for _, p in sorted(events)]
+
+
+def _first_record_time(path: Path, default: float) -> float:
+    """Start time of the first record of a file, `default` if it can't be read."""
+    try:
+        with open(path, "rb") as f:
+            return read_header(f.read(HEADER_SIZE)).start_time
+    except (OSError, ValueError):
+        return default
+
+
+class _Coverage:
+    """Time intervals of every channel already sent, merged as they grow."""
+    def __init__(self):
+        self._intervals: dict[str, list[list[float]]] = {}
+
+    def add(self, header: RecordHeader):
+        intervals = self._intervals.setdefault(header.seed_id, [])
+        gap = 1.5 / header.sampling_rate if header.sampling_rate > 0 else 0.0
+
+        # Records mostly follow the previous one of their channel
+        if intervals and intervals[-1][0] - gap <= header.start_time <= intervals[-1][1] + gap:
+            intervals[-1][1] = max(intervals[-1][1], header.end_time)
+        else:
+            bisect.insort(intervals, [header.start_time, header.end_time])
+
+    def contains(self, header: RecordHeader) -> bool:
+        intervals = self._intervals.get(header.seed_id, [])
+        tolerance = 0.5 / header.sampling_rate if header.sampling_rate > 0 else 0.0
+
+        i = bisect.bisect_right(intervals, [header.start_time + tolerance, float("inf")]) - 1
+        return i >= 0 and intervals[i][1] >= header.end_time - tolerance
+
+
+class ArchiveReader:
+    """
+    Matching MiniSEED records of the archive, read in batches of about `batch_size`
+    bytes. Only the headers of the records are parsed: the other records are skipped
+    and the matching ones are copied as they are, so the memory use doesn't depend
+    on the requested span.
+
+    The continuous files are read first. The event files repeat their data, so only
+    their records not covered by the continuous ones are added: the event windows
+    whose continuous data was deleted by the retention.
+    """
+    def __init__(self, data_dir: Path, query: DataSelectQuery, batch_size: int = 64 * 1024):
+        self.query = query
+        self.batch_size = batch_size
+
+        continuous, events = archive_files(data_dir, query.start_time, query.end_time)
+        self._files = [(path, False) for path in continuous] + [(path, True) for path in events]
+        self._coverage = _Coverage()
+
+        self._file = None
+        self._is_event = False
+
+    def read(self) -> bytes:
+        """Next batch of records, empty once every file was read."""
+        batch = []
+        size = 0
+
+        while size < self.batch_size:
+            if self._file is None and not self._open_next():
+                break
+
+            record = self._next_record()
+            if record is None:
+                self._file.close()
+                self._file = None
+                continue
+
+            batch.append(record)
+            size += len(record)
+
+        return b"".join(batch)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._files.clear()
+
+    def _open_next(self) -> bool:
+        while self._files:
+            path, self._is_event = self._files.pop(0)
+            try:
+                self._file = open(path, "rb")
+                return True
+            except FileNotFoundError:
+                # Merged in a day volume or deleted since the request started
+                logger.debug("%s is gone, skipped", path)
+
+        return False
+
+    def _next_record(self) -> bytes | None:
+        """Next matching record of the current file, None at its end."""
+        f = self._file
+
+        while True:
+            position = f.tell()
+            data = f.read(HEADER_SIZE)
+            if not data:
+                return None
+
+            try:
+                header = read_header(data)
+            except ValueError as e:
+                # A file being written, or not MiniSEED
+                logger.warning("Stopped reading %s at byte %d: %s", f.name, position, e)
+                return None
+
+            if not self.query.matches(header) or (self._is_event and self._coverage.contains(header)):
+                f.seek(position + header.length)
+                continue
+
+            f.seek(position)
+            record = f.read(header.length)
+            if len(record) < header.length:
+                return None
+
+            if not self._is_event:
+                self._coverage.add(header)
+            return record
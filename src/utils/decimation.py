@@ -0,0 +1,109 @@
+import numpy as np
+
+
+def _stage_factors(factor: int, max_stage_factor: int = 5) -> list[int]:
+    """
+    Splits a decimation factor in stages of at most `max_stage_factor` (larger prime
+    factors get their own stage), largest first: 100 -> [5, 5, 4].
+    """
+    primes = []
+    remaining = factor
+    divisor = 2
+    while divisor * divisor <= remaining:
+        while remaining % divisor == 0:
+            primes.append(divisor)
+            remaining //= divisor
+        divisor += 1
+    if remaining > 1:
+        primes.append(remaining)
+
+    stages = []
+    for prime in sorted(primes, reverse=True):
+        # Merge with the smallest stage that stays within the limit
+        candidates = [i for i, s in enumerate(stages) if s * prime <= max_stage_factor]
+        if candidates:
+            i = min(candidates, key=lambda i: stages[i])
+            stages[i] *= prime
+        else:
+            stages.append(prime)
+
+    return sorted(stages, reverse=True)
+
+
+class FIRDecimator:
+    """
+    One decimation stage: a linear-phase low-pass FIR followed by keeping one sample
+    out of `factor`. The last `ntaps - 1` input samples are carried over between
+    blocks, so blocks of any length give the same output as the whole signal.
+
+    Output j is the filter centred on input sample `offset + j * factor`, so the
+    output needs no delay correction: its time is the time of that input sample.
+    """
+    def __init__(self, factor: int, n_channels: int, taps_per_factor: int = 16):
+        from scipy.signal import firwin
+
+        self.factor = factor
+        ntaps = taps_per_factor * factor + 1
+        # Pass band up to 80% of the output Nyquist frequency
+        self.taps = firwin(ntaps, 0.8 / factor, window=("kaiser", 8.0)) if factor > 1 else np.ones(1)
+        self.offset = (len(self.taps) - 1) // 2
+
+        self._history = np.zeros((0, n_channels))
+        # Input index of the first sample of `_history`, and of the next window centre
+        self._history_start = 0
+        self._next_centre = self.offset
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """Filters a (samples, channels) block, returns the new output samples."""
+        data = np.concatenate([self._history, block]) if len(self._history) else block
+        ntaps = len(self.taps)
+
+        # Window ends (exclusive) of the outputs computable with this data
+        first_end = self._next_centre + self.offset + 1 - self._history_start
+        count = max(0, (len(data) - first_end) // self.factor + 1) if len(data) >= first_end else 0
+
+        if count:
+            windows = np.lib.stride_tricks.sliding_window_view(data, ntaps, axis=0)
+            first_start = first_end - ntaps
+            # windows has shape (positions, channels, ntaps)
+            selected = windows[first_start:first_start + count * self.factor:self.factor]
+            output = selected @ self.taps[::-1]
+            self._next_centre += count * self.factor
+        else:
+            output = np.zeros((0, data.shape[1]))
+
+        # Keep what the next windows need
+        keep_from = self._next_centre - self.offset - self._history_start
+        keep_from = min(max(keep_from, 0), len(data))
+        self._history = data[keep_from:].copy()
+        self._history_start += keep_from
+
+        return output
+
+
+class DecimationChain:
+    """
+    Cascade of FIR decimation stages from `input_rate` to `output_rate`, which must
+    divide it. Output j is centred on input sample `offset + j * factor`.
+    """
+    def __init__(self, input_rate: int, output_rate: int, n_channels: int):
+        if input_rate % output_rate:
+            raise ValueError(f"{output_rate} Hz is not an integer division of {input_rate} Hz.")
+
+        self.input_rate = input_rate
+        self.output_rate = output_rate
+        self.factor = input_rate // output_rate
+        self.stages = [FIRDecimator(f, n_channels) for f in _stage_factors(self.factor)]
+
+        # Input index of the centre of the first output, through all the stages
+        self.offset = 0
+        step = 1
+        for stage in self.stages:
+            self.offset += stage.offset * step
+            step *= stage.factor
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        for stage in self.stages:
+            block = stage.process(block)
+
+        return block
@@ -0,0 +1,45 @@
+from queue import Queue
+from threading import Lock
+
+from src.structs.trigger_event import TriggerEvent
+from src.utils.scheduling import Inbox
+
+
+class EventBus:
+    """
+    Lightweight publish/subscribe bus for trigger records.
+
+    Every subscriber owns a queue, so it is woken up as soon as a record is
+    published and never misses a transition, even if the trigger turns off
+    again before the subscriber gets scheduled. A subscriber blocked on the
+    inbox of its data queue is woken up as well.
+    """
+    def __init__(self):
+        # Queue of every subscriber, with the inbox to wake up
+        self._subscribers: list[tuple[Queue, Inbox | None]] = []
+        self._lock = Lock()
+
+    def subscribe(self, inbox: Inbox | None = None) -> Queue:
+        """
+        Register a new subscriber and return the queue records are delivered to,
+        `inbox` is woken up after every record.
+        """
+        queue = Queue()
+
+        with self._lock:
+            self._subscribers.append((queue, inbox))
+
+        return queue
+
+    def unsubscribe(self, queue: Queue) -> None:
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[0] is not queue]
+
+    def publish(self, event: TriggerEvent) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for queue, inbox in subscribers:
+            queue.put(event)
+            if inbox is not None:
+                inbox.wake()
@@ -0,0 +1,211 @@
+from contextlib import closing
+from pathlib import Path
+import sqlite3
+
+from src.structs.trigger_event import TriggerEvent
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    onset_time REAL NOT NULL,
+    offset_time REAL,
+    duration REAL,
+    onset_index INTEGER NOT NULL,
+    offset_index INTEGER,
+    peak_ratio REAL NOT NULL,
+    archive_path TEXT,
+    stream TEXT,
+    magnitude REAL
+);
+
+CREATE TABLE IF NOT EXISTS event_channels (
+    event_id INTEGER NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+    channel TEXT NOT NULL,
+    peak_counts INTEGER NOT NULL,
+    peak_velocity REAL NOT NULL,
+    PRIMARY KEY (event_id, channel)
+);
+
+CREATE INDEX IF NOT EXISTS idx_events_onset_time ON events(onset_time);
+CREATE INDEX IF NOT EXISTS idx_events_duration ON events(duration);
+CREATE INDEX IF NOT EXISTS idx_event_channels_peak ON event_channels(channel, peak_velocity);
+"""
+
+# Columns added after the first release, created on the existing catalogs
+MIGRATIONS = {
+    "stream": "ALTER TABLE events ADD COLUMN stream TEXT",
+    "magnitude": "ALTER TABLE events ADD COLUMN magnitude REAL",
+}
+
+
+class EventCatalog:
+    """
+    Persistent SQLite catalog of detected events.
+
+    A row is created at trigger-on and completed at trigger-off with the event
+    parameters, so the catalog can be listed and filtered without touching the
+    waveform archive. Every call opens its own connection, which makes the catalog
+    safe to share between the job threads.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(events)")}
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(statement)
+            conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def open_event(self, event: TriggerEvent) -> int:
+        """Insert a new event from its trigger-on record and return its id."""
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "INSERT INTO events (onset_time, onset_index, peak_ratio, stream) VALUES (?, ?, ?, ?)",
+                (event.onset_time, event.onset_index, event.peak_ratio, event.stream)
+            )
+            return cursor.lastrowid
+
+    def close_event(self, event: TriggerEvent) -> None:
+        """
+        Complete an event from its trigger-off record, with the local magnitude and
+        the peak of every channel (in counts and in m/s).
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                UPDATE events
+                SET offset_time = ?, offset_index = ?, duration = ?, peak_ratio = ?, magnitude = ?
+                WHERE id = ?
+                """,
+                (
+                    event.offset_time,
+                    event.offset_index,
+                    event.offset_time - event.onset_time,
+                    event.peak_ratio,
+                    event.magnitude,
+                    event.event_id
+                )
+            )
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO event_channels (event_id, channel, peak_counts, peak_velocity)
+                VALUES (?, ?, ?, ?)
+                """,
+                [
+                    (event.event_id, channel, amplitude.peak_counts, amplitude.peak_velocity)
+                    for channel, amplitude in event.amplitudes.items()
+                ]
+            )
+
+    def link_archive(self, start_time: float, end_time: float, path: Path) -> None:
+        """
+        Point events whose onset falls in [start_time, end_time] and that are not
+        linked yet to the archive file holding their data.
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                UPDATE events SET archive_path = ?
+                WHERE archive_path IS NULL AND onset_time BETWEEN ? AND ?
+                """,
+                (str(path), start_time, end_time)
+            )
+
+    def set_archive_path(self, event_id: int, path: Path) -> None:
+        """Point an event to its dedicated event file."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE events SET archive_path = ? WHERE id = ?", (str(path), event_id))
+
+    def move_archive(self, old_paths: list[Path], new_path: Path) -> None:
+        """Point the events of archive files merged into another one to it."""
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "UPDATE events SET archive_path = ? WHERE archive_path = ?",
+                [(str(new_path), str(path)) for path in old_paths]
+            )
+
+    def unlink_archive(self, path: Path) -> None:
+        """Forget a deleted archive file, its events have no data anymore."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE events SET archive_path = NULL WHERE archive_path = ?", (str(path),))
+
+    def list_events(
+        self,
+        start_time: float | None = None,
+        end_time: float | None = None,
+        min_duration: float | None = None,
+        channel: str | None = None,
+        min_peak_velocity: float | None = None,
+        min_magnitude: float | None = None,
+        stream: str | None = None,
+        limit: int | None = None
+    ) -> list[dict]:
+        """
+        List events (newest first) filtered by onset time, duration, channel, peak velocity
+        (on that channel when given), local magnitude and digitizer (``stream``, e.g. "XX.RPI3.").
+        Each event is returned as a dict with a ``channels`` mapping of its per-channel peaks.
+        """
+        conditions = []
+        params = []
+
+        if start_time is not None:
+            conditions.append("onset_time >= ?")
+            params.append(start_time)
+        if end_time is not None:
+            conditions.append("onset_time <= ?")
+            params.append(end_time)
+        if min_duration is not None:
+            conditions.append("duration >= ?")
+            params.append(min_duration)
+        if min_magnitude is not None:
+            conditions.append("magnitude >= ?")
+            params.append(min_magnitude)
+        if stream is not None:
+            conditions.append("stream = ?")
+            params.append(stream)
+        if channel is not None or min_peak_velocity is not None:
+            # Events with a channel of that name, and a peak at least that large on it
+            channel_conditions = []
+            if channel is not None:
+                channel_conditions.append("channel = ?")
+                params.append(channel)
+            if min_peak_velocity is not None:
+                channel_conditions.append("peak_velocity >= ?")
+                params.append(min_peak_velocity)
+
+            conditions.append(
+                f"id IN (SELECT event_id FROM event_channels WHERE {' AND '.join(channel_conditions)})"
+            )
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"SELECT * FROM events {where} ORDER BY onset_time DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with closing(self._connect()) as conn:
+            events = {row["id"]: dict(row, channels={}) for row in conn.execute(query, params)}
+
+            # Fetch the per-channel peaks of all the selected events in a single query
+            for row in conn.execute(
+                f"SELECT ec.* FROM event_channels ec JOIN ({query}) e ON ec.event_id = e.id",
+                params
+            ):
+                events[row["event_id"]]["channels"][row["channel"]] = {
+                    "peak_counts": row["peak_counts"],
+                    "peak_velocity": row["peak_velocity"]
+                }
+
+        return list(events.values())
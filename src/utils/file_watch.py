@@ -0,0 +1,63 @@
+from pathlib import Path
+from logging import getLogger
+import ctypes
+import ctypes.util
+import os
+import struct
+
+logger = getLogger(__name__)
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class FileWatch:
+    """
+    Blocking wait for the changes of a file, with Linux inotify: the folder of the
+    file is watched, so editors that save by replacing the file are seen as well.
+    `available` is False where inotify can't be used, the caller then polls.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd = None
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+
+        watch = libc.inotify_add_watch(
+            fd, os.fsencode(path.parent), IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE
+        )
+        if watch < 0:
+            logger.warning("Unable to watch %s: %s", path.parent, os.strerror(ctypes.get_errno()))
+            os.close(fd)
+            return
+
+        self._fd = fd
+
+    @property
+    def available(self) -> bool:
+        return self._fd is not None
+
+    def wait(self):
+        """Blocks until the file is written, replaced or deleted."""
+        name = os.fsencode(self.path.name)
+
+        while True:
+            data = os.read(self._fd, 4096)
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                if data[offset:offset + length].rstrip(b"\0") == name:
+                    return
+                offset += length
+
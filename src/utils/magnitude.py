@@ -0,0 +1,138 @@
+import math
+
+from src.settings import Settings
+from src.settings.enums import ChannelOrientation
+from src.structs.trigger_event import ChannelAmplitude
+
+# Standard Wood-Anderson seismometer (IASPEI): natural period and damping
+WOOD_ANDERSON_PERIOD = 0.8
+WOOD_ANDERSON_DAMPING = 0.7
+
+
+def local_magnitude(amplitude_nm: float, distance_km: float) -> float:
+    """
+    IASPEI local magnitude from the peak Wood-Anderson amplitude (static
+    magnification 1) in nanometres at an hypocentral distance in kilometres.
+    """
+    return math.log10(amplitude_nm) + 1.11 * math.log10(distance_km) + 0.00189 * distance_km - 2.09
+
+
+class AmplitudeEstimator:
+    """
+    Streaming ground motion of the channels of one digitizer.
+
+    Every sample updates a running mean of each channel (its offset, over
+    `baseline_sec`) and a Wood-Anderson simulation: the bilinear transform of the
+    seismometer response to ground velocity, a single biquad per channel. Between
+    `start` and `stop` the peak and the sum of squares of the samples (offset
+    removed) and the peak of the simulation are accumulated, so the amplitudes and
+    the magnitude can be read at any time without going back to the samples.
+
+    The filters run on counts: the conversion to ground velocity (the ADC volts per
+    count, set by `adc_gain`, over the sensor sensitivity) is applied when the values
+    are read, with the settings given then.
+    """
+    def __init__(self, n_channels: int, sampling_rate: float, baseline_sec: float):
+        self.n_channels = n_channels
+        self._baseline_weight = 1.0 / max(1.0, baseline_sec * sampling_rate)
+        self._baseline: list[float] | None = None
+
+        # H(s) = s / (s² + 2hω0 s + ω0²), ground velocity to Wood-Anderson displacement
+        w0 = 2 * math.pi / WOOD_ANDERSON_PERIOD
+        a = 2 * WOOD_ANDERSON_DAMPING * w0
+        b = w0 * w0
+        # Prewarped on the natural frequency, exact there at any sampling rate
+        k = w0 / math.tan(w0 / (2 * sampling_rate))
+        d0 = k * k + a * k + b
+        self._b0 = k / d0
+        self._a1 = (2 * b - 2 * k * k) / d0
+        self._a2 = (k * k - a * k + b) / d0
+        # Transposed direct form II state of every channel
+        self._state: list[list[float]] = []
+
+        self.active = False
+        self.count = 0
+        self._offset = [0.0] * n_channels
+        self._peak = [0.0] * n_channels
+        self._sum_sq = [0.0] * n_channels
+        self._peak_wa = [0.0] * n_channels
+
+    def add(self, values: list[float]):
+        """Feeds one sample of every channel, in counts."""
+        b0, a1, a2 = self._b0, self._a1, self._a2
+
+        if self._baseline is None:
+            self._baseline = [float(x) for x in values]
+            # Steady state of the filters for a constant input, no start transient
+            self._state = [[-b0 * x, -b0 * x] for x in values]
+
+        baseline = self._baseline
+        weight = self._baseline_weight
+        active = self.active
+
+        for i, x in enumerate(values):
+            baseline[i] += weight * (x - baseline[i])
+
+            state = self._state[i]
+            y = b0 * x + state[0]
+            state[0] = state[1] - a1 * y
+            state[1] = -b0 * x - a2 * y
+
+            if active:
+                d = abs(x - self._offset[i])
+                if d > self._peak[i]:
+                    self._peak[i] = d
+                self._sum_sq[i] += d * d
+                if abs(y) > self._peak_wa[i]:
+                    self._peak_wa[i] = abs(y)
+
+        if active:
+            self.count += 1
+
+    def start(self):
+        """Starts measuring an event, the offsets are frozen at their current value."""
+        self.active = True
+        self.count = 0
+        self._offset = list(self._baseline) if self._baseline is not None else [0.0] * self.n_channels
+        self._peak = [0.0] * self.n_channels
+        self._sum_sq = [0.0] * self.n_channels
+        self._peak_wa = [0.0] * self.n_channels
+
+    def stop(self):
+        self.active = False
+
+    @property
+    def wood_anderson_peak(self) -> float:
+        """Largest Wood-Anderson amplitude of the event so far, in counts."""
+        return max(self._peak_wa, default=0.0)
+
+    def amplitudes(self, settings: Settings) -> dict[str, ChannelAmplitude]:
+        """Amplitudes of every channel since `start`, by channel name."""
+        amplitudes = {}
+        for i, channel in enumerate(settings.channels):
+            to_velocity = settings.mcu.volts_per_count / channel.sensitivity
+            rms = math.sqrt(self._sum_sq[i] / self.count) if self.count else 0.0
+
+            amplitudes[channel.name] = ChannelAmplitude(
+                peak_counts=int(round(self._peak[i])),
+                peak_velocity=self._peak[i] * to_velocity,
+                rms_velocity=rms * to_velocity,
+                wood_anderson_nm=self._peak_wa[i] * to_velocity * 1e9
+            )
+
+        return amplitudes
+
+    def magnitude(self, settings: Settings, amplitudes: dict[str, ChannelAmplitude]) -> float | None:
+        """
+        Local magnitude from the largest Wood-Anderson amplitude of the horizontal
+        channels (of all channels on a vertical-only station), None without signal.
+        """
+        horizontal = [
+            amplitudes[ch.name].wood_anderson_nm
+            for ch in settings.channels if ch.orientation != ChannelOrientation.VERTICAL
+        ]
+        amplitude = max(horizontal or [a.wood_anderson_nm for a in amplitudes.values()], default=0.0)
+        if amplitude <= 0:
+            return None
+
+        return local_magnitude(amplitude, settings.trigger.magnitude_distance_km)
@@ -0,0 +1,148 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable
+
+
+# Default buckets (seconds) for processing times and latencies
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _format_labels(labels: dict[str, str], extra: dict[str, str] | None = None) -> str:
+    items = {**labels, **(extra or {})}
+    if not items:
+        return ""
+
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items.items()) + "}"
+
+
+class Counter:
+    """Monotonic counter. Every counter is expected to be updated by a single thread."""
+    def __init__(self, labels: dict[str, str]):
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def samples(self, name: str) -> list[str]:
+        return [f"{name}{_format_labels(self.labels)} {self.value}"]
+
+
+class Gauge:
+    """Gauge either set by its owner or read from a callback at scrape time."""
+    def __init__(self, labels: dict[str, str], callback: Callable[[], float] | None = None):
+        self.labels = labels
+        self.callback = callback
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def samples(self, name: str) -> list[str]:
+        value = self.callback() if self.callback is not None else self.value
+        return [f"{name}{_format_labels(self.labels)} {value}"]
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket upper bounds."""
+    def __init__(self, labels: dict[str, str], buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.labels = labels
+        self.buckets = buckets
+        # One slot per bucket plus the +Inf one, cumulated at scrape time
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str) -> list[str]:
+        lines = []
+        cumulative = 0
+
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(self.labels, {'le': bound})} {cumulative}")
+
+        lines.append(f"{name}_sum{_format_labels(self.labels)} {self.sum}")
+        lines.append(f"{name}_count{_format_labels(self.labels)} {cumulative}")
+
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Registry of the pipeline metrics, rendered in the Prometheus text format.
+
+    Metrics are plain Python objects updated without locks: the hot path only pays
+    for an attribute increment, the registry lock is only taken when metrics are
+    created or rendered.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        # { name: {"type": str, "help": str, "metrics": {labels_key: metric}} }
+        self._families = {}
+
+    def _get_or_create(self, metric_type: str, name: str, help_text: str, labels: dict, factory):
+        key = tuple(sorted(labels.items()))
+
+        with self._lock:
+            family = self._families.setdefault(
+                name, {"type": metric_type, "help": help_text, "metrics": {}}
+            )
+
+            if family["type"] != metric_type:
+                raise ValueError(f"Metric {name} is already registered as a {family['type']}.")
+
+            if key not in family["metrics"]:
+                family["metrics"][key] = factory()
+
+            return family["metrics"][key]
+
+    def counter(self, name: str, help_text: str, **labels: str) -> Counter:
+        return self._get_or_create("counter", name, help_text, labels, lambda: Counter(labels))
+
+    def gauge(
+        self,
+        name: str,
+        help_text: str,
+        callback: Callable[[], float] | None = None,
+        **labels: str
+    ) -> Gauge:
+        gauge = self._get_or_create("gauge", name, help_text, labels, lambda: Gauge(labels, callback))
+        if callback is not None:
+            gauge.callback = callback
+
+        return gauge
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        **labels: str
+    ) -> Histogram:
+        return self._get_or_create("histogram", name, help_text, labels, lambda: Histogram(labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+
+        with self._lock:
+            families = {name: dict(family, metrics=list(family["metrics"].values()))
+                        for name, family in self._families.items()}
+
+        for name, family in families.items():
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+
+            for metric in family["metrics"]:
+                lines.extend(metric.samples(name))
+
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry used by all the jobs
+REGISTRY = MetricsRegistry()
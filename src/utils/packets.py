@@ -0,0 +1,16 @@
+import numpy as np
+
+
+def packet_values(packet: dict, columns: dict[str, int]) -> np.ndarray:
+    """
+    Extract the values of a Reader packet as a row ordered by ``columns``
+    (channel name -> column index). Channels not in ``columns`` are ignored.
+    """
+    values = np.zeros(len(columns), dtype=np.int32)
+
+    for m in packet['measurements']:
+        column = columns.get(m['channel'].name)
+        if column is not None:
+            values[column] = m['value']
+
+    return values
@@ -0,0 +1,292 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+from logging import getLogger
+import json
+import os
+import re
+import warnings
+
+from src.settings import Settings
+
+logger = getLogger(__name__)
+
+# Continuous files of the MSeedWriter and their day volumes (ArchiveManager), the event
+# files and the decimated bands are left out
+RAW_FILE_PATTERN = re.compile(r"^data_\d{8}(T\d{6})?\.mseed$")
+
+DAY = 86400
+
+
+def _day_start(timestamp: float) -> float:
+    return float(timestamp // DAY * DAY)
+
+
+def _day_name(day: float) -> str:
+    return datetime.fromtimestamp(day, timezone.utc).strftime("%Y-%m-%d")
+
+
+def _file_span(path: Path) -> tuple[float, float] | None:
+    """First and last sample time of a MiniSEED file, read from the record headers."""
+    from obspy import read
+
+    try:
+        stream = read(str(path), format="MSEED", headonly=True)
+    except Exception:
+        logger.exception("Unable to read %s", path)
+        return None
+
+    if not stream:
+        return None
+    return (
+        min(tr.stats.starttime for tr in stream).timestamp,
+        max(tr.stats.endtime for tr in stream).timestamp
+    )
+
+
+def _process_day(
+    folder: Path,
+    day: float,
+    first_segment: float,
+    last_segment: float,
+    files: list[Path],
+    responses: dict[str, dict],
+    ppsd_length: float,
+    overlap: float
+) -> dict[str, int]:
+    """
+    Adds the PSD segments starting in [first_segment, last_segment] of one day to the
+    cached PPSD of every channel. Runs in a worker process, returns the number of new
+    segments by SEED id.
+    """
+    from obspy import Stream, UTCDateTime, read
+    from obspy.signal import PPSD
+
+    start = UTCDateTime(first_segment)
+    # The last segment needs `ppsd_length` seconds of data after its start
+    end = UTCDateTime(last_segment) + ppsd_length
+
+    stream = Stream()
+    for path in files:
+        try:
+            stream += read(str(path), format="MSEED", starttime=start, endtime=end)
+        except Exception:
+            logger.exception("Unable to read %s", path)
+
+    added = {}
+    for seed_id, response in responses.items():
+        traces = stream.select(id=seed_id)
+        if not traces:
+            continue
+
+        delta = traces[0].stats.delta
+        # Segments starting on the next day belong to its cache file
+        last_start = min(UTCDateTime(last_segment), UTCDateTime(day + DAY) - delta)
+        traces = traces.copy().trim(start, last_start + ppsd_length - delta)
+        if not traces:
+            continue
+
+        path = folder / seed_id / f"{_day_name(day)}.npz"
+        ppsd = PPSD(traces[0].stats, metadata=response, ppsd_length=ppsd_length, overlap=overlap)
+        if path.exists():
+            # Not `PPSD.load_npz(metadata=...)`, which computes the response for the
+            # wrong FFT length
+            ppsd.add_npz(str(path))
+
+        before = len(ppsd.times_processed)
+        with warnings.catch_warnings():
+            # Segments already in the cache and too short traces are expected here
+            warnings.simplefilter("ignore")
+            ppsd.add(traces)
+
+        added[seed_id] = len(ppsd.times_processed) - before
+        if added[seed_id]:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Written aside and renamed, an interrupted run never leaves a broken file
+            temp_path = path.with_suffix(".tmp.npz")
+            ppsd.save_npz(str(temp_path))
+            os.replace(temp_path, path)
+
+    return added
+
+
+class PPSDCache:
+    """
+    Incremental cache of the power spectral densities of the continuous archive.
+
+    The PSD segments of every channel are stored in one NPZ file per day
+    (`<folder>/<SEED id>/<YYYY-MM-DD>.npz`, the ObsPy PPSD format), and the archive
+    files already processed are listed, with their size and time span, in
+    `<folder>/processed.json`. An update only reads the data around the new or
+    changed files and only computes the segments that are not cached yet; the days
+    of a backlog are processed in parallel worker processes.
+
+    Counts are converted to ground velocity with a flat response: the channel
+    `sensitivity` over the ADC volts per count of its digitizer.
+    """
+    def __init__(self, data_dir: Path, settings: Settings, folder: Path | None = None,
+                 ppsd_length: float = 3600.0, overlap: float = 0.5):
+        self.data_dir = data_dir
+        self.folder = folder if folder is not None else data_dir / "ppsd"
+        self.ppsd_length = ppsd_length
+        self.overlap = overlap
+        self.step = ppsd_length * (1 - overlap)
+
+        # Response of every channel by SEED id, in counts per m/s
+        self.responses = {
+            f"{stream.stream_id}.{channel.name}": {
+                "poles": [],
+                "zeros": [],
+                "gain": 1.0,
+                "sensitivity": channel.sensitivity / stream.mcu.volts_per_count
+            }
+            for stream in settings.streams()
+            for channel in stream.channels
+        }
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.folder / "processed.json"
+
+    def _load_manifest(self) -> dict[str, dict]:
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="UTF-8"))
+        except FileNotFoundError:
+            return {}
+
+    def _save_manifest(self, manifest: dict[str, dict]):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        temp_path = self.manifest_path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps(manifest, indent=1, sort_keys=True), encoding="UTF-8")
+        os.replace(temp_path, self.manifest_path)
+
+    def update(self, workers: int | None = None) -> int:
+        """
+        Processes the archive files written or changed since the last update.
+        Returns the number of new PSD segments.
+        """
+        manifest = self._load_manifest()
+
+        new_files = {}
+        for path in sorted(self.data_dir.glob("data_*.mseed")):
+            if not RAW_FILE_PATTERN.match(path.name):
+                continue
+
+            stat = path.stat()
+            known = manifest.get(path.name)
+            if known is None or (known["size"], known["mtime"]) != (stat.st_size, stat.st_mtime_ns):
+                new_files[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+        # Files deleted from the archive since the last update
+        names = {p.name for p in self.data_dir.glob("data_*.mseed")}
+        manifest = {name: entry for name, entry in manifest.items() if name in names}
+
+        if not new_files:
+            logger.info("No new archive files.")
+            return 0
+        logger.info("%d new archive files to process.", len(new_files))
+
+        added = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            paths = list(new_files)
+            for path, span in zip(paths, executor.map(_file_span, paths, chunksize=16)):
+                if span is None:
+                    del new_files[path]
+                else:
+                    new_files[path]["start"], new_files[path]["end"] = span
+
+            # Every archive file by time span, to read the data around the new ones
+            spans = {self.data_dir / name: (entry["start"], entry["end"]) for name, entry in manifest.items()}
+            spans.update({path: (entry["start"], entry["end"]) for path, entry in new_files.items()})
+
+            # Start of the first and of the last segment to compute of every day, a new
+            # file completes the segments that started up to `ppsd_length` before it
+            days = {}
+            pending = {}
+            for path, entry in new_files.items():
+                first = entry["start"] - self.ppsd_length
+                last = entry["end"]
+                pending[path] = set()
+
+                day = _day_start(first)
+                while day <= last:
+                    start = max(first, day)
+                    # Aligned on the segment grid of the day, so the new segments follow the cached ones
+                    start = day + (start - day) // self.step * self.step
+                    stop = min(last, day + DAY)
+                    bounds = days.get(day, (start, stop))
+                    days[day] = (min(bounds[0], start), max(bounds[1], stop))
+                    pending[path].add(day)
+                    day += DAY
+
+            futures = {}
+            for day, (first, last) in sorted(days.items()):
+                files = [
+                    path for path, (start, end) in spans.items()
+                    if start <= last + self.ppsd_length and end >= first
+                ]
+                future = executor.submit(
+                    _process_day, self.folder, day, first, last, sorted(files),
+                    self.responses, self.ppsd_length, self.overlap
+                )
+                futures[future] = day
+
+            for future in as_completed(futures):
+                day = futures[future]
+                try:
+                    counts = future.result()
+                except Exception:
+                    logger.exception("Unable to process %s", _day_name(day))
+                    continue
+
+                added += sum(counts.values())
+                logger.info("%s: %d new PSD segments.", _day_name(day), sum(counts.values()))
+
+                # A file is done once every day it touches is, an interrupted or failed
+                # run processes the others again next time
+                for path in list(pending):
+                    pending[path].discard(day)
+                    if not pending[path]:
+                        manifest[path.name] = new_files[path]
+                        del pending[path]
+                self._save_manifest(manifest)
+
+        self._save_manifest(manifest)
+        return added
+
+    def load(self, seed_id: str, start_time: float | None = None, end_time: float | None = None):
+        """
+        PPSD of a channel aggregated from the cached days between `start_time` and
+        `end_time` (the whole cache by default), None if nothing is cached.
+        """
+        from obspy import UTCDateTime
+        from obspy.signal import PPSD
+
+        first_day = _day_name(_day_start(start_time)) if start_time is not None else None
+        last_day = _day_name(_day_start(end_time)) if end_time is not None else None
+
+        ppsd = None
+        for path in sorted((self.folder / seed_id).glob("*.npz")):
+            day = path.stem
+            if (first_day and day < first_day) or (last_day and day > last_day):
+                continue
+
+            if ppsd is None:
+                ppsd = PPSD.load_npz(str(path), metadata=self.responses.get(seed_id))
+            else:
+                ppsd.add_npz(str(path))
+
+        if ppsd is not None:
+            ppsd.calculate_histogram(
+                starttime=UTCDateTime(start_time) if start_time is not None else None,
+                endtime=UTCDateTime(end_time) if end_time is not None else None
+            )
+
+        return ppsd
+
+    def seed_ids(self) -> list[str]:
+        """Channels with cached segments."""
+        if not self.folder.exists():
+            return []
+        return sorted(p.name for p in self.folder.iterdir() if p.is_dir() and any(p.glob("*.npz")))
+
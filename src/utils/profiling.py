@@ -0,0 +1,221 @@
+from collections import Counter, deque
+from datetime import datetime, timezone
+from pathlib import Path
+from logging import getLogger
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+
+import numpy as np
+
+from src.utils.ring_buffer import RingBuffer
+
+logger = getLogger(__name__)
+
+# Attributes every job inherits from Thread, left out of the memory reports
+_THREAD_ATTRIBUTES = set(vars(threading.Thread()))
+
+
+def _thread_label(thread: threading.Thread) -> str:
+    """Thread name plus the job class, e.g. "Thread-3 (TriggerProcessor)"."""
+    if type(thread) is threading.Thread or type(thread) is threading._MainThread:
+        return thread.name
+    return f"{thread.name} ({type(thread).__name__})"
+
+
+class Profiler:
+    """
+    On-demand diagnostics of the running process, written under `output_dir`:
+
+    - `dump_stacks`: the current stack of every thread;
+    - `start_sampling`: samples the stacks of all threads for N seconds and writes
+      them in the folded format (flamegraph.pl, speedscope) plus a summary of the
+      hottest lines and functions;
+    - `memory_snapshot`: the first call starts tracemalloc and takes the baseline, the
+      next ones write the allocation growth since the baseline, along with the size of
+      the containers (lists, dicts, deques, buffers) held by the jobs.
+
+    Everything runs in the process itself, so it can be triggered in the field with a
+    signal or from the metrics endpoint without a restart.
+    """
+    def __init__(self, output_dir: Path, jobs: list[threading.Thread] | None = None):
+        self.output_dir = output_dir
+        self.jobs = jobs if jobs is not None else []
+
+        self._lock = threading.Lock()
+        self._sampler: threading.Thread | None = None
+        self._stop_sampling = threading.Event()
+        self._baseline: tracemalloc.Snapshot | None = None
+
+    def _output_path(self, kind: str, suffix: str = "txt") -> Path:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        return self.output_dir / f"{kind}_{timestamp}.{suffix}"
+
+    def dump_stacks(self) -> Path:
+        """Writes the current stack of every thread."""
+        threads = {t.ident: t for t in threading.enumerate()}
+        lines = []
+
+        for ident, frame in sys._current_frames().items():
+            thread = threads.get(ident)
+            label = _thread_label(thread) if thread else f"thread {ident}"
+            lines.append(f"--- {label}\n")
+            lines.extend(traceback.format_stack(frame))
+            lines.append("\n")
+
+        path = self._output_path("stacks")
+        path.write_text("".join(lines), encoding="UTF-8")
+        logger.info("Thread stacks written to %s", path)
+
+        return path
+
+    def start_sampling(self, duration: float = 30.0, interval: float = 0.005) -> Path | None:
+        """
+        Starts sampling the thread stacks for `duration` seconds in the background.
+        Returns the path of the folded stacks, or None if a session is already running.
+        """
+        with self._lock:
+            if self._sampler is not None and self._sampler.is_alive():
+                return None
+
+            path = self._output_path("profile", "folded")
+            self._stop_sampling.clear()
+            self._sampler = threading.Thread(
+                target=self._sample, args=(path, duration, interval), name="Profiler", daemon=True
+            )
+            self._sampler.start()
+
+        logger.info("Sampling profiler started for %.0f s, writing %s", duration, path)
+        return path
+
+    def stop_sampling(self) -> bool:
+        """Ends the running session early, its results are written anyway."""
+        sampler = self._sampler
+        if sampler is None or not sampler.is_alive():
+            return False
+
+        self._stop_sampling.set()
+        sampler.join()
+        return True
+
+    @property
+    def sampling(self) -> bool:
+        return self._sampler is not None and self._sampler.is_alive()
+
+    def _sample(self, path: Path, duration: float, interval: float):
+        own = threading.get_ident()
+        stacks = Counter()
+        hot_lines = Counter()
+        samples = 0
+        started = time.monotonic()
+        deadline = started + duration
+
+        while time.monotonic() < deadline and not self._stop_sampling.is_set():
+            labels = {t.ident: _thread_label(t) for t in threading.enumerate()}
+
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+
+                label = labels.get(ident, f"thread {ident}")
+                code = frame.f_code
+                hot_lines[(label, f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")] += 1
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+
+                stacks[(label, tuple(reversed(stack)))] += 1
+
+            samples += 1
+            self._stop_sampling.wait(interval)
+
+        elapsed = time.monotonic() - started
+
+        with open(path, "w", encoding="UTF-8") as folded:
+            for (label, stack), count in stacks.items():
+                folded.write(";".join((label,) + stack) + f" {count}\n")
+
+        self._write_summary(path.with_suffix(".txt"), stacks, hot_lines, samples, elapsed)
+        logger.info("Sampling profiler finished: %d samples in %.1f s written to %s", samples, elapsed, path)
+
+    def _write_summary(self, path: Path, stacks: Counter, hot_lines: Counter, samples: int, elapsed: float):
+        # Functions on the stack of each thread (inclusive samples)
+        inclusive = Counter()
+        for (label, stack), count in stacks.items():
+            for function in set(stack):
+                inclusive[(label, function)] += count
+
+        lines = [f"{samples} samples in {elapsed:.1f} s\n\n", "Hottest lines (self samples):\n"]
+        for (label, line), count in hot_lines.most_common(40):
+            lines.append(f"{100 * count / max(samples, 1):6.1f}%  {label:<40} {line}\n")
+
+        lines.append("\nHottest functions (inclusive samples):\n")
+        for (label, function), count in inclusive.most_common(40):
+            lines.append(f"{100 * count / max(samples, 1):6.1f}%  {label:<40} {function}\n")
+
+        path.write_text("".join(lines), encoding="UTF-8")
+
+    def memory_snapshot(self, reset: bool = False, limit: int = 50) -> Path | None:
+        """
+        Writes the allocations grown since the baseline. The first call (or a call with
+        `reset`) starts tracemalloc, takes the baseline and returns None.
+        """
+        with self._lock:
+            if reset or self._baseline is None or not tracemalloc.is_tracing():
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(10)
+                self._baseline = tracemalloc.take_snapshot()
+                logger.info("tracemalloc baseline taken")
+                return None
+
+            snapshot = tracemalloc.take_snapshot()
+            diff = snapshot.compare_to(self._baseline, "lineno")
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            f"Traced memory: {current / 1024:.1f} KiB (peak {peak / 1024:.1f} KiB)\n\n",
+            "Growth since the baseline:\n"
+        ]
+        lines.extend(f"{stat}\n" for stat in diff[:limit])
+
+        lines.append("\nJob containers:\n")
+        for job in self.jobs:
+            for name, value in vars(job).items():
+                if name in _THREAD_ATTRIBUTES:
+                    continue
+
+                size = self._container_size(value)
+                if size is not None:
+                    lines.append(f"{type(job).__name__}.{name}: {size}\n")
+
+        path = self._output_path("memory")
+        path.write_text("".join(lines), encoding="UTF-8")
+        logger.info("tracemalloc diff written to %s", path)
+
+        return path
+
+    def stop_memory(self):
+        """Stops tracemalloc (and its overhead), the next snapshot starts it again."""
+        with self._lock:
+            tracemalloc.stop()
+            self._baseline = None
+
+    @staticmethod
+    def _container_size(value) -> str | None:
+        if isinstance(value, RingBuffer):
+            filled = value.end_index - value.start_index
+            return f"ring buffer {filled}/{value.capacity} samples x {value.n_channels} channels"
+        if isinstance(value, np.ndarray):
+            return f"array {value.shape}, {value.nbytes / 1024:.1f} KiB"
+        if isinstance(value, dict):
+            items = sum(len(v) for v in value.values() if isinstance(v, (list, deque)))
+            return f"{len(value)} keys, {items} items in the values" if items else f"{len(value)} keys"
+        if isinstance(value, (list, deque)):
+            return f"{len(value)} items"
+        return None
@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True, slots=True)
+class SeedLinkRecord:
+    """A 512-byte MiniSEED record ready to be sent, with the SeedLink header ("SL" + sequence)."""
+    network: str
+    station: str
+    location: str
+    channel: str
+    start_time: float
+    end_time: float
+    packet: bytes
+
+
+class RecordRing:
+    """
+    Preallocated ring of the latest SeedLink records.
+
+    Every record gets the next absolute position when appended; its SeedLink
+    sequence number is the position modulo 2^24 (6 hex digits on the wire).
+    Positions never wrap, so readers can keep a cursor and detect that the
+    records they didn't read yet were overwritten (cursor < start).
+    """
+    SEQUENCE_MODULO = 0x1000000
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("Capacity must be a positive number of records.")
+
+        self.capacity = capacity
+        self._records: list[SeedLinkRecord | None] = [None] * capacity
+
+        # Absolute position of the oldest record still available and one past the newest
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, network: str, station: str, location: str, channel: str,
+               start_time: float, end_time: float, record: bytes) -> SeedLinkRecord:
+        """Store a MiniSEED record with the next sequence number."""
+        sequence = self.end % self.SEQUENCE_MODULO
+        entry = SeedLinkRecord(
+            network, station, location, channel, start_time, end_time,
+            b"SL%06X" % sequence + record
+        )
+
+        self._records[self.end % self.capacity] = entry
+        self.end += 1
+        self.start = max(self.start, self.end - self.capacity)
+
+        return entry
+
+    def get(self, position: int) -> SeedLinkRecord | None:
+        """Record at an absolute position, None if it was overwritten or doesn't exist yet."""
+        if not self.start <= position < self.end:
+            return None
+
+        return self._records[position % self.capacity]
+
+    def sequence(self, position: int) -> int:
+        return position % self.SEQUENCE_MODULO
+
+    def find_sequence(self, sequence: int) -> int:
+        """
+        Position of the record with a SeedLink sequence number. Numbers older than
+        the ring resume from the oldest record, numbers not assigned yet from the
+        next one.
+        """
+        # Distance back from the next record, the wrap of the 24-bit counter included
+        behind = (self.end - sequence) % self.SEQUENCE_MODULO
+        if behind == 0:
+            return self.end
+        if behind > len(self):
+            # Ahead of the ring (a client of an earlier run) or already overwritten
+            return self.end if behind > self.SEQUENCE_MODULO // 2 else self.start
+
+        return self.end - behind
+
+    def find_time(self, timestamp: float) -> int:
+        """Position of the oldest record ending at or after `timestamp`."""
+        for position in range(self.start, self.end):
+            if self._records[position % self.capacity].end_time >= timestamp:
+                return position
+
+        return self.end
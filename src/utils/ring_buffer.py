@@ -0,0 +1,94 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Preallocated multi-channel ring buffer keyed by absolute sample index.
+
+    Every sample is written twice, at ``index % capacity`` and at the mirrored
+    position ``index % capacity + capacity``. Thanks to this any window of up to
+    ``capacity`` contiguous samples is a plain slice of the backing arrays, so
+    windows are returned as NumPy views and never copied.
+    """
+    def __init__(self, capacity: int, n_channels: int, dtype=np.int32):
+        if capacity <= 0:
+            raise ValueError("Capacity must be a positive number of samples.")
+
+        self.capacity = capacity
+        self.n_channels = n_channels
+
+        self._data = np.zeros((2 * capacity, n_channels), dtype=dtype)
+        self._times = np.zeros(2 * capacity, dtype=np.float64)
+
+        # Absolute index of the oldest sample still available and one past the newest
+        self.start_index = 0
+        self.end_index = 0
+
+    def __len__(self):
+        return self.end_index - self.start_index
+
+    def append(self, index: int, timestamp: float, values) -> None:
+        """
+        Store a single sample (one value per channel) at the given sample index.
+        """
+        if len(self) == 0:
+            self.start_index = index
+        elif index != self.end_index:
+            self._restart(index)
+
+        pos = index % self.capacity
+        self._data[pos] = values
+        self._data[pos + self.capacity] = values
+        self._times[pos] = timestamp
+        self._times[pos + self.capacity] = timestamp
+
+        self.end_index = index + 1
+        self.start_index = max(self.start_index, self.end_index - self.capacity)
+
+    def extend(self, index: int, timestamps, values) -> None:
+        """
+        Store a block of samples, ``values`` having shape (n_samples, n_channels),
+        starting at the given sample index.
+        """
+        count = len(timestamps)
+        if count == 0:
+            return
+
+        if len(self) == 0:
+            self.start_index = index
+        elif index != self.end_index:
+            self._restart(index)
+
+        # Only the newest `capacity` samples can survive the write
+        skip = max(0, count - self.capacity)
+        positions = (np.arange(index + skip, index + count)) % self.capacity
+
+        self._data[positions] = values[skip:]
+        self._data[positions + self.capacity] = values[skip:]
+        self._times[positions] = timestamps[skip:]
+        self._times[positions + self.capacity] = timestamps[skip:]
+
+        self.end_index = index + count
+        self.start_index = max(self.start_index, self.end_index - self.capacity)
+
+    def window(self, start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return ``(timestamps, values)`` views for the samples in ``[start, stop)``.
+        Raises ValueError if part of the window was overwritten or not received yet.
+        """
+        if start < self.start_index or stop > self.end_index or start > stop:
+            raise ValueError(
+                f"Window [{start}, {stop}) is outside of the buffered "
+                f"range [{self.start_index}, {self.end_index})."
+            )
+
+        pos = start % self.capacity
+        length = stop - start
+
+        return self._times[pos:pos + length], self._data[pos:pos + length]
+
+    def _restart(self, index: int) -> None:
+        # The stream is not contiguous anymore (gap or restart), samples from
+        # before the discontinuity can't be addressed by index any longer.
+        self.start_index = index
+        self.end_index = index
@@ -0,0 +1,153 @@
+import time
+
+import numpy as np
+
+
+class SampleClock:
+    """
+    Clock model of a digitizer: the time of every sample from its index.
+
+    The MCU samples at a steady (but not exactly nominal) rate and the host receives
+    the samples in blocks, late by the USB/serial latency. Once per block the index of
+    the last sample and its arrival time (monotonic clock) are fed to an exponentially
+    weighted linear fit, whose slope is the actual sample period: the jitter of the
+    arrivals averages out over `time_constant` seconds and the drift of the MCU
+    oscillator is followed.
+
+    The published times never jump with the fit: they run at a period steered toward
+    the fit (by at most `max_slew` of it) so that they converge to it within
+    `slew_time` seconds, like a slewing NTP clock. Wall times are the monotonic times
+    plus the current offset of the system clock, so NTP steps show up in them.
+
+    An arrival further than `step_threshold` seconds from the fit on `confirm`
+    consecutive blocks (lost samples, a stalled MCU) re-anchors the model on the
+    latest block: `update` then returns the step, positive when the samples came
+    later than expected.
+    """
+    def __init__(
+        self,
+        sampling_rate: float,
+        time_constant: float = 60.0,
+        slew_time: float = 10.0,
+        max_drift: float = 0.01,
+        max_slew: float = 0.001,
+        step_threshold: float = 0.1,
+        confirm: int = 3
+    ):
+        self.sampling_rate = sampling_rate
+        self.nominal_period = 1.0 / sampling_rate
+        self.period = self.nominal_period
+        self.time_constant = time_constant
+        self.slew_samples = slew_time * sampling_rate
+        self.max_drift = max_drift
+        self.max_slew = max_slew
+        self.step_threshold = step_threshold
+        self.confirm = confirm
+
+        # Anchor of the fit: sample index and monotonic time, the fitted line goes
+        # through the weighted means (relative to the anchor)
+        self._index = None
+        self._time = 0.0
+        self._mean_x = 0.0
+        self._mean_y = 0.0
+        self._var_x = 0.0
+        self._cov_xy = 0.0
+        self._last_x = 0.0
+
+        # Published line: a sample index, its monotonic time and the period from there
+        self._published_index = 0
+        self._published_time = 0.0
+        self._published_period = self.nominal_period
+        # Last sample of the previous block, where the published line pivots
+        self._last_index = None
+
+        self._outliers = 0
+        self._wall_offset = time.time() - time.monotonic()
+
+    @property
+    def synchronized(self) -> bool:
+        return self._index is not None
+
+    def anchor(self, index: int, received_at: float):
+        """Restarts the fit from a sample index and its monotonic arrival time, keeping the period."""
+        self._index = index
+        self._time = received_at
+        self._mean_x = self._mean_y = 0.0
+        self._var_x = self._cov_xy = 0.0
+        self._last_x = 0.0
+        self._outliers = 0
+
+        self._published_index = self._last_index = index
+        self._published_time = received_at
+        self._published_period = self.period
+        self._wall_offset = time.time() - time.monotonic()
+
+    def predict(self, index: int) -> float:
+        """Monotonic time of a sample index on the fitted line."""
+        return self._time + self._mean_y + (index - self._index - self._mean_x) * self.period
+
+    def update(self, index: int, received_at: float) -> float:
+        """
+        Feeds the index of the last sample of a block and its monotonic arrival time.
+        Returns the step in seconds when the model was re-anchored, 0 otherwise.
+        """
+        if self._index is None:
+            self.anchor(index, received_at)
+            return 0.0
+
+        error = received_at - self.predict(index)
+        if abs(error) > self.step_threshold:
+            # A single late block is a latency spike, a lasting error a discontinuity
+            self._outliers += 1
+            if self._outliers < self.confirm:
+                self._pivot(index)
+                return 0.0
+
+            self.anchor(index, received_at)
+            return error
+        self._outliers = 0
+
+        x = float(index - self._index)
+        y = received_at - self._time
+
+        # Each block weighs as much as the time it covers
+        weight = min(1.0, max(x - self._last_x, 1.0) * self.nominal_period / self.time_constant)
+        self._last_x = x
+
+        dx = x - self._mean_x
+        dy = y - self._mean_y
+        self._mean_x += weight * dx
+        self._mean_y += weight * dy
+        self._var_x = (1 - weight) * (self._var_x + weight * dx * dx)
+        self._cov_xy = (1 - weight) * (self._cov_xy + weight * dx * dy)
+
+        # The slope is only meaningful once the blocks span a few seconds
+        if self._var_x * self.nominal_period ** 2 > 1.0:
+            self.period = min(
+                max(self._cov_xy / self._var_x, self.nominal_period * (1 - self.max_drift)),
+                self.nominal_period * (1 + self.max_drift)
+            )
+
+        self._pivot(index)
+        return 0.0
+
+    def _pivot(self, index: int):
+        """Moves the published line to the last published sample and steers it toward the fit."""
+        self._wall_offset = time.time() - time.monotonic()
+
+        self._published_time += (self._last_index - self._published_index) * self._published_period
+        self._published_index = self._last_index
+        self._last_index = index
+
+        # Period reaching the fitted line `slew_samples` from now
+        target = self._published_index + self.slew_samples
+        period = (self.predict(target) - self._published_time) / self.slew_samples
+        self._published_period = min(
+            max(period, self.period * (1 - self.max_slew)),
+            self.period * (1 + self.max_slew)
+        )
+
+    def timestamps(self, first_index: int, count: int) -> np.ndarray:
+        """Wall times (UNIX seconds) of `count` samples from `first_index`."""
+        offsets = np.arange(first_index - self._published_index, first_index - self._published_index + count)
+        return self._wall_offset + self._published_time + offsets * self._published_period
@@ -0,0 +1,87 @@
+from queue import Queue, Empty
+import time
+
+from src.utils.metrics import REGISTRY, Counter
+
+
+class _Token:
+    """Control item put in a job queue alongside the packets."""
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+# Put in every consumer queue once the sources stopped: the job processes the packets
+# queued before it, then stops
+SHUTDOWN = _Token("SHUTDOWN")
+# Wakes up a blocked job without data (new settings, a trigger record)
+WAKEUP = _Token("WAKEUP")
+
+
+def wakeup_counters(stage: str, **labels: str) -> dict[str, Counter]:
+    """Counters of the returns of the blocking waits of a stage, by reason."""
+    return {
+        reason: REGISTRY.counter(
+            "rpi_seism_wakeups_total", "Returns of the blocking waits of each stage, by reason",
+            stage=stage, reason=reason, **labels
+        )
+        for reason in ("data", "deadline", "wakeup")
+    }
+
+
+class Inbox:
+    """
+    Blocking side of a consumer queue: `get` sleeps until packets arrive, the next
+    deadline of the job is due, the job is woken up or the pipeline shuts down. No
+    polling timer is involved, so a job wakes up once per block of samples and not at
+    all when nothing happens.
+
+    Deadlines are `time.monotonic()` values. Every return of `get` is counted in
+    `rpi_seism_wakeups_total{stage, reason}`: "data", "deadline" or "wakeup".
+    """
+    def __init__(self, queue: Queue, stage: str):
+        self.queue = queue
+        # Set when the SHUTDOWN token is reached
+        self.closed = False
+
+        self._wakeups = wakeup_counters(stage)
+
+    def get(self, deadline: float | None = None, limit: int = 1000) -> list:
+        """
+        Blocks until packets are queued or `deadline` passes, returns the packets
+        waiting (at most `limit`, so a backlog doesn't delay the deadlines), an empty
+        list on a deadline or a wakeup.
+        """
+        if self.closed:
+            return []
+
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            item = self.queue.get(timeout=timeout)
+        except Empty:
+            self._wakeups["deadline"].inc()
+            return []
+
+        packets = []
+        while True:
+            if item is SHUTDOWN:
+                self.closed = True
+                break
+            if item is not WAKEUP:
+                packets.append(item)
+                if len(packets) >= limit:
+                    break
+
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                break
+
+        self._wakeups["data" if packets or self.closed else "wakeup"].inc()
+        return packets
+
+    def wake(self):
+        """Makes a blocked `get` return, from any thread."""
+        self.queue.put(WAKEUP)